@@ -0,0 +1,114 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Event loop lag while normalizing pages of statuses in the event loop and
+in ``NormalizerPool`` worker processes.
+
+A probe coroutine sleeps repeatedly and records how late it wakes up while
+several coroutines normalize pages as fast as they can, like the trend
+coroutines do during a spike.
+
+Usage: ``python -m benchmarks.event_loop_lag --workers 0 1 2 4``
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks._common import Timer
+from benchmarks.normalize import PAGE_SIZE, make_fixture
+from sento_crawler.normalizer import NormalizerPool, status_records
+
+PROBE_INTERVAL = 0.005
+
+
+async def _probe(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def _produce(normalizer, pages):
+    while pages:
+        await normalizer.normalize(pages.pop(), '#trend', 1)
+        # Stands for the search request made between pages
+        await asyncio.sleep(0)
+
+
+async def _run(workers, records, concurrency):
+    normalizer = NormalizerPool(workers, concurrency)
+    # Starts the worker processes before measuring
+    await normalizer.normalize(records[:PAGE_SIZE], '#trend', 1)
+
+    pages = [
+        records[i:i + PAGE_SIZE]
+        for i in range(0, len(records), PAGE_SIZE)
+    ]
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.ensure_future(_probe(lags, stop))
+
+    with Timer() as timer:
+        await asyncio.gather(
+            *(_produce(normalizer, pages) for _ in range(concurrency))
+        )
+
+    stop.set()
+    await probe
+    normalizer.close()
+
+    lags.sort()
+    print(
+        f'{workers:>7} {len(records) / timer.elapsed:>12.0f} '
+        f'{statistics.median(lags) * 1000:>9.2f} '
+        f'{lags[int(len(lags) * 0.99)] * 1000:>9.2f} '
+        f'{lags[-1] * 1000:>9.2f}'
+    )
+
+
+def _use_slow_dates(statuses):
+    # Dates with an offset other than +0000 go through dateutil's parser
+    for status in statuses:
+        status['created_at'] = status['created_at'].replace('+0000', '+0100')
+
+
+async def run(args):
+    statuses = make_fixture(args.statuses)
+    if args.slow_dates:
+        _use_slow_dates(statuses)
+
+    print('workers   status/s  lag p50 ms  p99 ms    max ms')
+    for workers in args.workers:
+        await _run(workers, status_records(statuses), args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--statuses', type=int, default=50000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument(
+        '--slow-dates',
+        action='store_true',
+        help='Force the dateutil parser, as before the fast date path'
+    )
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
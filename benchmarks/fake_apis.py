@@ -0,0 +1,455 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Local stand-in for the Twitter and Nominatim endpoints used by the
+crawler, serving synthetic or recorded data with configurable latency,
+errors and rate limits.
+
+Usage: ``python -m benchmarks.fake_apis --port 8089``
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from aiohttp import web
+
+TWITTER_DATE_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+_WORDS = (
+    'el', 'la', 'de', 'que', 'y', 'en', 'un', 'por', 'con', 'para',
+    'gobierno', 'partido', 'hoy', 'mañana', 'fútbol', 'gol', 'directo'
+)
+
+
+class _Timeline:
+    """Statuses of a search query, they keep arriving at a constant rate
+    since the server started."""
+
+    def __init__(self, backlog, rate, start):
+        self.backlog = backlog
+        self.rate = rate
+        self.start = start
+        self.ids = []
+        self.created = []
+
+
+class FakeApis:
+    """Stand-in server for the ``trends/available``, ``trends/place``,
+    ``search/tweets`` and Nominatim ``search`` endpoints.
+
+    Parameters
+    ----------
+    parent_woeid : int
+        WOEID of the country every location belongs to.
+    locations : int
+        Number of locations with trends.
+    trends_per_location : int
+        Number of trends in each location, taken from a pool shared by
+        every location so the same topic trends in several of them.
+    backlog : int
+        Statuses available for each query when the server starts.
+    statuses_rate : float
+        Statuses per second arriving to each query of a topic ranked first.
+    latency : float
+        Mean seconds added to every response.
+    jitter : float
+        Maximum deviation in seconds from the mean latency.
+    error_rate : float
+        Probability of answering a request with a 503 error.
+    search_limit : int
+        search/tweets requests allowed in each rate limit window.
+    window : int
+        Duration of the rate limit window in seconds.
+    templates : list of dict, optional
+        Recorded statuses whose text and entities are reused.
+    seed : int
+        Seed of the random number generator.
+    rate_skew : float
+        The statuses of a topic whose best rank is ``r`` arrive at
+        ``statuses_rate / r ** rate_skew``, 0 for the same rate in every
+        topic.
+    """
+
+    def __init__(self, parent_woeid=23424950, locations=10,
+                 trends_per_location=50, backlog=300, statuses_rate=0.5,
+                 latency=0.05, jitter=0.02, error_rate=0.0,
+                 search_limit=450, window=900, templates=None, seed=0,
+                 rate_skew=0.):
+        self.parent_woeid = parent_woeid
+        self.locations = locations
+        self.trends_per_location = trends_per_location
+        self.backlog = backlog
+        self.statuses_rate = statuses_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.search_limit = search_limit
+        self.window = window
+        self.templates = templates
+        self.rate_skew = rate_skew
+        self.calls = Counter()
+        self.rejected = Counter()
+
+        self._random = random.Random(seed)
+        self._start = time.time()
+        self._next_id = 10 ** 18
+        self._timelines = {}
+        self._windows = {}
+        self._runner = None  # type: web.AppRunner
+
+        topics = [
+            f'#Tema{i}' if i % 3 else f'Tema {i}'
+            for i in range(trends_per_location * 2)
+        ]
+        self._trends = {
+            woeid: self._random.sample(topics, trends_per_location)
+            for woeid in self._location_woeids()
+        }
+
+        # Best rank of each topic, by name and by its query
+        self._best_ranks = {}
+        for names in self._trends.values():
+            for idx, name in enumerate(names):
+                for key in (name, quote(name)):
+                    self._best_ranks[key] = min(
+                        self._best_ranks.get(key, idx + 1),
+                        idx + 1
+                    )
+
+    def app(self):
+        app = web.Application(middlewares=[self._inject_faults])
+        app.router.add_get('/1.1/trends/available.json', self._available)
+        app.router.add_get('/1.1/trends/place.json', self._place)
+        app.router.add_get('/1.1/search/tweets.json', self._search)
+        app.router.add_post('/oauth2/token', self._token)
+        app.router.add_get('/search', self._nominatim)
+        return app
+
+    async def start(self, host='127.0.0.1', port=8089):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _location_woeids(self):
+        return [766273 + i for i in range(self.locations)]
+
+    @web.middleware
+    async def _inject_faults(self, request, handler):
+        self.calls[request.path] += 1
+
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self._random.random() < self.error_rate:
+            return web.json_response(
+                {'errors': [{'code': 130, 'message': 'Over capacity'}]},
+                status=503
+            )
+
+        return await handler(request)
+
+    def _rate_limit(self, request, limit):
+        """Returns the rate limit headers of the request's endpoint and
+        whether the request exceeds the limit."""
+        now = time.time()
+        # Like Twitter's, each application token has its own windows
+        key = (request.headers.get('Authorization'), request.path)
+        reset, remaining = self._windows.get(key, (0, 0))
+
+        if now >= reset:
+            reset, remaining = now + self.window, limit
+
+        exceeded = remaining == 0
+        remaining = max(remaining - 1, 0)
+        self._windows[key] = (reset, remaining)
+
+        headers = {
+            'x-rate-limit-limit': str(limit),
+            'x-rate-limit-remaining': str(remaining),
+            'x-rate-limit-reset': str(int(reset))
+        }
+
+        if exceeded:
+            self.rejected[request.path] += 1
+
+        return headers, exceeded
+
+    def _rate_limited(self, headers):
+        return web.json_response(
+            {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]},
+            status=429,
+            headers=headers
+        )
+
+    async def _token(self, request):
+        return web.json_response(
+            {'token_type': 'bearer', 'access_token': 'fake-token'}
+        )
+
+    async def _available(self, request):
+        headers, exceeded = self._rate_limit(request, 75)
+        if exceeded:
+            return self._rate_limited(headers)
+
+        return web.json_response(
+            [
+                {
+                    'name': f'Ciudad {woeid}',
+                    'placeType': {'code': 7, 'name': 'Town'},
+                    'url': f'http://where.yahooapis.com/v1/place/{woeid}',
+                    'parentid': self.parent_woeid,
+                    'country': 'Spain',
+                    'woeid': woeid,
+                    'countryCode': 'ES'
+                }
+                for woeid in self._location_woeids()
+            ],
+            headers=headers
+        )
+
+    async def _place(self, request):
+        headers, exceeded = self._rate_limit(request, 75)
+        if exceeded:
+            return self._rate_limited(headers)
+
+        woeid = int(request.query['id'])
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        return web.json_response(
+            [{
+                'trends': [
+                    {
+                        'name': name,
+                        'url': f'http://twitter.com/search?q={quote(name)}',
+                        'promoted_content': None,
+                        'query': quote(name),
+                        'tweet_volume': (
+                            self._random.randint(10000, 500000)
+                            if idx < 10 else None
+                        )
+                    }
+                    for idx, name in enumerate(self._trends[woeid])
+                ],
+                'as_of': now,
+                'created_at': now,
+                'locations': [{'name': f'Ciudad {woeid}', 'woeid': woeid}]
+            }],
+            headers=headers
+        )
+
+    async def _search(self, request):
+        headers, exceeded = self._rate_limit(request, self.search_limit)
+        if exceeded:
+            return self._rate_limited(headers)
+
+        query = request.query
+        timeline = self._get_timeline(query['q'])
+        since_id = int(query.get('since_id', 0))
+        max_id = int(query.get('max_id', 2 ** 63 - 1))
+        count = int(query.get('count', 15))
+
+        first = bisect.bisect_right(timeline.ids, since_id)
+        last = bisect.bisect_right(timeline.ids, max_id)
+        indexes = range(last - 1, max(first, last - count) - 1, -1)
+
+        statuses = [
+            self._make_status(timeline.ids[i], timeline.created[i])
+            for i in indexes
+        ]
+
+        return web.json_response(
+            {
+                'statuses': statuses,
+                'search_metadata': {
+                    'count': count,
+                    'since_id': since_id,
+                    'max_id': statuses[0]['id'] if statuses else 0,
+                    'query': query['q']
+                }
+            },
+            headers=headers
+        )
+
+    async def _nominatim(self, request):
+        name = request.query.get('city', '')
+        lon = self._random.uniform(-8, 3)
+        lat = self._random.uniform(36, 43)
+        size = 0.05
+
+        return web.json_response([{
+            'place_id': abs(hash(name)) % 10 ** 8,
+            'display_name': f'{name}, Spain',
+            'lat': str(lat),
+            'lon': str(lon),
+            'geojson': {
+                'type': 'Polygon',
+                'coordinates': [[
+                    [lon - size, lat - size],
+                    [lon + size, lat - size],
+                    [lon + size, lat + size],
+                    [lon - size, lat + size],
+                    [lon - size, lat - size]
+                ]]
+            }
+        }])
+
+    def _get_timeline(self, query):
+        timeline = self._timelines.get(query)
+        if timeline is None:
+            rate = (
+                self.statuses_rate
+                / self._best_ranks.get(query, 1) ** self.rate_skew
+            )
+            timeline = _Timeline(self.backlog, rate, time.time())
+            self._timelines[query] = timeline
+
+        # Add the statuses that have arrived since the last request
+        elapsed = time.time() - timeline.start
+        expected = timeline.backlog + int(elapsed * timeline.rate)
+        while len(timeline.ids) < expected:
+            self._next_id += self._random.randint(1, 1000)
+            timeline.ids.append(self._next_id)
+            timeline.created.append(time.time())
+
+        return timeline
+
+    def _make_status(self, status_id, created):
+        if self.templates:
+            template = self.templates[status_id % len(self.templates)]
+            text = template.get('full_text') or template.get('text', '')
+            entities = template.get('entities', {})
+        else:
+            text = ' '.join(
+                self._random.choice(_WORDS)
+                for _ in range(self._random.randint(8, 30))
+            )
+            url = f'https://t.co/{status_id % 16 ** 10:010x}'
+            start = len(text) + 1
+            text = f'{text} {url}'
+            entities = {
+                'hashtags': [],
+                'symbols': [],
+                'user_mentions': [],
+                'urls': [{
+                    'url': url,
+                    'expanded_url': 'https://example.com/noticia',
+                    'display_url': 'example.com/noticia',
+                    'indices': [start, start + len(url)]
+                }]
+            }
+
+        user_id = status_id % 100000
+        return {
+            'created_at': datetime.fromtimestamp(created, timezone.utc)
+            .strftime(TWITTER_DATE_FORMAT),
+            'id': status_id,
+            'id_str': str(status_id),
+            'full_text': text,
+            'truncated': False,
+            'display_text_range': [0, len(text)],
+            'entities': entities,
+            'metadata': {'iso_language_code': 'es', 'result_type': 'recent'},
+            'source': '<a href="https://mobile.twitter.com">Twitter Web</a>',
+            'user': {
+                'id': user_id,
+                'id_str': str(user_id),
+                'name': f'Usuario {user_id}',
+                'screen_name': f'usuario{user_id}',
+                'location': 'España',
+                'description': 'Perfil de prueba',
+                'followers_count': user_id % 5000,
+                'friends_count': user_id % 700,
+                'created_at': 'Mon Jan 01 00:00:00 +0000 2018',
+                'profile_image_url_https': 'https://pbs.twimg.com/x.jpg'
+            },
+            'geo': None,
+            'coordinates': None,
+            'place': None,
+            'is_quote_status': False,
+            'retweet_count': 0,
+            'favorite_count': 0,
+            'favorited': False,
+            'retweeted': False,
+            'lang': 'es'
+        }
+
+
+def load_templates(path):
+    """Loads recorded statuses from a JSON-lines file."""
+    with open(path, encoding='utf-8') as fixture:
+        return [json.loads(line) for line in fixture if line.strip()]
+
+
+def add_arguments(parser):
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--trends', type=int, default=50)
+    parser.add_argument('--backlog', type=int, default=300)
+    parser.add_argument('--statuses-rate', type=float, default=0.5)
+    parser.add_argument('--rate-skew', type=float, default=0.)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--search-limit', type=int, default=450)
+    parser.add_argument('--window', type=int, default=900)
+    parser.add_argument('--fixture', help='JSON-lines file with statuses')
+
+
+def from_arguments(args, parent_woeid):
+    return FakeApis(
+        parent_woeid=parent_woeid,
+        locations=args.locations,
+        trends_per_location=args.trends,
+        backlog=args.backlog,
+        statuses_rate=args.statuses_rate,
+        rate_skew=args.rate_skew,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        search_limit=args.search_limit,
+        window=args.window,
+        templates=load_templates(args.fixture) if args.fixture else None
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--parent-woeid', type=int, default=23424950)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(
+        from_arguments(args, args.parent_woeid).app(),
+        host=args.host,
+        port=args.port
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Measures the latency of geocoding a burst of new locations with a
+throwaway session per lookup and with the shared HTTP transport.
+
+The lookups go to the stand-in Nominatim endpoint by default. Pass
+``--url`` with a real Nominatim search URL to include the DNS resolutions
+and TLS handshakes, keeping ``--locations`` low to respect its usage
+policy.
+
+Usage: ``python -m benchmarks.geocoder_cold_start --locations 50``
+"""
+
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+from benchmarks import fake_apis
+from sento_crawler import transport
+from sento_crawler.geocoder import USER_AGENT
+
+
+async def _lookup(session, url, idx):
+    params = {'format': 'json', 'city': f'Location {idx}', 'limit': 1}
+    async with session.get(
+        url,
+        params=params,
+        headers={'User-Agent': USER_AGENT}
+    ) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+async def throwaway_sessions(url, locations):
+    # One session per lookup, as the geocoder used to do
+    latencies = []
+    for idx in range(locations):
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            await _lookup(session, url, idx)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def shared_transport(url, locations):
+    latencies = []
+    for idx in range(locations):
+        start = time.perf_counter()
+        await _lookup(transport.get_session(), url, idx)
+        latencies.append(time.perf_counter() - start)
+    stats = transport.get_stats()
+    await transport.close_session()
+    return latencies, stats
+
+
+def _report(name, latencies):
+    latencies = sorted(latencies)
+    print(
+        f'{name:<20} total {sum(latencies):>8.3f} s   '
+        f'p50 {latencies[len(latencies) // 2] * 1000:>8.2f} ms   '
+        f'max {latencies[-1] * 1000:>8.2f} ms'
+    )
+
+
+async def run(args):
+    apis = None
+    url = args.url
+    if url is None:
+        apis = fake_apis.FakeApis(latency=args.latency, jitter=0)
+        await apis.start(port=args.port)
+        # Looked up by name so the addresses are resolved as well
+        url = f'http://localhost:{args.port}/search'
+
+    latencies = await throwaway_sessions(url, args.locations)
+    _report('Throwaway sessions', latencies)
+    latencies, stats = await shared_transport(url, args.locations)
+    _report('Shared transport', latencies)
+
+    reused = stats.get('connections_reused', 0)
+    print(
+        f'Connections reused {reused} of '
+        f'{reused + stats.get("connections_new", 0)}, '
+        f'DNS resolutions {stats.get("dns_resolved", 0)}'
+    )
+
+    if apis is not None:
+        await apis.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--url')
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
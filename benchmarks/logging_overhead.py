@@ -0,0 +1,157 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Measures the logging overhead of each stored status, replaying the
+logging calls made while crawling trends through the queue handler and
+listener used by the crawler, writing to ``/dev/null``.
+
+The time spent in the crawling coroutines and the total time until the
+listener thread has written every record are reported separately.
+
+Usage: ``python -m benchmarks.logging_overhead --visits 20000``
+"""
+
+import argparse
+import logging
+import os
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+
+from sento_crawler.logger import (LOG_FORMAT, LOG_FORMAT_NO_CALLER,
+                                  CallSiteQueueHandler, CallSiteSampler,
+                                  JsonFormatter, set_caller_lookup)
+
+STATUSES_PER_PAGE = 100
+
+# name, logger level, output level, format, caller info, sample limit,
+# per-page records
+SCENARIOS = (
+    ('per-page records, DEBUG dropped at output', logging.DEBUG,
+     logging.INFO, 'text', True, 0, True),
+    ('per-page records, DEBUG written', logging.DEBUG,
+     logging.DEBUG, 'text', True, 0, True),
+    ('per-visit records, INFO', logging.INFO,
+     logging.INFO, 'text', True, 0, False),
+    ('per-visit records, DEBUG written', logging.DEBUG,
+     logging.DEBUG, 'text', True, 0, False),
+    ('per-visit records, DEBUG json sampled', logging.DEBUG,
+     logging.DEBUG, 'json', False, 10, False),
+)
+
+
+def _crawl_per_page(logger, visits, pages):
+    # Logging calls made by _get_tweets_from_trend before the summaries
+    params = {'q': '#trend', 'geocode': '40.4,-3.7,20km', 'count': 100}
+    for visit in range(visits):
+        logger.debug(
+            'Extracting tweets from trend "%s" written in %s since %s',
+            '#trend', 'Madrid', visit
+        )
+        for _ in range(pages):
+            logger.debug(
+                'Buffering tweets from search request to "%s" in %s',
+                '#trend', 'Madrid'
+            )
+        logger.debug(
+            'No more tweets from trend "%s" written in %s. '
+            'Parameters used in request: %s',
+            '#trend', 'Madrid', params
+        )
+
+
+def _crawl_per_visit(logger, visits, pages):
+    for visit in range(visits):
+        logger.debug(
+            'Extracted %d statuses in %d pages from trend "%s" in %s '
+            'since %s',
+            pages * STATUSES_PER_PAGE, pages, '#trend', 'Madrid', visit,
+            extra={
+                'trend': '#trend',
+                'woeid': 766273,
+                'pages': pages,
+                'statuses': pages * STATUSES_PER_PAGE,
+                'kept': pages * STATUSES_PER_PAGE
+            }
+        )
+
+
+def run_scenario(scenario, visits, pages):
+    (_, level, out_level, fmt, caller_info, sample_limit,
+     per_page) = scenario
+
+    devnull = open(os.devnull, 'w')
+    out_handler = logging.StreamHandler(devnull)
+    out_handler.setLevel(out_level)
+    if fmt == 'json':
+        out_handler.setFormatter(JsonFormatter(caller_info))
+    else:
+        out_handler.setFormatter(logging.Formatter(
+            LOG_FORMAT if caller_info else LOG_FORMAT_NO_CALLER
+        ))
+    if sample_limit:
+        out_handler.addFilter(CallSiteSampler(sample_limit, 60))
+
+    log_queue = Queue(-1)
+    # The crawler used a plain queue handler before sampling call sites
+    queue_handler = (
+        CallSiteQueueHandler(log_queue) if sample_limit
+        else QueueHandler(log_queue)
+    )
+    listener = QueueListener(
+        log_queue,
+        out_handler,
+        respect_handler_level=True
+    )
+
+    logger = logging.getLogger('sento-crawler-benchmark')
+    set_caller_lookup(logger, caller_info)
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+    logger.setLevel(level)
+
+    listener.start()
+    start = time.perf_counter()
+    crawl = _crawl_per_page if per_page else _crawl_per_visit
+    crawl(logger, visits, pages)
+    producer = time.perf_counter() - start
+    listener.stop()
+    total = time.perf_counter() - start
+
+    devnull.close()
+
+    return producer, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--visits', type=int, default=20000)
+    parser.add_argument('--pages', type=int, default=3)
+    args = parser.parse_args()
+
+    statuses = args.visits * args.pages * STATUSES_PER_PAGE
+    print(
+        f'{"Scenario":<40} {"crawl us/status":>16} {"total us/status":>16}'
+    )
+    for scenario in SCENARIOS:
+        producer, total = run_scenario(scenario, args.visits, args.pages)
+        print(
+            f'{scenario[0]:<40} {producer / statuses * 1e6:>16.3f} '
+            f'{total / statuses * 1e6:>16.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Per-status cost of building ``data.statuses`` rows, comparing the
+former row builder with ``normalizer.normalize_statuses``.
+
+Usage: ``python -m benchmarks.normalize``
+"""
+
+import random
+import re
+from datetime import datetime
+
+from dateutil import parser, tz
+
+from benchmarks._common import Timer
+from sento_crawler.normalizer import normalize_statuses
+
+FIXTURE_SIZE = 100000
+PAGE_SIZE = 100
+
+_OLD_URL_REGEX = (
+    r'[(http(s)?):\/\/(www\.)?a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b'
+    r'([-a-zA-Z0-9@:%_\+.~#?&//=]*)'
+)
+
+_WORDS = (
+    'el', 'la', 'de', 'que', 'y', 'en', 'un', 'por', 'con', 'para',
+    'gobierno', 'partido', 'hoy', 'mañana', 'fútbol', 'gol', 'directo'
+)
+
+
+def make_fixture(size, seed=0):
+    """Builds synthetic statuses shaped like the ones in search responses,
+    half of them with a link."""
+    rnd = random.Random(seed)
+    statuses = []
+
+    for i in range(size):
+        text = ' '.join(rnd.choice(_WORDS) for _ in range(rnd.randint(8, 30)))
+        entities = {'urls': [], 'hashtags': [], 'user_mentions': []}
+
+        if i % 2:
+            url = f'https://t.co/{rnd.getrandbits(40):010x}'
+            start = len(text) + 1
+            text = f'{text} {url}'
+            entities['urls'].append({
+                'url': url,
+                'expanded_url': 'https://example.com/news',
+                'indices': [start, start + len(url)]
+            })
+
+        statuses.append({
+            'id': 10 ** 18 + i,
+            'created_at': 'Wed Mar 13 12:{:02d}:{:02d} +0000 2019'.format(
+                i // 60 % 60, i % 60
+            ),
+            'text': text,
+            'entities': entities
+        })
+
+    return statuses
+
+
+def _old_build_status_rows(tweets, trend_id, woeid):
+    return [
+        (
+            x['id'],
+            parser.parse(x['created_at']).astimezone(tz.tzutc())
+            .replace(tzinfo=None),
+            datetime.utcnow(),
+            re.sub(_OLD_URL_REGEX, '', x['text']),
+            trend_id,
+            woeid
+        )
+        for x in tweets
+    ]
+
+
+def _run(name, build_rows, statuses):
+    with Timer() as timer:
+        for i in range(0, len(statuses), PAGE_SIZE):
+            build_rows(statuses[i:i + PAGE_SIZE], '#trend', 1)
+
+    print(
+        f'{name:<10} {timer.elapsed:>8.2f} s '
+        f'{timer.elapsed / len(statuses) * 10 ** 6:>8.2f} µs/status'
+    )
+
+
+def main():
+    statuses = make_fixture(FIXTURE_SIZE)
+    _run('before', _old_build_status_rows, statuses)
+    _run('after', normalize_statuses, statuses)
+
+
+if __name__ == '__main__':
+    main()
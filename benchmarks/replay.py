@@ -0,0 +1,208 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""End-to-end benchmark running the crawler tasks against the stand-in
+Twitter and Nominatim server and a local PostgreSQL with PostGIS.
+
+The rest of the settings are read from ``config.ini`` as usual. With
+``--uniform`` every trend is revisited with the same frequency regardless
+of its score, as a baseline for the prioritization.
+
+Usage: ``python -m benchmarks.replay --duration 120``
+"""
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from peony.oauth import OAuth2Headers
+
+from benchmarks import fake_apis
+from benchmarks._common import create_pool, truncate
+from sento_crawler import model, transport
+from sento_crawler.client import TwitterClient
+from sento_crawler.settings import get_config
+
+MODEL_METHODS = (
+    'store_trends_batch',
+    'store_statuses',
+    'store_location',
+    'get_rankings_since',
+    'get_locations_info',
+    'get_location_ids',
+    'get_checkpoints'
+)
+
+db_time = Counter()
+db_calls = Counter()
+
+
+class ReplayClient(TwitterClient):
+    async def _get_twitter_configuration(self):
+        # The stand-in server does not serve help/configuration, which
+        # peony requests from the real API
+        return {}
+
+
+def _timed(name, method):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            db_time[name] += time.perf_counter() - start
+            db_calls[name] += 1
+    return wrapper
+
+
+def _instrument():
+    for name in MODEL_METHODS:
+        setattr(model.Model, name, _timed(name, getattr(model.Model, name)))
+
+
+async def run(args):
+    config = get_config()
+    apis = fake_apis.from_arguments(args, config.SEARCH_WOEIDS[0])
+    base_url = await apis.start(port=args.port)
+
+    config.GEOCODER_NOMINATIM_URL = f'{base_url}/search'
+    config.GEOCODER_CACHE_PATH = ':memory:'
+    config.PRIORITY_MIN_REVISIT = args.min_revisit
+    if args.uniform:
+        config.PRIORITY_EXPLORATION_SHARE = 1
+    config.SEARCH_RATE_LIMIT = args.search_limit
+    config.SEARCH_RATE_LIMIT_WINDOW = args.window
+    config.NORMALIZER_WORKERS = args.normalizer_workers
+
+    pool = await create_pool(postgis=True)
+    await truncate(
+        pool,
+        'data.statuses',
+        'data.checkpoints',
+        'data.rankings',
+        'data.topics',
+        'data.locations',
+        'data.location_bounds'
+    )
+    model._conn_pool = pool
+    _instrument()
+
+    clients = [
+        ReplayClient(
+            consumer_key='fake',
+            consumer_secret='fake',
+            bearer_token=f'fake-token-{idx}',
+            auth=OAuth2Headers,
+            base_url=base_url + '/{version}'
+        )
+        for idx in range(args.credentials)
+    ]
+    client = clients[0]
+    await client.create(clients)
+
+    start = time.perf_counter()
+    tasks = asyncio.ensure_future(client.run_tasks())
+    await asyncio.sleep(args.duration)
+    tasks.cancel()
+    await asyncio.gather(tasks, return_exceptions=True)
+    await client.status_buffer.close()
+    elapsed = time.perf_counter() - start
+
+    await client.geocoder.close()
+    client.normalizer.close()
+    if client.archive is not None:
+        client.archive.close()
+    for search_client in clients:
+        await search_client.close()
+    http_stats = transport.get_stats()
+    await transport.close_session()
+
+    async with pool.acquire() as conn:
+        stored = await conn.fetchval('SELECT count(*) FROM data.statuses')
+
+    await pool.close()
+    await apis.stop()
+
+    api_calls = sum(
+        calls for path, calls in apis.calls.items()
+        if path.startswith('/1.1/')
+    )
+    search_calls = apis.calls['/1.1/search/tweets.json']
+    total_db_time = sum(db_time.values())
+    trends_cycles = db_calls['store_trends_batch'] or 1
+
+    print(f'Duration                    {elapsed:>12.1f} s')
+    print(f'Statuses stored             {stored:>12}')
+    print(f'Statuses per second         {stored / elapsed:>12.1f}')
+    print(f'Twitter API calls           {api_calls:>12}')
+    print(f'search/tweets calls         {search_calls:>12}')
+    print(
+        'Stored statuses per search  '
+        f'{stored / search_calls if search_calls else 0:>12.2f}'
+    )
+    print(f'Rate limited calls          {sum(apis.rejected.values()):>12}')
+    print(
+        'API calls per stored status '
+        f'{api_calls / stored if stored else float("inf"):>12.3f}'
+    )
+    print(
+        'HTTP connections reused     '
+        f'{http_stats.get("connections_reused", 0):>12}'
+    )
+    print(
+        'HTTP connections opened     '
+        f'{http_stats.get("connections_new", 0):>12}'
+    )
+    print(f'DB time                     {total_db_time:>12.2f} s')
+    print(
+        'DB time per trends cycle    '
+        f'{total_db_time / trends_cycles:>12.3f} s'
+    )
+    print(
+        'DB time per 1000 statuses   '
+        f'{total_db_time / stored * 1000 if stored else 0:>12.3f} s'
+    )
+    for name, seconds in db_time.most_common():
+        print(f'  {name:<25} {seconds:>12.2f} s {db_calls[name]:>8} calls')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=120)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--credentials', type=int, default=1)
+    parser.add_argument(
+        '--normalizer-workers',
+        type=int,
+        default=get_config().NORMALIZER_WORKERS
+    )
+    parser.add_argument(
+        '--min-revisit',
+        type=float,
+        default=get_config().PRIORITY_MIN_REVISIT
+    )
+    parser.add_argument(
+        '--uniform',
+        action='store_true',
+        help='revisit every trend with the same frequency'
+    )
+    fake_apis.add_arguments(parser)
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
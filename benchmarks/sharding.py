@@ -0,0 +1,155 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Runs several lease workers as separate processes against one database
+and checks that every work unit is leased by a single live worker, that
+the units are spread evenly and that the units of a killed worker are
+taken over.
+
+Usage: ``python -m benchmarks.sharding --workers 4 --units 200``
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter
+
+from benchmarks._common import create_pool, truncate
+from sento_crawler.model import Model
+from sento_crawler.sharding import LeaseManager
+
+
+def _make_units(units):
+    return [(f'#unit{i}', 1 + i % 20) for i in range(units)]
+
+
+async def _work(worker_id, units, lease_ttl, renew_interval):
+    pool = await create_pool()
+    Model.pool = pool
+
+    lease_manager = LeaseManager(
+        Model(),
+        worker_id,
+        lease_ttl,
+        renew_interval
+    )
+    while True:
+        await lease_manager.renew(units)
+        await asyncio.sleep(renew_interval)
+
+
+def _run_worker(worker_id, units, lease_ttl, renew_interval):
+    asyncio.run(_work(worker_id, units, lease_ttl, renew_interval))
+
+
+async def _prepare(units):
+    pool = await create_pool()
+    await truncate(
+        pool,
+        'data.work_units',
+        'data.crawler_workers',
+        'data.checkpoints',
+        'data.topics'
+    )
+    async with pool.acquire() as conn:
+        await conn.executemany(
+            'INSERT INTO data.topics (id) VALUES ($1)',
+            sorted({(topic_id,) for topic_id, _ in units})
+        )
+    return pool
+
+
+async def _owners(pool):
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT owner, expires_at > now() AS valid
+            FROM data.work_units
+            """
+        )
+
+
+async def run(args):
+    units = _make_units(args.units)
+    pool = await _prepare(units)
+
+    processes = {}
+    for i in range(args.workers):
+        worker_id = f'bench-{i}'
+        processes[worker_id] = multiprocessing.Process(
+            target=_run_worker,
+            args=(worker_id, units, args.lease_ttl, args.renew_interval)
+        )
+        processes[worker_id].start()
+
+    killed = None
+    killed_at = None
+    taken_over_at = None
+    start = time.monotonic()
+
+    try:
+        while time.monotonic() - start < args.duration:
+            await asyncio.sleep(0.5)
+            elapsed = time.monotonic() - start
+            owners = await _owners(pool)
+
+            if killed is None and elapsed >= args.duration / 3:
+                killed = 'bench-0'
+                killed_at = elapsed
+                os.kill(processes[killed].pid, signal.SIGKILL)
+                print(f'{elapsed:6.1f} s killed {killed}')
+
+            leased = Counter(r['owner'] for r in owners if r['valid'])
+            free = len(owners) - sum(leased.values())
+            if killed is not None and taken_over_at is None \
+                    and killed not in leased and not free:
+                taken_over_at = elapsed
+
+            print(
+                f'{elapsed:6.1f} s {free:>5} units not leased, per worker: '
+                + ', '.join(f'{w}={n}' for w, n in sorted(leased.items()))
+            )
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.join()
+        await pool.close()
+
+    if taken_over_at is None:
+        print('The units of the killed worker were not taken over')
+    else:
+        print(
+            'Units of the killed worker taken over in '
+            f'{taken_over_at - killed_at:.1f} s '
+            f'(lease TTL {args.lease_ttl:.0f} s)'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--units', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--lease-ttl', type=float, default=10)
+    parser.add_argument('--renew-interval', type=float, default=3)
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Peak memory of a burst of search pages waiting to be normalized, keeping
+the parsed pages as before or only their ``StatusRecord``.
+
+The pages are built by the stand-in server and parsed with peony's JSON
+decoder, like the crawler's responses.
+
+Usage: ``python -m benchmarks.status_memory --pages 1000``
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+
+from peony.data_processing import loads
+
+from benchmarks._common import Timer
+from benchmarks.fake_apis import FakeApis
+from benchmarks.normalize import PAGE_SIZE
+from sento_crawler.normalizer import (normalize_records, normalize_statuses,
+                                      status_records)
+
+DISTINCT_PAGES = 20
+
+
+def _make_pages():
+    apis = FakeApis()
+    now = time.time()
+    return [
+        json.dumps({
+            'statuses': [
+                apis._make_status(
+                    10 ** 18 + page * PAGE_SIZE + i,
+                    now - i
+                )
+                for i in range(PAGE_SIZE)
+            ]
+        }).encode('utf-8')
+        for page in range(DISTINCT_PAGES)
+    ]
+
+
+def _keep_pages(page):
+    return loads(page)['statuses']
+
+
+def _keep_records(page):
+    return status_records(loads(page)['statuses'])
+
+
+def _run(name, keep, normalize, pages, burst):
+    tracemalloc.start()
+
+    with Timer() as timer:
+        pending = [keep(pages[i % len(pages)]) for i in range(burst)]
+        _, peak = tracemalloc.get_traced_memory()
+
+        rows = 0
+        for page in pending:
+            rows += len(normalize(page, '#trend', 1, datetime.utcnow()))
+
+    tracemalloc.stop()
+
+    print(
+        f'{name:<10} {peak / 2 ** 20:>10.1f} MB '
+        f'{peak / rows:>10.0f} B/status {timer.elapsed:>8.2f} s'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=1000)
+    args = parser.parse_args()
+
+    pages = _make_pages()
+
+    print('           peak memory     per status      time')
+    _run('pages', _keep_pages, normalize_statuses, pages, args.pages)
+    _run('records', _keep_records, normalize_records, pages, args.pages)
+
+
+if __name__ == '__main__':
+    main()
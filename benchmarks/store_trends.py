@@ -0,0 +1,111 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compares the former per-row trends storage with the bulk path of
+``Model.store_trends_batch``.
+
+Usage: ``python -m benchmarks.store_trends``
+"""
+
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from benchmarks._common import Timer, create_pool, report, truncate
+from sento_crawler.model import Model
+
+TRENDS_PER_LOCATION = 50
+
+
+def _make_trends(locations):
+    return {
+        woeid: [
+            SimpleNamespace(
+                name=f'#trend{woeid}_{i}',
+                url=f'http://twitter.com/search?q=%23trend{woeid}_{i}',
+                query=f'%23trend{woeid}_{i}',
+                tweet_volume=i * 1000 or None
+            )
+            for i in range(TRENDS_PER_LOCATION)
+        ]
+        for woeid in range(1, locations + 1)
+    }
+
+
+async def _store_trends_per_row(pool, location_woeid, trends):
+    # Storage path used before the bulk statements were introduced
+    store_moment = datetime.utcnow()
+
+    for idx, trend in enumerate(trends):
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO data.topics (id, url, query_str)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (id) DO NOTHING
+                    """,
+                    trend.name,
+                    trend.url,
+                    trend.query
+                )
+
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO data.rankings
+                    (ranking_ts, ranking_no, woeid, tweet_volume, topic_id)
+                    VALUES
+                    ($1, $2, $3, $4, $5)
+                    """,
+                    store_moment,
+                    idx + 1,
+                    location_woeid,
+                    trend.tweet_volume,
+                    trend.name
+                )
+
+
+async def main():
+    pool = await create_pool()
+    Model.pool = pool
+    model = Model()
+
+    for locations in (1, 100):
+        trends_by_location = _make_trends(locations)
+        rows = locations * TRENDS_PER_LOCATION
+
+        await truncate(pool, 'data.rankings', 'data.topics')
+        with Timer() as timer:
+            for woeid, trends in trends_by_location.items():
+                await _store_trends_per_row(pool, woeid, trends)
+        report('per-row', rows, timer.elapsed)
+
+        await truncate(pool, 'data.rankings', 'data.topics')
+        with Timer() as timer:
+            for woeid, trends in trends_by_location.items():
+                await model.store_trends(woeid, trends)
+        report('bulk, one transaction per location', rows, timer.elapsed)
+
+        await truncate(pool, 'data.rankings', 'data.topics')
+        with Timer() as timer:
+            await model.store_trends_batch(trends_by_location)
+        report('bulk, one transaction per cycle', rows, timer.elapsed)
+
+    await pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Measures the statuses ingest throughput of every ingest mode.
+
+Usage: ``python -m benchmarks.store_tweets``
+"""
+
+import asyncio
+
+from benchmarks._common import Timer, create_pool, report, truncate
+from sento_crawler.model import VALID_INGEST_MODES, Model
+
+TOTAL_STATUSES = 20000
+BATCH_SIZES = (100, 1000)
+
+
+def _make_tweets(count):
+    return [
+        {
+            'id': 10 ** 18 + i,
+            'created_at': 'Wed Mar 13 12:30:00 +0000 2019',
+            'text': f'Status number {i} about #trend https://t.co/abcdefghij'
+        }
+        for i in range(count)
+    ]
+
+
+async def main():
+    pool = await create_pool()
+    Model.pool = pool
+    model = Model()
+    tweets = _make_tweets(TOTAL_STATUSES)
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO data.topics (id, url, query_str)
+            VALUES ('#trend', '', '%23trend')
+            ON CONFLICT (id) DO NOTHING
+            """
+        )
+
+    for batch_size in BATCH_SIZES:
+        for ingest_mode in VALID_INGEST_MODES:
+            Model.ingest_mode = ingest_mode
+            await truncate(pool, 'data.statuses')
+
+            with Timer() as timer:
+                for i in range(0, len(tweets), batch_size):
+                    await model.store_tweets(
+                        tweets[i:i + batch_size], '#trend', 1
+                    )
+
+            report(
+                f'{ingest_mode}, batches of {batch_size}',
+                len(tweets),
+                timer.elapsed
+            )
+
+    await pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
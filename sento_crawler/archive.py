@@ -0,0 +1,189 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+
+VALID_COMPRESSIONS = (
+    'gzip',
+    'zstd'
+)
+
+_EXTENSIONS = {
+    'gzip': 'gz',
+    'zstd': 'zst'
+}
+
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
+_ARCHIVED_STATUSES = metrics.ARCHIVED_STATUSES
+_DROPPED_PAGES = metrics.ARCHIVE_DROPPED_PAGES
+
+
+class RawArchive:
+    """Compressed JSON lines archive of the raw statuses, so they can be
+    processed again without requesting them from Twitter. The files are
+    written by a background thread and rotated by size.
+
+    Each line holds a status along with the trend and location it was
+    found in and the moment it was fetched.
+
+    Parameters
+    ----------
+    path : str
+        Directory where the archive files are created.
+    max_file_bytes : int
+        Compressed size after which a new file is started.
+    compression : str
+        One of ``VALID_COMPRESSIONS``, ``zstd`` needs the ``zstandard``
+        package.
+    max_pending : int
+        Pages that may wait to be written, new pages are dropped when
+        there are more so the crawl is never slowed down.
+    """
+
+    def __init__(self, path, max_file_bytes, compression, max_pending):
+        if compression not in VALID_COMPRESSIONS:
+            raise ValueError('A valid archive compression must be set.')
+
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError(
+                    'The zstandard package is needed for zstd archives.'
+                )
+            self._zstd = zstandard.ZstdCompressor()
+
+        self.logger = get_logger()
+        self.path = path
+        self.max_file_bytes = max_file_bytes
+        self.compression = compression
+        self._queue = queue.Queue(max(max_pending, 1))
+        self._raw = None  # type: io.FileIO
+        self._writer = None  # type: io.BufferedWriter
+        self._thread = None  # type: threading.Thread
+
+        os.makedirs(path, exist_ok=True)
+
+    def start(self):
+        """Starts the writer thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._write_pages,
+                name='raw-archive',
+                daemon=True
+            )
+            self._thread.start()
+
+    def put(self, statuses, trend_id, woeid):
+        """Queues a page of statuses to be archived, without waiting.
+
+        Parameters
+        ----------
+        statuses : list of dict
+            Statuses from a search response.
+        trend_id : str
+            Topic the statuses were found in.
+        woeid : int
+            Location the statuses were found in.
+        """
+
+        try:
+            self._queue.put_nowait(
+                (statuses, trend_id, woeid, datetime.utcnow())
+            )
+        except queue.Full:
+            _DROPPED_PAGES.inc()
+            self.logger.warning(
+                'Raw archive queue full, dropped %d statuses from "%s"',
+                len(statuses),
+                trend_id
+            )
+
+    def close(self):
+        """Writes the queued pages and closes the current file."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        self._close_file()
+
+    def _write_pages(self):
+        while True:
+            page = self._queue.get()
+            if page is None:
+                return
+
+            try:
+                self._write_page(*page)
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred writing the raw archive: {err}'
+                )
+
+    def _write_page(self, statuses, trend_id, woeid, fetched_at):
+        if self._writer is None:
+            self._open_file()
+
+        fetched_at = fetched_at.isoformat()
+        for status in statuses:
+            self._writer.write(json.dumps({
+                'trend_id': trend_id,
+                'woeid': woeid,
+                'fetched_at': fetched_at,
+                'status': status
+            }, ensure_ascii=False).encode('utf-8'))
+            self._writer.write(b'\n')
+
+        _ARCHIVED_STATUSES.inc(len(statuses))
+
+        if self._raw.tell() >= self.max_file_bytes:
+            self._close_file()
+
+    def _open_file(self):
+        name = 'statuses-{}.jsonl.{}'.format(
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+            _EXTENSIONS[self.compression]
+        )
+        self._raw = io.FileIO(os.path.join(self.path, name), 'wb')
+
+        if self.compression == 'zstd':
+            stream = self._zstd.stream_writer(self._raw)
+        else:
+            stream = gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+        # Many small writes are turned into a few large ones
+        self._writer = io.BufferedWriter(stream, _WRITE_BUFFER_SIZE)
+
+    def _close_file(self):
+        if self._writer is None:
+            return
+
+        # Closing a gzip stream leaves the underlying file open
+        self._writer.close()
+        self._raw.close()
+        self._writer = None
+        self._raw = None
@@ -0,0 +1,327 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import json
+import time
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+from sento_crawler.model import STATUS_COLUMNS, is_transient_error
+from sento_crawler.resilience import backoff_delay
+from sento_crawler.settings import get_config
+
+
+class StatusBuffer:
+    """Write-behind buffer for the statuses rows produced by every trend
+    coroutine, the rows are written together when the buffer reaches its
+    size limits or when too much time has passed since the last flush.
+
+    The checkpoints of the trends are buffered along with the rows and
+    committed in the same transaction, so a checkpoint never covers rows
+    that were not written.
+
+    A batch failing for a transient error, like a lost connection, is kept
+    and written with the next flush. When the database rejects a batch
+    otherwise it is split to find the rows it rejects, which are appended
+    to the dead letters file instead of being retried.
+
+    Parameters
+    ----------
+    model : Model
+        Model used for writing the buffered rows.
+    on_flushed : callable, optional
+        Called with the checkpoints of every successful flush, indexed by
+        topic id and WOEID.
+    """
+
+    def __init__(self, model, on_flushed=None):
+        config = get_config()
+
+        self.model = model
+        self.on_flushed = on_flushed
+        self.logger = get_logger()
+        self.max_rows = config.BUFFER_MAX_ROWS
+        self.max_bytes = config.BUFFER_MAX_BYTES
+        self.max_delay = config.BUFFER_MAX_DELAY
+        self.max_pending = max(config.BUFFER_MAX_PENDING, self.max_rows)
+        self.close_attempts = config.RESILIENCE_RETRIES + 1
+        self.dead_letter_path = config.BUFFER_DEAD_LETTER_PATH
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.duplicate_rows = 0
+        self.dead_rows = 0
+
+        self._rows = []
+        self._bytes = 0
+        self._since_ids = {}
+        self._not_full = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._timer_task = None  # type: asyncio.Task
+
+    @property
+    def depth(self):
+        """Number of rows waiting to be written."""
+        return len(self._rows)
+
+    def start(self):
+        """Starts the task that flushes the buffer periodically."""
+        if self._timer_task is None:
+            self._timer_task = asyncio.ensure_future(
+                self._flush_periodically()
+            )
+
+    async def put(self, rows):
+        """Adds rows to the buffer, waiting while the buffer is full. The
+        rows of a failed flush stay in the buffer, so the trend coroutines
+        are paused until they are written.
+
+        Parameters
+        ----------
+        rows : list of tuple
+            Rows built by ``Model.build_status_rows``.
+        """
+
+        if not rows:
+            return
+
+        async with self._not_full:
+            await self._not_full.wait_for(
+                lambda: len(self._rows) < self.max_pending
+            )
+            self._rows.extend(rows)
+            self._bytes += sum(len(row[3]) for row in rows)
+            metrics.BUFFER_DEPTH.set(len(self._rows))
+
+        if self._is_full():
+            try:
+                await self._flush(only_if_full=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred flushing the statuses buffer: {err}'
+                )
+
+    def put_checkpoints(self, since_ids):
+        """Advances the checkpoints written with the next flush. They must
+        be put after the rows they cover.
+
+        Parameters
+        ----------
+        since_ids : dict
+            Newest status id indexed by topic id and WOEID.
+        """
+
+        for key, since_id in since_ids.items():
+            self._since_ids[key] = max(since_id, self._since_ids.get(key, 0))
+
+    async def flush(self):
+        """Writes every buffered row in a single call to the model. When
+        the write fails the rows are put back at the front of the buffer
+        and the error is raised."""
+        await self._flush()
+
+    def _is_full(self):
+        return (
+            len(self._rows) >= self.max_rows
+            or self._bytes >= self.max_bytes
+        )
+
+    async def _flush(self, only_if_full=False):
+        async with self._flush_lock:
+            # Another coroutine may have flushed the rows while waiting
+            if only_if_full and not self._is_full():
+                return
+
+            async with self._not_full:
+                rows = self._rows
+                rows_bytes = self._bytes
+                since_ids = self._since_ids
+                self._rows = []
+                self._bytes = 0
+                self._since_ids = {}
+                self._not_full.notify_all()
+                metrics.BUFFER_DEPTH.set(0)
+
+            if not rows and not since_ids:
+                return
+
+            start = time.perf_counter()
+            dead_letters = []
+            try:
+                inserted = await self._store(rows, since_ids, dead_letters)
+            except Exception:
+                # Only transient errors get here, the rows are written with
+                # the next flush, before the rows buffered in the meantime
+                async with self._not_full:
+                    self._rows[:0] = rows
+                    self._bytes += rows_bytes
+                    metrics.BUFFER_DEPTH.set(len(self._rows))
+                self.put_checkpoints(since_ids)
+                raise
+            latency = time.perf_counter() - start
+
+            if dead_letters:
+                await self._write_dead_letters(dead_letters)
+
+            if since_ids and self.on_flushed is not None:
+                self.on_flushed(since_ids)
+
+            written = len(rows) - len(dead_letters)
+            self.flushes += 1
+            self.flushed_rows += written
+            self.duplicate_rows += written - inserted
+
+            metrics.BUFFER_FLUSH_ROWS.observe(written)
+            metrics.BUFFER_FLUSH_SECONDS.observe(latency)
+            metrics.DUPLICATE_STATUSES.inc(written - inserted)
+
+            self.logger.debug(
+                'Flushed %d statuses (%d already stored) in %.3f s, '
+                '%d statuses pending',
+                written,
+                written - inserted,
+                latency,
+                self.depth
+            )
+
+    async def _store(self, rows, since_ids, dead_letters):
+        # Returns the number of rows inserted, the rows rejected by the
+        # database are added to dead_letters along with their error
+        try:
+            return await self.model.store_statuses(rows, since_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            if is_transient_error(err):
+                raise
+            error = err
+
+        if len(rows) > 1:
+            # The checkpoints go with the last half, once the rows of the
+            # first one are written or rejected
+            middle = len(rows) // 2
+            return (
+                await self._store(rows[:middle], {}, dead_letters)
+                + await self._store(rows[middle:], since_ids, dead_letters)
+            )
+
+        if rows:
+            dead_letters.append((rows[0], error))
+            if since_ids:
+                return await self._store([], since_ids, dead_letters)
+        else:
+            self.logger.error(
+                f'Exception ocurred storing the checkpoints of '
+                f'{len(since_ids)} trends: {error}'
+            )
+        return 0
+
+    async def _write_dead_letters(self, dead_letters):
+        self.dead_rows += len(dead_letters)
+        metrics.BUFFER_DEAD_LETTERS.inc(len(dead_letters))
+        self.logger.error(
+            'Dropped %d statuses rejected by the database, appended to %s: '
+            '%s. Ids: %s',
+            len(dead_letters),
+            self.dead_letter_path,
+            dead_letters[0][1],
+            ', '.join(str(row[0]) for row, _ in dead_letters)
+        )
+
+        lines = [
+            json.dumps(
+                dict(zip(STATUS_COLUMNS, row), error=str(err)),
+                default=str
+            )
+            for row, err in dead_letters
+        ]
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None,
+                self._append_dead_letters,
+                lines
+            )
+        except Exception as err:
+            self.logger.error(
+                f'Exception ocurred writing the dead letters: {err}'
+            )
+
+    def _append_dead_letters(self, lines):
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    async def close(self):
+        """Stops the periodic flushes and writes the remaining rows,
+        retrying a few times when the writes fail.
+
+        Returns
+        -------
+        int
+            Number of rows that could not be written.
+        """
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            try:
+                await self._timer_task
+            except asyncio.CancelledError:
+                pass
+            self._timer_task = None
+
+        for attempt in range(self.close_attempts):
+            try:
+                await self.flush()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred flushing the statuses buffer: {err}'
+                )
+                if attempt + 1 < self.close_attempts:
+                    await asyncio.sleep(backoff_delay(attempt))
+
+        if self._rows:
+            self.logger.error(
+                'Statuses buffer closed with %d statuses that could not be '
+                'written',
+                len(self._rows)
+            )
+
+        self.logger.info(
+            'Statuses buffer drained, %d statuses written in %d flushes, '
+            '%d of them were already stored, %d rejected',
+            self.flushed_rows,
+            self.flushes,
+            self.duplicate_rows,
+            self.dead_rows
+        )
+
+        return len(self._rows)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.max_delay)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred flushing the statuses buffer: {err}'
+                )
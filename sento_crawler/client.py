@@ -14,29 +14,220 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
-import aiohttp
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlparse
 
 from peony import PeonyClient, task
 
+from sento_crawler import metrics
+from sento_crawler.archive import RawArchive
+from sento_crawler.buffer import StatusBuffer
+from sento_crawler.dedup import Deduplicator
+from sento_crawler.geocoder import Geocoder
 from sento_crawler.logger import get_logger
 from sento_crawler.model import Model
+from sento_crawler.normalizer import NormalizerPool, status_records
+from sento_crawler.partitions import PartitionManager
+from sento_crawler.planner import FanOutPlanner
+from sento_crawler.resilience import (TwitterErrorHandler, get_breaker,
+                                      is_transient)
+from sento_crawler.scheduler import (CredentialPool, TrendPrioritizer,
+                                     TrendRefresher, TrendScheduler)
 from sento_crawler.settings import get_config
-
-NOMINATIM_SEARCH_URL = 'https://nominatim.openstreetmap.org/search'
+from sento_crawler.sharding import LeaseManager
+from sento_crawler.supervisor import supervised
+from sento_crawler.trends import TrendFeed
+from sento_crawler.transport import get_session
+
+
+_API_IN_FLIGHT = metrics.IN_FLIGHT.labels('api_requests')
+_TREND_VISITS_IN_FLIGHT = metrics.IN_FLIGHT.labels('trend_visits')
+_TRENDS_CYCLE_SECONDS = metrics.CYCLE_SECONDS.labels('trends')
+_TREND_VISIT_SECONDS = metrics.CYCLE_SECONDS.labels('trend_visit')
+_TRENDS_REFRESHES_CHANGED = metrics.TRENDS_REFRESHES.labels('changed')
+_TRENDS_REFRESHES_STORED = metrics.TRENDS_REFRESHES.labels('unchanged_stored')
+_TRENDS_REFRESHES_SKIPPED = metrics.TRENDS_REFRESHES.labels(
+    'unchanged_skipped'
+)
+_api_metrics = {}
+
+
+def _get_endpoint(url):
+    # https://api.twitter.com/1.1/search/tweets.json -> search/tweets
+    path = urlparse(str(url)).path
+    return path.split('/', 2)[-1].rsplit('.', 1)[0]
+
+
+def _get_api_metrics(endpoint):
+    api_metrics = _api_metrics.get(endpoint)
+    if api_metrics is None:
+        api_metrics = _api_metrics[endpoint] = (
+            metrics.API_REQUEST_SECONDS.labels(endpoint),
+            metrics.API_RATE_LIMIT_REMAINING.labels(endpoint)
+        )
+    return api_metrics
 
 
 class TwitterClient(PeonyClient):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('error_handler', TwitterErrorHandler)
+        # Every credential shares the connections to the API
+        kwargs.setdefault('session', get_session())
+        kwargs.setdefault('compression', get_config().HTTP_GZIP)
+        super().__init__(*args, **kwargs)
+        self.request_timeout = get_config().RESILIENCE_TWITTER_TIMEOUT
+        self.breaker = get_breaker('twitter')
+
     @classmethod
-    async def create(cls):
+    async def create(cls, search_clients):
+        """Prepares the state shared by the clients.
+
+        Parameters
+        ----------
+        search_clients : list of TwitterClient
+            Clients used for searching tweets, one per credential,
+            including the client running the tasks.
+        """
+
         cls.model = Model()
         cls.logger = get_logger()
-        cls.search_woeid = get_config().SEARCH_WOEID
+        config = get_config()
+        cls.search_woeids = config.SEARCH_WOEIDS
         await cls.model.create()
+        cls.status_buffer = StatusBuffer(cls.model, cls._advance_checkpoints)
+        cls.status_buffer.start()
+        cls.normalizer = NormalizerPool(
+            config.NORMALIZER_WORKERS,
+            config.NORMALIZER_MAX_PENDING
+        )
+        cls.deduplicator = Deduplicator(
+            config.DEDUP_RETWEETS,
+            config.DEDUP_EXACT,
+            config.DEDUP_NEAR_DUPLICATES,
+            config.DEDUP_WINDOW,
+            config.DEDUP_MAX_ENTRIES,
+            config.DEDUP_MAX_DISTANCE
+        )
+        cls.archive = None
+        if config.ARCHIVE_ENABLED:
+            cls.archive = RawArchive(
+                config.ARCHIVE_PATH,
+                config.ARCHIVE_MAX_FILE_BYTES,
+                config.ARCHIVE_COMPRESSION,
+                config.ARCHIVE_MAX_PENDING
+            )
+            cls.archive.start()
+        cls.since_ids = await cls.model.get_checkpoints()
+        cls.backfills = {}
+        cls.trend_feed = TrendFeed(cls.model)
+        await cls.trend_feed.load()
+        cls.geocoder = Geocoder(cls.model, cls.trend_feed.refresh_locations)
+        await cls.geocoder.warm()
+        cls.geocoder.start()
+        cls.credential_pool = CredentialPool(
+            search_clients,
+            config.SEARCH_RATE_LIMIT,
+            config.SEARCH_RATE_LIMIT_WINDOW
+        )
+        cls.max_pages_per_visit = config.SCHEDULER_MAX_PAGES_PER_VISIT
+        cls.scheduler_concurrency = config.SCHEDULER_CONCURRENCY
+        cls.trend_prioritizer = TrendPrioritizer(
+            config.PRIORITY_RANK_WEIGHT,
+            config.PRIORITY_VOLUME_WEIGHT,
+            config.PRIORITY_HALF_LIFE,
+            config.PRIORITY_MIN_REVISIT,
+            config.PRIORITY_EXPLORATION_SHARE,
+            len(search_clients) * config.SEARCH_RATE_LIMIT
+            / config.SEARCH_RATE_LIMIT_WINDOW
+        )
+        cls.trend_prioritizer.restore(await cls.model.get_trend_visits())
+        cls.trend_refresher = TrendRefresher(
+            config.TRENDS_MIN_INTERVAL,
+            config.TRENDS_MAX_INTERVAL,
+            config.TRENDS_FAST_CHANGE,
+            config.TRENDS_RATE_LIMIT,
+            config.TRENDS_RATE_LIMIT_WINDOW,
+            config.TRENDS_UNCHANGED_WRITE_INTERVAL
+        )
+        cls.visited = {}
+        cls.crawl_stats = Counter()
+        cls.state_interval = config.SUPERVISOR_STATE_INTERVAL
+        cls.planner = None
+        if config.PLANNER_ENABLED:
+            cls.planner = FanOutPlanner(config.PLANNER_MIN_OVERLAP)
+        cls.partition_manager = None
+        cls.maintenance_interval = config.RETENTION_INTERVAL
+        if config.RETENTION_ENABLED:
+            cls.partition_manager = PartitionManager(
+                cls.model,
+                config.RETENTION_DAYS_AHEAD,
+                config.RETENTION_DAYS,
+                config.RETENTION_DROP_EXPIRED
+            )
+        cls.lease_manager = None
+        if config.SHARDING_ENABLED:
+            cls.lease_manager = LeaseManager(
+                cls.model,
+                config.SHARDING_WORKER_ID,
+                config.SHARDING_LEASE_TTL,
+                config.SHARDING_RENEW_INTERVAL
+            )
+            # Nothing is crawled until the first leases are claimed
+            cls.trend_feed.restrict(())
+
+    async def request(self, method, url, *args, **kwargs):
+        """Makes a request to the Twitter API, measuring its duration and
+        outcome and keeping the rate limit headers. The request fails when
+        it times out or when the API has been failing.
+        """
+
+        endpoint = _get_endpoint(url)
+        request_seconds, rate_limit_remaining = _get_api_metrics(endpoint)
 
-    async def _get_locations_with_trends(self):
+        self.breaker.check()
+
+        _API_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                super().request(method, url, *args, **kwargs),
+                self.request_timeout
+            )
+        except Exception as err:
+            metrics.API_REQUESTS.labels(endpoint, 'error').inc()
+            if is_transient(err):
+                self.breaker.failure()
+            raise
+        finally:
+            request_seconds.observe(time.perf_counter() - start)
+            _API_IN_FLIGHT.dec()
+
+        metrics.API_REQUESTS.labels(endpoint, 'ok').inc()
+        self.breaker.success()
+
+        # Peony 1.x returns the response through a future
+        future = args[0] if args else kwargs.get('future')
+        if response is None and future is not None and future.done():
+            response = future.result()
+
+        remaining = getattr(response, 'headers', {}).get(
+            'x-rate-limit-remaining'
+        )
+        if remaining is not None:
+            rate_limit_remaining.set(int(remaining))
+
+        return response
+
+    async def _get_locations_with_trends(self, woeids):
         """Returns the locations that have trends in the moment when the
-        request is made and whose parent woeid is the specified in the
-        configuration file
+        request is made and whose parent woeid is one of the given ones
+
+        Parameters
+        ----------
+        woeids : list of int
+            WOEIDs of the countries.
 
         Returns
         -------
@@ -46,151 +237,293 @@ class TwitterClient(PeonyClient):
         self.logger.debug('Requesting trends/available')
 
         locations = await self.api.trends.available.get()
-        return [_ for _ in locations if _.get('parentid') == self.search_woeid]
+        return [_ for _ in locations if _.get('parentid') in woeids]
 
-    async def _get_location_information(self, location):
-        """Queries the location geometry from Openstreetmap's nominatim
-        service and stores it in the database.
+    async def _get_trends_for_location(self, location):
+        """Queries the current trends available in a location, its
+        geospatial information is stored later in the background.
 
         Parameters
         ----------
         location : dict
-            Location definition from twitter.
+            Location object from twitter.
+
+        Returns
+        -------
+        tuple of int and list
+            The location's WOEID and its trends.
         """
 
-        location_exists = (
-            await self.model.check_location_existence(location.get('woeid'))
-        )
-        if not location_exists:
-            self.logger.debug(
-                'Requesting location data for %s (WOEID %d)',
-                location.get('name'),
-                location.get('woeid')
+        headers = None
+        try:
+            trends_response = await self.api.trends.place.get(
+                id=location.get('woeid')
             )
+            headers = trends_response.headers
+        finally:
+            self.trend_refresher.release(headers)
+        self.geocoder.put(location)
 
-            async with aiohttp.ClientSession() as session:
-                params = {
-                    'format': 'json',
-                    'city': location.get('name'),
-                    'polygon_geojson': 1,
-                    'country': location.get('country'),
-                    'limit': 1
-                }
+        # Get the trends from the response
+        trends = trends_response.data[0].get('trends')
 
-                async with session.get(
-                    NOMINATIM_SEARCH_URL,
-                    params=params
-                ) as resp:
-                    data = await resp.json()
-                    osm_data = data[0] if data else None
+        return location.get('woeid'), trends
 
-                    self.logger.debug(
-                        'Storing location data for %s (WOEID %d) [%s, %s]',
-                        osm_data.get('display_name'),
-                        location.get('woeid'),
-                        osm_data.get('lon'),
-                        osm_data.get('lat')
+    @task
+    @supervised
+    async def get_trends(self):
+        """Periodic task for querying the current trends in different
+        locations whose parent WOEID is one of the specified in the
+        configuration file. The trends and the location geospatial
+        information is stored in the database.
+
+        The trends of each location are requested again sooner when its
+        ranking changes and later when it does not, and the rankings that
+        did not change are not stored again.
+        """
+
+        locations = {}
+        locations_woeids = None
+        locations_at = 0
+
+        while True:
+            woeids = self.search_woeids
+            if self.lease_manager is not None:
+                woeids = [
+                    woeid for woeid in woeids
+                    if await self.lease_manager.lead_trends(woeid)
+                ]
+
+            if not woeids:
+                # The trends are extracted by other crawlers and read
+                # from the database by the leases task
+                locations_woeids = None
+                await asyncio.sleep(self.lease_manager.renew_interval)
+                continue
+
+            if locations_woeids != woeids:
+                # The trends may have been extracted right before a restart
+                wait = await self._get_trends_wait(woeids)
+                if wait > 0:
+                    self.logger.info(
+                        'Trends extracted recently. Next trend search in %d '
+                        'seconds',
+                        wait
                     )
+                    await asyncio.sleep(wait)
+                    continue
 
-                    await self.model.store_location(osm_data, location)
+            # New locations with trends appear seldom
+            if (locations_woeids != woeids or time.monotonic() - locations_at
+                    >= self.trend_refresher.max_interval):
+                self.logger.info('Looking for trends')
+                locations = {
+                    location.get('woeid'): location
+                    for location in await self._get_locations_with_trends(
+                        woeids
+                    )
+                }
+                locations_woeids = woeids
+                locations_at = time.monotonic()
+
+            due = [
+                locations[woeid]
+                for woeid in self.trend_refresher.due(list(locations))
+            ]
+            if due:
+                await self._refresh_trends(due)
+                await self.model.store_trends_cycle(woeids)
+
+            wait = min(
+                self.trend_refresher.time_until_next(),
+                locations_at + self.trend_refresher.max_interval
+                - time.monotonic()
+            )
+            # At least a second between rounds of refreshes
+            await asyncio.sleep(max(wait, 1))
 
-    async def _get_trends_for_location(self, location):
-        """Queries the current trends available in a location and stores
-        the location's geospatial information and the different trends.
+    async def _refresh_trends(self, locations):
+        """Requests the trends of the given locations, storing the rankings
+        that changed and publishing every trend to the tweets extraction.
 
         Parameters
         ----------
-        location : dict
-            Location object from twitter.
+        locations : list of dict
+            Location objects from twitter.
         """
 
-        self.logger.debug(
-            'Requesting trends and location data for '
-            '%s WOEID: %d Country: %s',
-            location.get('name'),
-            location.get('woeid'),
-            location.get('country')
-        )
+        cycle_start = time.perf_counter()
+        coros = [self._get_trends_for_location(_) for _ in locations]
+
+        # A failing location does not prevent storing the rest
+        trends_by_location = {}
+        stored_by_location = {}
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for location, result in zip(locations, results):
+            if isinstance(result, Exception):
+                self.logger.error(
+                    f'Exception ocurred extracting trends in '
+                    f'{location.get("name")}: {result}'
+                )
+                continue
+            woeid, trends = result
+            trends_by_location[woeid] = trends
 
-        trends_response, _ = await asyncio.gather(
-            self.api.trends.place.get(id=location.get('woeid')),
-            self._get_location_information(location)
-        )
+            change, store = self.trend_refresher.update(
+                woeid,
+                tuple(trend.name for trend in trends)
+            )
+            if not store:
+                _TRENDS_REFRESHES_SKIPPED.inc()
+                continue
 
-        # Get the trends from the response
-        trends = trends_response.data[0].get('trends')
+            stored_by_location[woeid] = trends
+            if change > 0:
+                _TRENDS_REFRESHES_CHANGED.inc()
+            else:
+                _TRENDS_REFRESHES_STORED.inc()
 
         self.logger.debug(
-            'Storing trends and location info for %s WOEID: %d Country: %s',
-            location.get('name'),
-            location.get('woeid'),
-            location.get('country')
+            'Refreshed trends for %d locations, storing %d rankings',
+            len(trends_by_location),
+            len(stored_by_location)
         )
 
-        await self.model.store_trends(location.get('woeid'), trends)
+        await self.model.store_trends_batch(stored_by_location)
+        # Every trend seen is published, even if its ranking is not stored
+        await self.trend_feed.publish(trends_by_location)
+        _TRENDS_CYCLE_SECONDS.observe(time.perf_counter() - cycle_start)
+
+    async def _get_trends_wait(self, woeids):
+        """Returns the seconds left until the trends of the given countries
+        may be extracted again after a restart, 0 when any of them is
+        due."""
+        cycles = await self.model.get_trends_cycles(woeids)
+        if len(cycles) < len(woeids):
+            return 0
+
+        elapsed = datetime.utcnow() - min(cycles.values())
+        return max(
+            self.trend_refresher.min_interval - elapsed.total_seconds(),
+            0
+        )
 
     @task
-    async def get_trends(self):
-        """Periodic task for querying the current trends in different
-        locations whose parent WOEID is the specified in the configuration
-        file. The trends and the location geospatial information is stored
-        in the database.
+    @supervised
+    async def get_tweets(self):
+        """Periodic task for extracting tweets/statuses from the different
+        trends existing in the different locations and storing them in the
+        database.
         """
 
+        trend_scheduler = TrendScheduler(
+            self._get_tweets_from_trend,
+            self.scheduler_concurrency
+        )
+        trend_scheduler.start()
+
+        self.logger.info('Extracting tweets from trends in each location')
+
+        last_saved = time.monotonic()
         try:
             while True:
-                self.logger.info('Looking for trends')
+                relevant_trends = await self.trend_feed.get_trends()
+                due_trends = self.trend_prioritizer.due(relevant_trends)
 
-                locations = await self._get_locations_with_trends()
-                coros = [self._get_trends_for_location(_) for _ in locations]
+                if self.planner is not None:
+                    due_trends = self.planner.plan(
+                        due_trends,
+                        relevant_trends
+                    )
+                    for trend, _ in due_trends:
+                        for member in trend.get('members', ())[1:]:
+                            self.trend_prioritizer.visit(member)
 
-                self.logger.info('Launching trends extraction coroutines '
-                                 'for each location')
+                queued = sum(
+                    trend_scheduler.put(trend, -score)
+                    for trend, score in due_trends
+                )
 
-                await asyncio.gather(*coros)
+                if queued:
+                    self.logger.debug(
+                        'Queued %d of %d trends and locations, %d waiting '
+                        'or being crawled',
+                        queued,
+                        len(relevant_trends),
+                        trend_scheduler.depth
+                    )
 
-                self.logger.info(
-                    'Sleeping trends search. Next trend search in 15 minutes'
-                )
+                if time.monotonic() - last_saved >= self.state_interval:
+                    await self.save_state()
+                    self._log_crawl_summary(time.monotonic() - last_saved)
+                    last_saved = time.monotonic()
 
-                await asyncio.sleep(15 * 60)
-        except Exception as err:
-            self.logger.error(f'Exception ocurred in get_trends task: {err}')
+                # New trends are due as soon as they are published, the
+                # state is saved at least once per interval
+                await self.trend_feed.wait_for_update(min(
+                    self.trend_prioritizer.time_until_next(),
+                    self.state_interval
+                ))
+        finally:
+            await trend_scheduler.close()
 
     @task
-    async def get_tweets(self):
-        """Periodic task for extracting tweets/statuses from the different
-        trends existing in the different locations and storing them in the
-        database.
+    async def renew_leases(self):
+        """Periodic task for reading the trends stored by every crawler and
+        renewing the leases of the trends crawled by this one, only when
+        the crawl is sharded.
         """
 
-        try:
-            while True:
-                self.logger.info('Extracting tweets from trends in each location')
+        if self.lease_manager is None:
+            return
 
-                relevant_trends = await self.model.get_relevant_trends_info()
-
-                while not relevant_trends:
-                    await asyncio.sleep(5)
-                    relevant_trends = (await
-                                       self.model.get_relevant_trends_info())
+        while True:
+            try:
+                await self.trend_feed.load()
+                claimed = await self.lease_manager.renew(
+                    self.trend_feed.get_work_units()
+                )
 
-                self.logger.info(
-                    'Launching tweets extraction coroutines '
-                    'for each trend and location'
+                # Another crawler may have extracted tweets from the
+                # claimed trends
+                for key, since_id in claimed.items():
+                    if since_id is not None:
+                        self.since_ids[key] = max(
+                            since_id,
+                            self.since_ids.get(key, 0)
+                        )
+
+                self.trend_feed.restrict(self.lease_manager.owned)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred renewing the leases: {err}'
                 )
 
-                for coros in self._distribute_trends(relevant_trends, 5):
-                    await asyncio.gather(*coros)
-        except Exception as err:
-            self.logger.error(f'Exception ocurred in get_tweets task: {err}')
+                if self.lease_manager.expire():
+                    self.trend_feed.restrict(self.lease_manager.owned)
+
+            await asyncio.sleep(self.lease_manager.renew_interval)
+
+    @task
+    @supervised
+    async def maintain_partitions(self):
+        """Periodic task for creating the partitions of the coming days and
+        expiring the old ones, only when the retention is managed.
+        """
 
-    def _distribute_trends(self, trends, size):
-        for i in range(0, len(trends), size):
-            yield [self._get_tweets_from_trend(_) for _ in trends[i:i+size]]
+        if self.partition_manager is None:
+            return
 
+        while True:
+            await self.partition_manager.maintain()
+            await asyncio.sleep(self.maintenance_interval)
+
+    @metrics.timed(_TREND_VISIT_SECONDS, _TREND_VISITS_IN_FLIGHT)
     async def _get_tweets_from_trend(self, trend):
-        """Extracts the available tweets from a trend in a certain location.
+        """Extracts the available tweets from a trend in a certain location,
+        or in several locations when the trend groups them.
 
         Parameters
         ----------
@@ -198,51 +531,199 @@ class TwitterClient(PeonyClient):
             Twitter and geospatial data for a certain trend.
         """
 
-        geocode_str = (
-            f'{trend.get("latitude")},'
-            f'{trend.get("longitude")},'
-            f'{trend.get("radius_km")}km'
-        )
+        # The trends may have been leased to another crawler while queued
+        members = [
+            member for member in trend.get('members', (trend,))
+            if self.lease_manager is None or self.lease_manager.owns(member)
+        ]
+        if not members:
+            return
+        if len(members) > 1:
+            metrics.FANOUT_TRENDS.inc(len(members) - 1)
 
         # TODO: Make lang configurable
 
         req_params = {
             'q': trend.get('query_str'),
-            'geocode': geocode_str,
+            'geocode': trend.get('geocode'),
             'count': 100,
             'lang': 'es',
             'tweet_mode': 'extended'
         }
 
-        req = self.api.search.tweets.get(**req_params)
-        responses = req.iterator.with_since_id(force=False)
-
-        try:
-            self.logger.debug(
-                'Extracting tweets from trend "%s" written in %s',
-                trend.get('id'),
-                trend.get('location_name')
+        # Resume from the newest status already stored from every
+        # location
+        checkpoint_keys = [
+            (member.get('id'), member.get('woeid')) for member in members
+        ]
+        since_ids = [self.since_ids.get(key) for key in checkpoint_keys]
+        since_id = None if None in since_ids else min(since_ids)
+        if since_id is not None:
+            req_params['since_id'] = since_id
+
+        # A previous visit may have run out of pages before reaching the
+        # checkpoint, the gap is filled before requesting newer statuses
+        max_id = None
+        top = 0
+        backfills = {self.backfills.get(key) for key in checkpoint_keys}
+        if since_id is not None and len(backfills) == 1:
+            max_id, top = backfills.pop() or (None, 0)
+
+        # The pages go from the newest statuses to the checkpoint, which
+        # is only advanced once every status after it was extracted.
+        # Without a checkpoint only the newest page is extracted.
+        requests = pages = found = kept = 0
+        filled = since_id is None
+        for _ in range(self.max_pages_per_visit):
+            if max_id is not None:
+                req_params['max_id'] = max_id
+            records = await self._search_tweets(req_params, trend)
+            requests += 1
+
+            if not records:
+                filled = True
+                break
+
+            pages += 1
+            found += len(records)
+
+            assigned = (
+                self.planner.assign(records, members)
+                if len(members) > 1 else [records]
             )
-            async for response in responses:
-                self.logger.debug(
-                    'Storing tweets from search request to "%s" in %s',
-                    trend.get('id'),
-                    trend.get('location_name')
-                )
 
-                await self.model.store_tweets(
-                    response.data.statuses, trend.get('id'), trend.get('woeid')
+            for member, member_records in zip(members, assigned):
+                # The whole page is still used for resuming the search
+                unique_records = self.deduplicator.filter_retweets(
+                    member_records,
+                    member.get('id'),
+                    member.get('woeid')
+                )
+                rows, fingerprints = await self.normalizer.normalize(
+                    unique_records,
+                    member.get('id'),
+                    member.get('woeid'),
+                    self.deduplicator.fingerprints
                 )
-        except IndexError:
-            # Peony raises IndexError when the first request returns no
-            # results, this happens when a trend is not relevant enough
-            # in a location. This except block may be removed when Peony
-            # ceases to raise this exception on these cases.
-            self.logger.debug(
-                'Could not iterate through tweets from trend "%s" '
-                'written in %s. Twitter may have returned no results. '
-                'Parameters used in request: %s',
-                trend.get('id'),
-                trend.get('location_name'),
-                req_params
+                rows = self.deduplicator.filter_rows(
+                    rows,
+                    fingerprints,
+                    member.get('id'),
+                    member.get('woeid')
+                )
+                kept += len(rows)
+
+                await self.status_buffer.put(rows)
+
+            top = max(top, records[0].id)
+            max_id = records[-1].id - 1
+            if since_id is None:
+                break
+
+        # Advanced once the rows put so far are committed
+        for key in checkpoint_keys:
+            if filled:
+                self.backfills.pop(key, None)
+            else:
+                self.backfills[key] = (max_id, top)
+        if filled and top:
+            self.status_buffer.put_checkpoints(
+                {key: top for key in checkpoint_keys}
             )
+
+        self.trend_prioritizer.record_requests(requests)
+        visited_at = datetime.utcnow()
+        for key in checkpoint_keys:
+            self.visited[key] = visited_at
+
+        self.crawl_stats.update(
+            visits=1,
+            trends=len(members),
+            pages=pages,
+            statuses=found,
+            kept=kept
+        )
+
+        # One record per visit instead of one per page
+        self.logger.debug(
+            'Extracted %d statuses in %d pages from trend "%s" in %s '
+            'since %s',
+            found,
+            pages,
+            trend.get('id'),
+            trend.get('location_name'),
+            since_id,
+            extra={
+                'trend': trend.get('id'),
+                'woeid': trend.get('woeid'),
+                'pages': pages,
+                'statuses': found,
+                'kept': kept
+            }
+        )
+
+    @classmethod
+    def _advance_checkpoints(cls, since_ids):
+        # Called by the statuses buffer with the checkpoints committed
+        for key, since_id in since_ids.items():
+            cls.since_ids[key] = max(since_id, cls.since_ids.get(key, 0))
+
+    def _log_crawl_summary(self, seconds):
+        stats = dict(self.crawl_stats)
+        self.crawl_stats.clear()
+        self.logger.info(
+            'Crawled %d trends in %d visits over the last %d seconds: '
+            '%d pages, %d statuses, %d kept after removing duplicates',
+            stats.get('trends', 0),
+            stats.get('visits', 0),
+            seconds,
+            stats.get('pages', 0),
+            stats.get('statuses', 0),
+            stats.get('kept', 0),
+            extra={'summary': 'crawl', 'seconds': round(seconds, 1), **stats}
+        )
+
+    async def save_state(self):
+        """Stores when the trends crawled since the last call were visited,
+        so they are not crawled again right after a restart."""
+        visits = self.visited.copy()
+        self.visited.clear()
+        try:
+            await self.model.store_trend_visits(visits)
+        except Exception:
+            # Kept for the next attempt unless visited again meanwhile
+            for key, visited_at in visits.items():
+                self.visited.setdefault(key, visited_at)
+            raise
+
+    async def _search_tweets(self, params, trend):
+        """Makes a search/tweets request within the rate limit budget.
+
+        Parameters
+        ----------
+        params : dict
+            Parameters of the request.
+        trend : dict
+            Trend searched, used for archiving the raw statuses.
+
+        Returns
+        -------
+        list of StatusRecord
+            Records of the statuses found, the rest of the response is
+            freed once they are extracted.
+        """
+
+        idx = await self.credential_pool.acquire()
+        client = self.credential_pool.clients[idx]
+        headers = None
+        try:
+            response = await client.api.search.tweets.get(**params)
+            headers = response.headers
+        finally:
+            self.credential_pool.release(idx, headers)
+
+        statuses = response.data.statuses
+        if self.archive is not None and statuses:
+            self.archive.put(statuses, trend.get('id'), trend.get('woeid'))
+
+        return status_records(statuses)
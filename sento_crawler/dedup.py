@@ -0,0 +1,341 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import re
+import time
+
+from sento_crawler import metrics
+
+RETWEET_PREFIX_REGEX = re.compile(r'^RT @\w+: ')
+MENTION_REGEX = re.compile(r'@\w+')
+WORD_REGEX = re.compile(r'\w+')
+
+SIMHASH_BITS = 64
+_MASK = (1 << SIMHASH_BITS) - 1
+
+_KEPT = metrics.DEDUP_STATUSES.labels('kept')
+_RETWEETS = metrics.DEDUP_STATUSES.labels('retweet')
+_EXACT = metrics.DEDUP_STATUSES.labels('exact')
+_NEAR = metrics.DEDUP_STATUSES.labels('near_duplicate')
+
+
+def content_tokens(text):
+    """Returns the lowercase words of a status text whose links were
+    already removed, without its mentions and retweet prefix."""
+    text = MENTION_REGEX.sub('', RETWEET_PREFIX_REGEX.sub('', text))
+    return WORD_REGEX.findall(text.lower())
+
+
+def content_fingerprint(text):
+    """Returns the hash of the words of a status text whose links were
+    already removed and their SimHash, ``None`` when it has no words, e.g.
+    only emoji or links, as it can not be told apart by its content.
+
+    The hashes of strings differ between interpreters, the fingerprints
+    compared must be computed by processes sharing the hash seed.
+    """
+
+    tokens = content_tokens(text)
+    if not tokens:
+        return None
+    return hash(' '.join(tokens)), simhash(set(tokens))
+
+
+def simhash(tokens):
+    """Computes the 64 bits SimHash of a collection of tokens.
+
+    Each bit is set when it is set in the hash of more than half of the
+    tokens. The bits are counted in parallel, using an integer per bit of
+    the counters.
+    """
+
+    planes = []
+    for token in tokens:
+        carry = hash(token) & _MASK
+        for i, plane in enumerate(planes):
+            planes[i] = plane ^ carry
+            carry &= plane
+            if not carry:
+                break
+        if carry:
+            planes.append(carry)
+
+    # Lanes whose count is greater than half of the tokens
+    threshold = len(tokens) // 2 + 1
+    greater = 0
+    equal = _MASK
+    for i in range(max(len(planes), threshold.bit_length()) - 1, -1, -1):
+        plane = planes[i] if i < len(planes) else 0
+        if threshold >> i & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane
+
+    return greater | equal
+
+
+class _ExpiringSet:
+    """Set of keys forgotten after a time window or when there are too
+    many, the oldest first."""
+
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self._added = {}
+
+    def __len__(self):
+        return len(self._added)
+
+    def add(self, key, now):
+        """Adds the key, returns ``False`` if it was already there."""
+        if key in self._added:
+            return False
+
+        self._added[key] = now
+        return True
+
+    def expire(self, now):
+        """Forgets the expired keys, returns them."""
+        oldest = now - self.window
+        excess = len(self._added) - self.max_size
+        expired = []
+        # Keys are kept in insertion order, so the oldest come first
+        for key, added in self._added.items():
+            if added >= oldest and len(expired) >= excess:
+                break
+            expired.append(key)
+
+        for key in expired:
+            del self._added[key]
+
+        return expired
+
+
+class SimHashIndex:
+    """Index of recent SimHashes finding those within a Hamming distance.
+
+    The hashes are split in ``max_distance + 1`` bands, two hashes within
+    the distance have at least one identical band, so only the hashes
+    sharing a band with the searched one are compared.
+
+    Parameters
+    ----------
+    max_distance : int
+        Maximum number of different bits between near duplicates.
+    window : float
+        Seconds a hash is kept.
+    max_size : int
+        Maximum number of hashes kept.
+    """
+
+    def __init__(self, max_distance, window, max_size):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = SIMHASH_BITS // bands
+        # Shift and mask of each band, the last one takes the spare bits
+        self._bands = [(i * width, (1 << width) - 1) for i in range(bands)]
+        self._bands[-1] = (
+            (bands - 1) * width,
+            (1 << (SIMHASH_BITS - (bands - 1) * width)) - 1
+        )
+        self._entries = _ExpiringSet(window, max_size)
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, scope, value, now):
+        """Adds a hash unless a near duplicate is already indexed.
+
+        Parameters
+        ----------
+        scope : tuple
+            Only hashes within the same scope are compared.
+        value : int
+            The SimHash.
+        now : float
+            Current monotonic time.
+
+        Returns
+        -------
+        bool
+            Whether the hash was added.
+        """
+
+        self._expire(now)
+
+        keys = self._keys(scope, value)
+        for key in keys:
+            for other in self._buckets.get(key, ()):
+                if bin(value ^ other[1]).count('1') <= self.max_distance:
+                    return False
+
+        entry = (scope, value)
+        if not self._entries.add(entry, now):
+            return False
+
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(entry)
+
+        return True
+
+    def _keys(self, scope, value):
+        return [
+            (scope, i, value >> shift & mask)
+            for i, (shift, mask) in enumerate(self._bands)
+        ]
+
+    def _expire(self, now):
+        for entry in self._entries.expire(now):
+            for key in self._keys(*entry):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(entry)
+                    if not bucket:
+                        del self._buckets[key]
+
+
+class Deduplicator:
+    """Drops the statuses whose content is already stored for the same
+    trend and location within a time window: retweets of an already seen
+    status, statuses with the same words and near duplicates with a
+    similar SimHash.
+
+    Parameters
+    ----------
+    retweets : bool
+        Whether the retweets of a seen status are dropped.
+    exact : bool
+        Whether the statuses with the same words are dropped.
+    near_duplicates : bool
+        Whether the statuses with a similar SimHash are dropped.
+    window : float
+        Seconds a status is remembered.
+    max_entries : int
+        Maximum number of statuses remembered by each filter.
+    max_distance : int
+        Maximum number of different SimHash bits between near duplicates.
+    """
+
+    def __init__(self, retweets, exact, near_duplicates, window,
+                 max_entries, max_distance):
+        self.retweets = retweets
+        self.exact = exact
+        self.near_duplicates = near_duplicates
+        self._seen_statuses = _ExpiringSet(window, max_entries)
+        self._seen_contents = _ExpiringSet(window, max_entries)
+        self._similar = SimHashIndex(max_distance, window, max_entries)
+
+    @property
+    def enabled(self):
+        return self.retweets or self.exact or self.near_duplicates
+
+    @property
+    def fingerprints(self):
+        """Whether ``filter_rows`` needs the ``content_fingerprint`` of the
+        rows."""
+        return self.exact or self.near_duplicates
+
+    def filter_retweets(self, records, trend_id, woeid):
+        """Returns the records that are not a retweet of a seen status, nor
+        a seen status, the rest of filters need the statuses rows.
+
+        Parameters
+        ----------
+        records : list of StatusRecord
+            Records of the statuses from a search response.
+        trend_id : str
+            Topic the statuses were found in.
+        woeid : int
+            Location the statuses were found in.
+
+        Returns
+        -------
+        list of StatusRecord
+            The records kept, in the same order.
+        """
+
+        if not self.retweets:
+            return records
+
+        now = time.monotonic()
+        self._seen_statuses.expire(now)
+
+        scope = (trend_id, woeid)
+        kept = []
+        for record in records:
+            if not self._seen_statuses.add(
+                    (scope, record.retweeted_id or record.id), now):
+                _RETWEETS.inc()
+                continue
+            kept.append(record)
+
+        return kept
+
+    def filter_rows(self, rows, fingerprints, trend_id, woeid):
+        """Returns the statuses rows whose content was not seen yet. Only
+        the fingerprints are compared, they are computed along with the
+        rows, so the text of the statuses is not processed again.
+
+        Parameters
+        ----------
+        rows : list of tuple
+            Rows of the records kept by ``filter_retweets``.
+        fingerprints : list of tuple or None
+            ``content_fingerprint`` of each row, ``None`` when
+            ``fingerprints`` is false.
+        trend_id : str
+            Topic the statuses were found in.
+        woeid : int
+            Location the statuses were found in.
+
+        Returns
+        -------
+        list of tuple
+            The rows kept, in the same order.
+        """
+
+        if not self.enabled:
+            return rows
+
+        if not self.fingerprints:
+            _KEPT.inc(len(rows))
+            return rows
+
+        now = time.monotonic()
+        self._seen_contents.expire(now)
+
+        scope = (trend_id, woeid)
+        kept = []
+        for row, fingerprint in zip(rows, fingerprints):
+            if fingerprint is not None:
+                content_hash, content_simhash = fingerprint
+
+                if self.exact and not self._seen_contents.add(
+                        (scope, content_hash), now):
+                    _EXACT.inc()
+                    continue
+
+                if self.near_duplicates and not self._similar.add(
+                        scope, content_simhash, now):
+                    _NEAR.inc()
+                    continue
+
+            kept.append(row)
+
+        _KEPT.inc(len(kept))
+        return kept
@@ -0,0 +1,280 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import json
+import sqlite3
+import time
+
+from sento_crawler.logger import get_logger
+from sento_crawler.resilience import call_with_retries, get_breaker
+from sento_crawler.settings import get_config
+from sento_crawler.transport import get_session
+
+USER_AGENT = 'sento-crawler'
+
+
+class GeocodeCache:
+    """On-disk cache of Nominatim search results indexed by location name
+    and country.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    ttl : int
+        Seconds after which a cached result expires.
+    """
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS nominatim_results (
+              name TEXT NOT NULL,
+              country TEXT NOT NULL,
+              result TEXT,
+              stored_at REAL NOT NULL,
+              PRIMARY KEY (name, country)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, name, country):
+        """Returns a tuple telling if there was a valid cached result and
+        the result itself, which may be ``None`` when Nominatim did not
+        find the location."""
+        row = self._conn.execute(
+            """
+            SELECT result, stored_at
+            FROM nominatim_results
+            WHERE name = ? AND country = ?
+            """,
+            (name, country)
+        ).fetchone()
+
+        if row is None or time.time() - row[1] > self.ttl:
+            return False, None
+
+        return True, json.loads(row[0])
+
+    def put(self, name, country, result):
+        self._conn.execute(
+            """
+            INSERT OR REPLACE INTO nominatim_results
+              (name, country, result, stored_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (name, country, json.dumps(result), time.time())
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class Geocoder:
+    """Obtains the geometry of the locations with trends and stores it,
+    avoiding database and Nominatim requests for already known locations.
+
+    Parameters
+    ----------
+    model : Model
+        Model used for storing the locations.
+    on_stored : callable, optional
+        Coroutine function called after storing locations in the
+        background.
+    """
+
+    def __init__(self, model, on_stored=None):
+        config = get_config()
+
+        self.model = model
+        self.logger = get_logger()
+        self.known_woeids = set()
+        self.search_url = config.GEOCODER_NOMINATIM_URL
+        self.timeout = config.RESILIENCE_NOMINATIM_TIMEOUT
+        self.breaker = get_breaker('nominatim')
+        self.cache = GeocodeCache(
+            config.GEOCODER_CACHE_PATH,
+            config.GEOCODER_CACHE_TTL
+        )
+        self.on_stored = on_stored
+        self._queue = asyncio.Queue()
+        self._pending = set()
+        self._worker = None  # type: asyncio.Task
+
+    async def warm(self):
+        """Loads the WOEIDs of the locations already stored."""
+        self.known_woeids = set(await self.model.get_location_ids())
+        self.logger.info('Loaded %d known locations', len(self.known_woeids))
+
+    def start(self):
+        """Starts the task storing the locations queued with ``put``."""
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._work())
+
+    def put(self, location):
+        """Queues a location for storing its geometry in the background if
+        it is not stored yet.
+
+        Parameters
+        ----------
+        location : dict
+            Location definition from twitter.
+        """
+
+        woeid = location.get('woeid')
+        if woeid in self.known_woeids or woeid in self._pending:
+            return
+
+        self._pending.add(woeid)
+        self._queue.put_nowait(location)
+
+    async def ensure_location(self, location):
+        """Queries the location geometry from Openstreetmap's nominatim
+        service and stores it in the database if it is not stored yet.
+
+        Parameters
+        ----------
+        location : dict
+            Location definition from twitter.
+        """
+
+        woeid = location.get('woeid')
+        if woeid in self.known_woeids:
+            return
+
+        osm_data = await self.search(
+            location.get('name'),
+            location.get('country')
+        )
+
+        if osm_data is None:
+            self.logger.warning(
+                'Nominatim returned no results for %s (WOEID %d)',
+                location.get('name'),
+                woeid
+            )
+            return
+
+        self.logger.debug(
+            'Storing location data for %s (WOEID %d) [%s, %s]',
+            osm_data.get('display_name'),
+            woeid,
+            osm_data.get('lon'),
+            osm_data.get('lat')
+        )
+
+        await self.model.store_location(osm_data, location)
+        self.known_woeids.add(woeid)
+
+    async def search(self, name, country):
+        """Searches a city in Nominatim, using the cached result if there is
+        a valid one.
+
+        Parameters
+        ----------
+        name : str
+            City name.
+        country : str
+            Country name.
+
+        Returns
+        -------
+        dict or None
+            The best result from Nominatim, ``None`` if there are none.
+        """
+
+        found, osm_data = self.cache.get(name, country)
+        if found:
+            return osm_data
+
+        self.logger.debug('Requesting location data for %s', name)
+
+        params = {
+            'format': 'json',
+            'city': name,
+            'polygon_geojson': 1,
+            'country': country,
+            'limit': 1
+        }
+
+        async def request():
+            async with get_session().get(
+                self.search_url,
+                params=params,
+                headers={'User-Agent': USER_AGENT}
+            ) as resp:
+                resp.raise_for_status()
+                return await resp.json()
+
+        data = await call_with_retries(request, self.timeout, self.breaker)
+
+        # Errors are returned as an object instead of a list of results
+        osm_data = data[0] if isinstance(data, list) and data else None
+        if osm_data is not None and not all(
+            osm_data.get(key) for key in ('geojson', 'lon', 'lat')
+        ):
+            osm_data = None
+
+        self.cache.put(name, country, osm_data)
+
+        return osm_data
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        self.cache.close()
+
+    async def _work(self):
+        stored = 0
+        while True:
+            location = await self._queue.get()
+            try:
+                await self.ensure_location(location)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                # The location is queued again with the next trends
+                self.logger.error(
+                    f'Exception ocurred storing location '
+                    f'{location.get("name")}: {err}'
+                )
+            finally:
+                self._pending.discard(location.get('woeid'))
+
+            stored += location.get('woeid') in self.known_woeids
+
+            # Notified once per batch of queued locations
+            if self.on_stored is not None and stored and self._queue.empty():
+                stored = 0
+                try:
+                    await self.on_stored()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    self.logger.error(
+                        f'Exception ocurred after storing locations: {err}'
+                    )
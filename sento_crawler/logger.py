@@ -14,6 +14,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import json
 import logging
 import time
 from logging.handlers import (QueueHandler, QueueListener,
@@ -30,23 +31,145 @@ LOG_FORMAT = (
     '%(module)s::%(funcName)s::%(lineno)d || %(message)s'
 )
 
+# Used when the caller's module, function and line are not looked up
+LOG_FORMAT_NO_CALLER = '%(asctime)-23s %(levelname)-8s || %(message)s'
+
 VALID_OUTPUTS = (
     'console',
     'daily_rotating_file'
 )
 
+VALID_FORMATS = (
+    'text',
+    'json'
+)
+
+# Attributes of every record, the rest are the fields passed with ``extra``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    'message',
+    'asctime',
+    'call_site'
+}
+
 _logger = None  # type: logging.Logger
 _queue_listener = None  # type: logging.handlers.QueueListener
 
 
+class CallSiteQueueHandler(QueueHandler):
+    """Queue handler keeping the unformatted message of each record, which
+    identifies the call site that logged it."""
+
+    def prepare(self, record):
+        record.call_site = record.msg
+        return super().prepare(record)
+
+
+class CallSiteSampler(logging.Filter):
+    """Lets through at most ``limit`` records below WARNING from each call
+    site every ``interval`` seconds. The number of dropped records is
+    added to the next record let through.
+
+    It is meant for the handlers of the queue listener, so the records are
+    sampled in the listener's thread.
+    """
+
+    def __init__(self, limit, interval):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.name, getattr(record, 'call_site', record.msg))
+        window = self._windows.get(key)
+        if window is None or record.created - window[0] >= self.interval:
+            dropped = window[2] if window is not None else 0
+            window = self._windows[key] = [record.created, 0, dropped]
+
+        if window[1] >= self.limit:
+            window[2] += 1
+            return False
+
+        window[1] += 1
+        if window[2]:
+            record.msg = f'{record.msg} ({window[2]} similar records dropped)'
+            window[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a JSON object in a single line, with the
+    fields passed with ``extra`` as keys of the object.
+
+    Parameters
+    ----------
+    caller_info : bool
+        Whether the module, function and line of the call are included.
+    """
+
+    def __init__(self, caller_info=True):
+        super().__init__()
+        self.caller_info = caller_info
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime(
+                '%Y-%m-%dT%H:%M:%S',
+                time.gmtime(record.created)
+            ) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if self.caller_info:
+            entry['caller'] = (
+                f'{record.module}::{record.funcName}::{record.lineno}'
+            )
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+
+        return json.dumps(entry, default=str)
+
+
+def _unknown_caller(*args, **kwargs):
+    return '(unknown file)', 0, '(unknown function)', None
+
+
+def set_caller_lookup(logger, enabled):
+    """Enables or disables looking up the file, function and line of the
+    records of a logger, the lookup walks the stack on every record. The
+    rest of loggers are not affected.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger whose records are created.
+    enabled : bool
+        Whether the caller is looked up.
+    """
+
+    if enabled:
+        logger.__dict__.pop('findCaller', None)
+    else:
+        logger.findCaller = _unknown_caller
+
+
 def _get_logging_settings():
     config = get_config()
     input_lvl = config.LOGGING_LEVEL
+    input_out_lvl = config.LOGGING_OUTPUT_LEVEL
     input_asyncio_lvl = config.ASYNCIO_LOGGING_LEVEL
     input_peony_lvl = config.PEONY_TWITTER_LOGGING_LEVEL
     input_out_dst = config.LOGGING_OUTPUT
+    input_format = config.LOGGING_FORMAT
 
     lvl = logging.getLevelName(input_lvl)
+    out_lvl = logging.getLevelName(input_out_lvl)
     asyncio_lvl = logging.getLevelName(input_asyncio_lvl)
     peony_lvl = logging.getLevelName(input_peony_lvl)
     out_dst = None  # type: str
@@ -56,11 +179,19 @@ def _get_logging_settings():
     else:
         raise ValueError('A valid logging output must be set.')
 
+    if input_format not in VALID_FORMATS:
+        raise ValueError('A valid logging format must be set.')
+
     return {
         'level': lvl,
+        'output_level': out_lvl,
         'asyncio_level': asyncio_lvl,
         'peony_level': peony_lvl,
-        'output': out_dst
+        'output': out_dst,
+        'format': input_format,
+        'caller_info': config.LOGGING_CALLER_INFO,
+        'sample_limit': config.LOGGING_SAMPLE_LIMIT,
+        'sample_interval': config.LOGGING_SAMPLE_INTERVAL
     }
 
 
@@ -78,8 +209,16 @@ def _setup_logging():
     asyncio_logger.setLevel(logging_cfg.get('asyncio_level'))
     peony_logger.setLevel(logging_cfg.get('peony_level'))
 
-    logger_formatter = logging.Formatter(LOG_FORMAT)
-    logger_formatter.converter = time.gmtime
+    set_caller_lookup(_logger, logging_cfg.get('caller_info'))
+
+    if logging_cfg.get('format') == 'json':
+        logger_formatter = JsonFormatter(logging_cfg.get('caller_info'))
+    else:
+        logger_formatter = logging.Formatter(
+            LOG_FORMAT if logging_cfg.get('caller_info')
+            else LOG_FORMAT_NO_CALLER
+        )
+        logger_formatter.converter = time.gmtime
     out_handler = None  # type: logging.Handler
 
     if logging_cfg.get('output') == VALID_OUTPUTS[0]:
@@ -94,11 +233,21 @@ def _setup_logging():
             utc=True
         )
 
-    out_handler.setLevel(logging.INFO)
+    out_handler.setLevel(logging_cfg.get('output_level'))
     out_handler.setFormatter(logger_formatter)
+    if logging_cfg.get('sample_limit'):
+        out_handler.addFilter(CallSiteSampler(
+            logging_cfg.get('sample_limit'),
+            logging_cfg.get('sample_interval')
+        ))
 
-    logger_handler = QueueHandler(log_queue)
-    _queue_listener = QueueListener(log_queue, out_handler)
+    logger_handler = CallSiteQueueHandler(log_queue)
+    # The listener ignores the handler's level unless told otherwise
+    _queue_listener = QueueListener(
+        log_queue,
+        out_handler,
+        respect_handler_level=True
+    )
 
     _logger.addHandler(logger_handler)
     asyncio_logger.addHandler(logger_handler)
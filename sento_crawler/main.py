@@ -1,7 +1,9 @@
 import asyncio
+import signal
 
 from peony.oauth import OAuth2Headers
 
+from sento_crawler import metrics, transport
 from sento_crawler.client import TwitterClient
 from sento_crawler.logger import get_logger, get_queue_listener
 from sento_crawler.settings import get_config
@@ -13,15 +15,70 @@ async def main():
 
     config = get_config()
 
-    client = TwitterClient(
-        consumer_key=config.TWITTER_CONSUMER_API_KEY,
-        consumer_secret=config.TWITTER_CONSUMER_API_SECRET_KEY,
-        auth=OAuth2Headers
+    # One client per credential, the first one also runs the tasks
+    clients = [
+        TwitterClient(
+            consumer_key=consumer_key,
+            consumer_secret=consumer_secret,
+            auth=OAuth2Headers
+        )
+        for consumer_key, consumer_secret in config.TWITTER_CREDENTIALS
+    ]
+    client = clients[0]
+
+    logger.info(
+        'Crawling %d countries with %d credentials',
+        len(config.SEARCH_WOEIDS),
+        len(clients)
     )
 
     await client.twitter_configuration
-    await client.create()
-    await client.run_tasks()
+    await client.create(clients)
+
+    metrics_runner = None
+    if config.METRICS_ENABLED:
+        metrics_runner = await metrics.start_server(
+            config.METRICS_HOST,
+            config.METRICS_PORT
+        )
+        logger.info(
+            'Serving metrics at http://%s:%d/metrics',
+            config.METRICS_HOST,
+            config.METRICS_PORT
+        )
+
+    # Stopping the tasks runs the cleanup below, so the statuses already
+    # extracted are written before exiting
+    tasks = asyncio.ensure_future(client.run_tasks())
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, tasks.cancel)
+
+    try:
+        await tasks
+    except asyncio.CancelledError:
+        logger.info('Stopping the crawler')
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+
+        # Statuses still buffered must be written before exiting
+        await client.status_buffer.close()
+        await client.save_state()
+        await client.geocoder.close()
+        client.normalizer.close()
+        if client.archive is not None:
+            client.archive.close()
+        # Released after the last checkpoints are written, so the crawlers
+        # taking the trends over resume from them
+        if client.lease_manager is not None:
+            await client.lease_manager.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await client.model.close()
+        for search_client in clients:
+            await search_client.close()
+        await transport.close_session()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,365 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import functools
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60
+)
+
+_registry = []  # type: list
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket', labels + (('le', repr(bound)),), cumulative
+        yield f'{name}_bucket', labels + (('le', '+Inf'),), self.count
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+class _Metric:
+    kind = None  # type: str
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Returns the child metric for the given label values, children
+        should be kept by callers in hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+        for values, child in self._children.items():
+            labels = tuple(zip(self.labelnames, values))
+            for name, sample_labels, value in child.samples(self.name, labels):
+                lines.append(f'{name}{_format_labels(sample_labels)} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            key,
+            str(value)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+def timed(histogram_child, in_flight=None):
+    """Decorator measuring the duration of a coroutine function.
+
+    Parameters
+    ----------
+    histogram_child : object
+        Histogram, or histogram child, observing the durations.
+    in_flight : object, optional
+        Gauge, or gauge child, counting the running calls.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if in_flight is not None:
+                in_flight.inc()
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram_child.observe(time.perf_counter() - start)
+                if in_flight is not None:
+                    in_flight.dec()
+        return wrapper
+    return decorator
+
+
+def generate_latest():
+    """Returns every metric in Prometheus' text exposition format."""
+    return '\n'.join(metric.expose() for metric in _registry) + '\n'
+
+
+async def _handle_metrics(request):
+    return web.Response(
+        body=generate_latest().encode('utf-8'),
+        headers={'Content-Type': CONTENT_TYPE}
+    )
+
+
+async def start_server(host, port):
+    """Serves the metrics at ``/metrics``.
+
+    Returns
+    -------
+    aiohttp.web.AppRunner
+        The server's runner, its ``cleanup`` method stops it.
+    """
+
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
+
+
+API_REQUEST_SECONDS = Histogram(
+    'sento_api_request_seconds',
+    'Duration of the requests to the Twitter API.',
+    ('endpoint',)
+)
+API_REQUESTS = Counter(
+    'sento_api_requests_total',
+    'Requests made to the Twitter API.',
+    ('endpoint', 'outcome')
+)
+API_RATE_LIMIT_REMAINING = Gauge(
+    'sento_api_rate_limit_remaining',
+    'Requests left in the current rate limit window.',
+    ('endpoint',)
+)
+CREDENTIAL_REQUESTS = Counter(
+    'sento_credential_requests_total',
+    'Rate limited requests sent with each Twitter credential.',
+    ('credential',)
+)
+CREDENTIAL_QUOTA_REMAINING = Gauge(
+    'sento_credential_quota_remaining',
+    'Requests left to each Twitter credential in its rate limit window.',
+    ('credential',)
+)
+DB_SECONDS = Histogram(
+    'sento_db_operation_seconds',
+    'Duration of the database operations.',
+    ('operation',)
+)
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    'sento_db_pool_acquire_seconds',
+    'Time waited for a database connection from the pool.',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+ROWS_WRITTEN = Counter(
+    'sento_rows_written_total',
+    'Rows inserted in each table.',
+    ('table',)
+)
+IN_FLIGHT = Gauge(
+    'sento_in_flight',
+    'Coroutines of each kind currently running.',
+    ('kind',)
+)
+CYCLE_SECONDS = Histogram(
+    'sento_cycle_seconds',
+    'Duration of each crawling cycle.',
+    ('cycle',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+BUFFER_FLUSH_ROWS = Histogram(
+    'sento_buffer_flush_rows',
+    'Statuses written in each flush of the statuses buffer.',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+BUFFER_FLUSH_SECONDS = Histogram(
+    'sento_buffer_flush_seconds',
+    'Duration of each flush of the statuses buffer.'
+)
+BUFFER_DEPTH = Gauge(
+    'sento_buffer_depth',
+    'Statuses waiting in the buffer to be written.'
+)
+BUFFER_DEAD_LETTERS = Counter(
+    'sento_buffer_dead_letters_total',
+    'Statuses rejected by the database and written to the dead letters.'
+)
+DUPLICATE_STATUSES = Counter(
+    'sento_duplicate_statuses_total',
+    'Statuses that were not written because they were already stored.'
+)
+ARCHIVED_STATUSES = Counter(
+    'sento_archived_statuses_total',
+    'Raw statuses written to the archive.'
+)
+ARCHIVE_DROPPED_PAGES = Counter(
+    'sento_archive_dropped_pages_total',
+    'Pages of statuses not archived because the archive queue was full.'
+)
+DEDUP_STATUSES = Counter(
+    'sento_dedup_statuses_total',
+    'Statuses kept or dropped by each duplicates filter.',
+    ('outcome',)
+)
+FANOUT_TRENDS = Counter(
+    'sento_fanout_trends_total',
+    'Trends crawled with a search shared with another location.'
+)
+SCHEDULER_DEPTH = Gauge(
+    'sento_scheduler_depth',
+    'Trends queued or being crawled.'
+)
+CIRCUIT_OPEN = Gauge(
+    'sento_circuit_open',
+    'Whether the requests to each upstream service are paused.',
+    ('upstream',)
+)
+TASK_RESTARTS = Counter(
+    'sento_task_restarts_total',
+    'Restarts of each crawling task after it failed.',
+    ('task',)
+)
+PARTITION_DEFAULT_ROWS = Counter(
+    'sento_partition_default_rows_total',
+    'Rows of each partitioned table stored in its default partition for '
+    'lack of a daily partition, moved once the partition was created.',
+    ('table',)
+)
+LEASES_OWNED = Gauge(
+    'sento_leases_owned',
+    'Work units leased by this crawler when the crawl is sharded.'
+)
+HTTP_CONNECTIONS = Counter(
+    'sento_http_connections_total',
+    'Connections to each host used by a request, new or reused.',
+    ('host', 'outcome')
+)
+HTTP_DNS_LOOKUPS = Counter(
+    'sento_http_dns_lookups_total',
+    'Lookups of the address of each host, resolved or cached.',
+    ('host', 'outcome')
+)
+HTTP_RESPONSES = Counter(
+    'sento_http_responses_total',
+    'Responses received from each host by content encoding.',
+    ('host', 'encoding')
+)
+TRENDS_REFRESHES = Counter(
+    'sento_trends_refreshes_total',
+    'Refreshes of the trends of a location by whether its ranking changed '
+    'and was stored.',
+    ('outcome',)
+)
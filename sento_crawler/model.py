@@ -14,21 +14,118 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import asyncio
 import json
-import re
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 import asyncpg
-from dateutil import parser, tz
 
+from sento_crawler import metrics
+from sento_crawler.normalizer import normalize_statuses
 from sento_crawler.settings import get_config
 
-_conn_pool = None  # type: asyncpg.pool.Pool
-_url_regex = (
-    r'[(http(s)?):\/\/(www\.)?a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b'
-    r'([-a-zA-Z0-9@:%_\+.~#?&//=]*)'
+VALID_INGEST_MODES = (
+    'insert',
+    'copy'
+)
+
+STATUS_COLUMNS = (
+    'id',
+    'wrote_at',
+    'fetched_at',
+    'content',
+    'topic_id',
+    'woeid'
 )
 
+# Tables owned by the crawler, the rest of the schema is created by
+# Sento API
+CRAWLER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS data.checkpoints (
+  topic_id text NOT NULL REFERENCES data.topics (id),
+  woeid integer NOT NULL,
+  since_id bigint NOT NULL,
+  updated_at timestamp NOT NULL,
+  PRIMARY KEY (topic_id, woeid)
+);
+
+CREATE TABLE IF NOT EXISTS data.crawler_workers (
+  id text PRIMARY KEY,
+  heartbeat_at timestamptz NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS data.work_units (
+  topic_id text NOT NULL REFERENCES data.topics (id),
+  woeid integer NOT NULL,
+  owner text,
+  expires_at timestamptz,
+  PRIMARY KEY (topic_id, woeid)
+);
+
+CREATE TABLE IF NOT EXISTS data.trend_visits (
+  topic_id text NOT NULL REFERENCES data.topics (id),
+  woeid integer NOT NULL,
+  visited_at timestamp NOT NULL,
+  PRIMARY KEY (topic_id, woeid)
+);
+
+CREATE TABLE IF NOT EXISTS data.trends_cycles (
+  woeid integer PRIMARY KEY,
+  finished_at timestamp NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS data.location_bounds (
+  woeid integer PRIMARY KEY,
+  name text,
+  longitude double precision NOT NULL,
+  latitude double precision NOT NULL,
+  radius_km double precision NOT NULL,
+  xmin double precision NOT NULL,
+  ymin double precision NOT NULL,
+  xmax double precision NOT NULL,
+  ymax double precision NOT NULL
+);
+"""
+
+# Computes the search circle and bounding box of the given locations once,
+# so reading them does not touch their geometry
+STORE_LOCATION_BOUNDS = """
+INSERT INTO data.location_bounds
+  (woeid, name, longitude, latitude, radius_km, xmin, ymin, xmax, ymax)
+SELECT
+  l.id,
+  l.name,
+  st_x (l.the_geom_point),
+  st_y (l.the_geom_point),
+  ceil(l.bcircle_radius / 1000),
+  st_xmin (l.the_geom),
+  st_ymin (l.the_geom),
+  st_xmax (l.the_geom),
+  st_ymax (l.the_geom)
+FROM
+  data.locations l
+WHERE
+  l.id = ANY ($1::integer[])
+  AND NOT EXISTS (
+    SELECT 1 FROM data.location_bounds b WHERE b.woeid = l.id
+  )
+ON CONFLICT (woeid) DO NOTHING
+"""
+
+# Advisory lock serializing the creation of the crawler tables when several
+# crawlers start at the same time
+SCHEMA_LOCK = 5310
+
+_conn_pool = None  # type: asyncpg.pool.Pool
+
+_POOL_ACQUIRE_SECONDS = metrics.DB_POOL_ACQUIRE_SECONDS
+_TOPICS_WRITTEN = metrics.ROWS_WRITTEN.labels('topics')
+_RANKINGS_WRITTEN = metrics.ROWS_WRITTEN.labels('rankings')
+_LOCATIONS_WRITTEN = metrics.ROWS_WRITTEN.labels('locations')
+_STATUSES_WRITTEN = metrics.ROWS_WRITTEN.labels('statuses')
+
 
 async def _get_conn_pool():
     global _conn_pool
@@ -44,99 +141,187 @@ async def _get_conn_pool():
     return _conn_pool
 
 
+def is_transient_error(err):
+    """Tells if a statement failed because of an error that may not happen
+    again: lost connections, timeouts, deadlocks, serialization failures
+    and a server out of resources or shutting down. Errors caused by the
+    data, like constraint violations, are not transient."""
+    return isinstance(err, (
+        OSError,
+        asyncio.TimeoutError,
+        asyncpg.exceptions.PostgresConnectionError,
+        asyncpg.exceptions.TransactionRollbackError,
+        asyncpg.exceptions.InsufficientResourcesError,
+        asyncpg.exceptions.OperatorInterventionError
+    ))
+
+
+def _inserted_rows(status):
+    # Command status of an INSERT: "INSERT 0 <rows>"
+    return int(status.split()[-1])
+
+
 class Model:
     @classmethod
     async def create(cls):
+        ingest_mode = get_config().POSTGRES_INGEST_MODE
+        if ingest_mode not in VALID_INGEST_MODES:
+            raise ValueError('A valid ingest mode must be set.')
+
+        cls.ingest_mode = ingest_mode
+        cls.simplify_tolerance = get_config().GEOCODER_SIMPLIFY_TOLERANCE
         cls.pool = await _get_conn_pool()
 
+        async with cls.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    'SELECT pg_advisory_xact_lock($1)',
+                    SCHEMA_LOCK
+                )
+                await conn.execute(CRAWLER_SCHEMA)
+
+    @asynccontextmanager
+    async def _acquire(self):
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            _POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
+            yield conn
+
     async def store_trends(self, location_woeid, trends):
+        await self.store_trends_batch({location_woeid: trends})
+
+    @metrics.timed(metrics.DB_SECONDS.labels('store_trends_batch'))
+    async def store_trends_batch(self, trends_by_location):
+        """Stores the topics and rankings of one or several locations
+        using a single transaction and two multi-row statements.
+
+        Parameters
+        ----------
+        trends_by_location : dict
+            Trends lists from twitter indexed by their location's WOEID.
+        """
+
         store_moment = datetime.utcnow()
+        topics = ([], [], [])
+        rankings = ([], [], [], [])
 
-        for idx, trend in enumerate(trends):
-            async with self.pool.acquire() as conn:
-                # Insert trend data if it does not exist on one transaction
-                async with conn.transaction():
-                    await conn.execute(
-                        """
-                        INSERT INTO data.topics (id, url, query_str)
-                        VALUES ($1, $2, $3)
-                        ON CONFLICT (id) DO NOTHING
-                        """,
-                        trend.name,
-                        trend.url,
-                        trend.query
-                    )
+        for location_woeid, trends in trends_by_location.items():
+            for idx, trend in enumerate(trends):
+                topics[0].append(trend.name)
+                topics[1].append(trend.url)
+                topics[2].append(trend.query)
 
-                # Insert trend's ranking data for the current location
-                # in another transaction
-                async with conn.transaction():
-                    await conn.execute(
-                        """
-                        INSERT INTO data.rankings
-                        (ranking_ts, ranking_no, woeid, tweet_volume, topic_id)
-                        VALUES
-                        ($1, $2, $3, $4, $5)
-                        """,
-                        store_moment,
-                        idx + 1,
-                        location_woeid,
-                        trend.tweet_volume,
-                        trend.name
-                    )
+                rankings[0].append(idx + 1)
+                rankings[1].append(location_woeid)
+                rankings[2].append(trend.tweet_volume)
+                rankings[3].append(trend.name)
 
-    async def get_relevant_trends_info(self):
-        results = None  # type: asyncpg.Record
-        async with self.pool.acquire() as conn:
+        if not topics[0]:
+            return
+
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                status = await conn.execute(
+                    """
+                    INSERT INTO data.topics (id, url, query_str)
+                    SELECT *
+                    FROM unnest($1::text[], $2::text[], $3::text[])
+                    ON CONFLICT (id) DO NOTHING
+                    """,
+                    *topics
+                )
+                _TOPICS_WRITTEN.inc(_inserted_rows(status))
+
+                await conn.execute(
+                    """
+                    INSERT INTO data.rankings
+                    (ranking_ts, ranking_no, woeid, tweet_volume, topic_id)
+                    SELECT $1, r.ranking_no, r.woeid, r.tweet_volume,
+                      r.topic_id
+                    FROM unnest(
+                      $2::integer[], $3::integer[], $4::bigint[], $5::text[]
+                    ) AS r (ranking_no, woeid, tweet_volume, topic_id)
+                    """,
+                    store_moment,
+                    *rankings
+                )
+                _RANKINGS_WRITTEN.inc(len(rankings[0]))
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_rankings_since'))
+    async def get_rankings_since(self, since):
+        async with self._acquire() as conn:
             results = await conn.fetch(
                 """
                 SELECT
-                  t.id AS id,
+                  r.topic_id AS id,
                   t.query_str AS query_str,
-                  l.name AS location_name,
-                  l.id AS woeid,
-                  st_x (l.the_geom_point) AS longitude,
-                  st_y (l.the_geom_point) AS latitude,
-                  ceil(l.bcircle_radius / 1000) AS radius_km
-                FROM ( SELECT DISTINCT
-                    topic_id,
-                    woeid
-                  FROM
-                    data.rankings
-                  WHERE
-                    ranking_ts BETWEEN now() - interval '12 hours'
-                    AND now()) r
+                  r.woeid AS woeid,
+                  min(r.ranking_no) AS best_rank,
+                  max(r.tweet_volume) AS tweet_volume,
+                  max(r.ranking_ts) AS last_seen
+                FROM
+                  data.rankings r
                   JOIN data.topics t ON r.topic_id = t.id
-                  JOIN data.locations l ON r.woeid = l.id
-                """
+                WHERE
+                  r.ranking_ts > $1
+                GROUP BY
+                  r.topic_id,
+                  t.query_str,
+                  r.woeid
+                """,
+                since
             )
         return results
 
-    async def check_location_existence(self, woeid):
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval(
+    @metrics.timed(metrics.DB_SECONDS.labels('get_locations_info'))
+    async def get_locations_info(self, woeids):
+        async with self._acquire() as conn:
+            # Locations stored by other means than store_location
+            await conn.execute(STORE_LOCATION_BOUNDS, woeids)
+            results = await conn.fetch(
                 """
                 SELECT
-                  exists(
-                    SELECT 1
-                    FROM
-                      data.locations l
-                    WHERE
-                      l.id = $1
-                  )
+                  b.woeid,
+                  b.name AS location_name,
+                  b.longitude,
+                  b.latitude,
+                  b.radius_km
+                FROM
+                  data.location_bounds b
+                WHERE
+                  b.woeid = ANY ($1::integer[])
                 """,
-                woeid
+                woeids
+            )
+        return results
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_location_ids'))
+    async def get_location_ids(self):
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                """
+                SELECT l.id
+                FROM data.locations l
+                """
             )
+        return [r['id'] for r in results]
 
+    @metrics.timed(metrics.DB_SECONDS.labels('store_location'))
     async def store_location(self, osm_data, twitter_data):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.transaction():
-                await conn.execute(
+                # The geometry is simplified, city boundaries from
+                # Nominatim may have tens of thousands of vertices
+                status = await conn.execute(
                     """
                     INSERT INTO data.locations
                       (id, the_geom, the_geom_point, name, osm_name)
                     VALUES (
                       $1,
-                      ST_Multi(ST_SetSRID(ST_GeomFromGeoJSON($2), 4326)),
+                      ST_Multi(ST_SimplifyPreserveTopology(
+                        ST_SetSRID(ST_GeomFromGeoJSON($2), 4326),
+                        $7
+                      )),
                       ST_SetSRID(ST_MakePoint($3, $4), 4326),
                       $5,
                       $6
@@ -148,29 +333,612 @@ class Model:
                     float(osm_data.get('lon')),
                     float(osm_data.get('lat')),
                     twitter_data.get('name'),
-                    osm_data.get('display_name')
+                    osm_data.get('display_name'),
+                    self.simplify_tolerance
+                )
+                await conn.execute(
+                    STORE_LOCATION_BOUNDS,
+                    [twitter_data.get('woeid')]
                 )
+                _LOCATIONS_WRITTEN.inc(_inserted_rows(status))
+
+    def build_status_rows(self, tweets, trend_id, woeid):
+        return normalize_statuses(tweets, trend_id, woeid)
 
     async def store_tweets(self, tweets, trend_id, woeid):
-        async with self.pool.acquire() as conn:
+        await self.store_statuses(
+            self.build_status_rows(tweets, trend_id, woeid)
+        )
+
+    @metrics.timed(metrics.DB_SECONDS.labels('store_statuses'))
+    async def store_statuses(self, rows, since_ids=None):
+        """Stores statuses rows and advances the checkpoints of their
+        topics and locations in the same transaction.
+
+        Parameters
+        ----------
+        rows : list of tuple
+            Rows following the order of ``STATUS_COLUMNS``.
+        since_ids : dict, optional
+            Checkpoints indexed by topic id and WOEID, by default the
+            newest status of each topic and location in the rows.
+
+        Returns
+        -------
+        int
+            Number of rows inserted, the rest were already stored.
+        """
+
+        if since_ids is None:
+            since_ids = {}
+            for row in rows:
+                key = (row[4], row[5])
+                if row[0] > since_ids.get(key, 0):
+                    since_ids[key] = row[0]
+
+        if not rows and not since_ids:
+            return 0
+
+        inserted = 0
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if rows and self.ingest_mode == 'copy':
+                    inserted = await self._copy_statuses(conn, rows)
+                elif rows:
+                    inserted = await self._insert_statuses(conn, rows)
+
+                if since_ids:
+                    await self._store_checkpoints(conn, since_ids)
+
+        _STATUSES_WRITTEN.inc(inserted)
+        return inserted
+
+    @metrics.timed(metrics.DB_SECONDS.labels('store_trend_visits'))
+    async def store_trend_visits(self, visits):
+        """Records when each trend in a location was last crawled.
+
+        Parameters
+        ----------
+        visits : dict
+            Time of the last visit indexed by topic id and WOEID.
+        """
+
+        if not visits:
+            return
+
+        topic_ids, woeids = zip(*visits.keys())
+        async with self._acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO data.trend_visits (topic_id, woeid, visited_at)
+                SELECT v.topic_id, v.woeid, v.visited_at
+                FROM unnest($1::text[], $2::integer[], $3::timestamp[])
+                  AS v (topic_id, woeid, visited_at)
+                ON CONFLICT (topic_id, woeid) DO UPDATE
+                SET visited_at = greatest(data.trend_visits.visited_at,
+                                          excluded.visited_at)
+                """,
+                topic_ids,
+                woeids,
+                list(visits.values())
+            )
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_trend_visits'))
+    async def get_trend_visits(self):
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                """
+                SELECT v.topic_id, v.woeid, v.visited_at
+                FROM data.trend_visits v
+                WHERE v.visited_at > now() - interval '12 hours'
+                """
+            )
+        return {
+            (r['topic_id'], r['woeid']): r['visited_at'] for r in results
+        }
+
+    @metrics.timed(metrics.DB_SECONDS.labels('store_trends_cycle'))
+    async def store_trends_cycle(self, woeids):
+        """Records that the trends of the given countries were just
+        extracted."""
+        async with self._acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO data.trends_cycles (woeid, finished_at)
+                SELECT unnest($1::integer[]), $2
+                ON CONFLICT (woeid) DO UPDATE
+                SET finished_at = excluded.finished_at
+                """,
+                woeids,
+                datetime.utcnow()
+            )
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_trends_cycles'))
+    async def get_trends_cycles(self, woeids):
+        """Returns when the trends of each of the given countries were last
+        extracted, the countries never crawled are missing."""
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                """
+                SELECT c.woeid, c.finished_at
+                FROM data.trends_cycles c
+                WHERE c.woeid = any($1::integer[])
+                """,
+                woeids
+            )
+        return {r['woeid']: r['finished_at'] for r in results}
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_checkpoints'))
+    async def get_checkpoints(self):
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                """
+                SELECT c.topic_id, c.woeid, c.since_id
+                FROM data.checkpoints c
+                WHERE c.updated_at > now() - interval '12 hours'
+                """
+            )
+        return {(r['topic_id'], r['woeid']): r['since_id'] for r in results}
+
+    @metrics.timed(metrics.DB_SECONDS.labels('renew_leases'))
+    async def renew_leases(self, worker_id, units, ttl):
+        """Registers the work units not registered yet, records the
+        worker's heartbeat and extends the leases it holds.
+
+        Parameters
+        ----------
+        worker_id : str
+            Identifier of the crawler process.
+        units : iterable of tuple
+            Topic id and WOEID of the work units known by the worker.
+        ttl : float
+            Seconds the leases and the heartbeat are valid for.
+
+        Returns
+        -------
+        tuple of set, int and int
+            Keys of the units leased by the worker, number of live workers
+            and number of registered units.
+        """
+
+        # Sorted so concurrent registrations lock the rows in one order
+        units = sorted(units)
+
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if units:
+                    await conn.execute(
+                        """
+                        INSERT INTO data.work_units (topic_id, woeid)
+                        SELECT *
+                        FROM unnest($1::text[], $2::integer[])
+                        ON CONFLICT (topic_id, woeid) DO NOTHING
+                        """,
+                        *zip(*units)
+                    )
+
+                await conn.execute(
+                    """
+                    DELETE FROM data.crawler_workers
+                    WHERE heartbeat_at < now() - make_interval(secs => $1)
+                    """,
+                    float(ttl)
+                )
+                await conn.execute(
+                    """
+                    INSERT INTO data.crawler_workers (id, heartbeat_at)
+                    VALUES ($1, now())
+                    ON CONFLICT (id) DO UPDATE
+                    SET heartbeat_at = excluded.heartbeat_at
+                    """,
+                    worker_id
+                )
+
+                owned = await conn.fetch(
+                    """
+                    UPDATE data.work_units
+                    SET expires_at = now() + make_interval(secs => $2)
+                    WHERE owner = $1
+                    RETURNING topic_id, woeid
+                    """,
+                    worker_id,
+                    float(ttl)
+                )
+                counts = await conn.fetchrow(
+                    """
+                    SELECT
+                      (SELECT count(*) FROM data.crawler_workers) AS workers,
+                      (SELECT count(*) FROM data.work_units) AS units
+                    """
+                )
+
+        return (
+            {(r['topic_id'], r['woeid']) for r in owned},
+            counts['workers'],
+            counts['units']
+        )
+
+    @metrics.timed(metrics.DB_SECONDS.labels('claim_leases'))
+    async def claim_leases(self, worker_id, limit, ttl):
+        """Leases work units that are free or whose lease has expired,
+        skipping those being claimed by other workers.
+
+        Returns
+        -------
+        dict
+            Checkpointed since_id, or ``None``, of each claimed unit indexed
+            by its topic id and WOEID.
+        """
+
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                """
+                UPDATE data.work_units w
+                SET
+                  owner = $1,
+                  expires_at = now() + make_interval(secs => $3)
+                FROM (
+                  SELECT topic_id, woeid
+                  FROM data.work_units
+                  WHERE owner IS NULL OR expires_at < now()
+                  LIMIT $2
+                  FOR UPDATE SKIP LOCKED
+                ) free
+                WHERE w.topic_id = free.topic_id AND w.woeid = free.woeid
+                RETURNING
+                  w.topic_id,
+                  w.woeid,
+                  (
+                    SELECT c.since_id
+                    FROM data.checkpoints c
+                    WHERE c.topic_id = w.topic_id AND c.woeid = w.woeid
+                  ) AS since_id
+                """,
+                worker_id,
+                limit,
+                float(ttl)
+            )
+        return {(r['topic_id'], r['woeid']): r['since_id'] for r in results}
+
+    @metrics.timed(metrics.DB_SECONDS.labels('release_leases'))
+    async def release_leases(self, worker_id, units):
+        """Frees the given units leased by the worker so other workers can
+        claim them."""
+        async with self._acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE data.work_units w
+                SET owner = NULL, expires_at = NULL
+                FROM unnest($2::text[], $3::integer[]) AS u (topic_id, woeid)
+                WHERE
+                  w.owner = $1
+                  AND w.topic_id = u.topic_id
+                  AND w.woeid = u.woeid
+                """,
+                worker_id,
+                *zip(*units)
+            )
+
+    @metrics.timed(metrics.DB_SECONDS.labels('drop_leases'))
+    async def drop_leases(self, worker_id, units, relevance_window):
+        """Deletes the given units leased by the worker whose trend has not
+        been ranked within the relevance window by any crawler.
+
+        Returns
+        -------
+        set of tuple
+            Topic id and WOEID of the deleted units.
+        """
+
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                """
+                DELETE FROM data.work_units w
+                USING unnest($2::text[], $3::integer[]) AS u (topic_id, woeid)
+                WHERE
+                  w.owner = $1
+                  AND w.topic_id = u.topic_id
+                  AND w.woeid = u.woeid
+                  AND NOT EXISTS (
+                    SELECT 1
+                    FROM data.rankings r
+                    WHERE
+                      r.topic_id = w.topic_id
+                      AND r.woeid = w.woeid
+                      AND r.ranking_ts > now() - make_interval(secs => $4)
+                  )
+                RETURNING w.topic_id, w.woeid
+                """,
+                worker_id,
+                *zip(*units),
+                float(relevance_window)
+            )
+        return {(r['topic_id'], r['woeid']) for r in results}
+
+    async def remove_worker(self, worker_id):
+        """Frees every unit leased by the worker and forgets it."""
+        async with self._acquire() as conn:
             async with conn.transaction():
-                await conn.executemany(
+                await conn.execute(
                     """
-                    INSERT INTO data.statuses
-                      (id, wrote_at, fetched_at, content, topic_id, woeid)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                    ON CONFLICT (id, topic_id, woeid) DO NOTHING
+                    UPDATE data.work_units
+                    SET owner = NULL, expires_at = NULL
+                    WHERE owner = $1
                     """,
-                    [
-                        (
-                            x.id,
-                            parser.parse(x.created_at).astimezone(tz.tzutc())
-                            .replace(tzinfo=None),
-                            datetime.utcnow(),
-                            re.sub(_url_regex, '', x.text),
-                            trend_id,
-                            woeid
-                        )
-                        for x in tweets
-                    ]
+                    worker_id
+                )
+                await conn.execute(
+                    'DELETE FROM data.crawler_workers WHERE id = $1',
+                    worker_id
+                )
+
+    async def try_advisory_lock(self, key):
+        """Tries to take a session level advisory lock.
+
+        Parameters
+        ----------
+        key : tuple of int
+            The lock's two keys.
+
+        Returns
+        -------
+        asyncpg.Connection or None
+            The connection holding the lock, which has to be kept until the
+            lock is released with ``release_advisory_lock``, ``None`` if
+            the lock is held by another session.
+        """
+
+        conn = await self.pool.acquire()
+        try:
+            locked = await conn.fetchval(
+                'SELECT pg_try_advisory_lock($1, $2)',
+                *key
+            )
+        except Exception:
+            await self.pool.release(conn)
+            raise
+
+        if not locked:
+            await self.pool.release(conn)
+            return None
+
+        return conn
+
+    async def release_advisory_lock(self, conn):
+        # Connections returned to the pool are reset, which releases
+        # every advisory lock held by their session
+        await self.pool.release(conn)
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_partitions'))
+    async def get_partitions(self, table):
+        """Returns the names of the partitions of a table, ``None`` when the
+        table is not partitioned."""
+        async with self._acquire() as conn:
+            partitioned = await conn.fetchval(
+                """
+                SELECT EXISTS (
+                  SELECT 1
+                  FROM pg_partitioned_table p
+                  WHERE p.partrelid = to_regclass($1)
+                )
+                """,
+                table
+            )
+            if not partitioned:
+                return None
+
+            results = await conn.fetch(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                  JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass($1)
+                """,
+                table
+            )
+        return [r['relname'] for r in results]
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_default_partition'))
+    async def get_default_partition(self, table):
+        """Returns the name of the default partition of a table, ``None``
+        when it has none."""
+        async with self._acquire() as conn:
+            return await conn.fetchval(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                  JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass($1)
+                  AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+                """,
+                table
+            )
+
+    @metrics.timed(metrics.DB_SECONDS.labels('get_partition_days'))
+    async def get_partition_days(self, table, name, key):
+        """Returns the days of the rows stored in a partition of a table.
+
+        Parameters
+        ----------
+        table : str
+            Schema qualified name of the partitioned table.
+        name : str
+            Name of the partition.
+        key : str
+            Partition key column of the table.
+        """
+
+        schema = table.split('.')[0]
+        async with self._acquire() as conn:
+            results = await conn.fetch(
+                f"""
+                SELECT DISTINCT date_trunc('day', {key})::date AS day
+                FROM {schema}.{name}
+                """
+            )
+        return [r['day'] for r in results]
+
+    @metrics.timed(metrics.DB_SECONDS.labels('create_partition'))
+    async def create_partition(self, table, name, start, end, key=None,
+                               default=None):
+        """Creates a range partition of a table in its schema. When the table
+        has a default partition, the rows of the range stored there are
+        moved to the new partition before attaching it, as PostgreSQL
+        refuses to attach it otherwise.
+
+        Parameters
+        ----------
+        table : str
+            Schema qualified name of the partitioned table.
+        name : str
+            Name of the partition.
+        start : datetime.date
+            First day in the partition.
+        end : datetime.date
+            Day after the last day in the partition.
+        key : str, optional
+            Partition key column of the table, needed with ``default``.
+        default : str, optional
+            Name of the default partition of the table.
+
+        Returns
+        -------
+        int
+            Number of rows moved from the default partition.
+        """
+
+        schema = table.split('.')[0]
+        bounds = f"""
+            FOR VALUES FROM ('{start.isoformat()}')
+            TO ('{end.isoformat()}')
+        """
+
+        async with self._acquire() as conn:
+            if default is None:
+                await conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {schema}.{name}
+                    PARTITION OF {table}
+                    {bounds}
+                    """
+                )
+                return 0
+
+            async with conn.transaction():
+                # The rows of the range can't be stored in the default
+                # partition while they are moved
+                await conn.execute(
+                    f'LOCK TABLE {schema}.{default} IN ACCESS EXCLUSIVE MODE'
+                )
+                await conn.execute(
+                    f"""
+                    CREATE TABLE {schema}.{name}
+                    (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                    """
+                )
+                status = await conn.execute(
+                    f"""
+                    WITH moved AS (
+                      DELETE FROM {schema}.{default}
+                      WHERE {key} >= '{start.isoformat()}'
+                        AND {key} < '{end.isoformat()}'
+                      RETURNING *
+                    )
+                    INSERT INTO {schema}.{name}
+                    SELECT * FROM moved
+                    """
+                )
+                await conn.execute(
+                    f"""
+                    ALTER TABLE {table}
+                    ATTACH PARTITION {schema}.{name}
+                    {bounds}
+                    """
+                )
+
+        return _inserted_rows(status)
+
+    @metrics.timed(metrics.DB_SECONDS.labels('detach_partition'))
+    async def detach_partition(self, table, name, drop):
+        """Detaches a partition from a table, dropping it if requested."""
+        schema = table.split('.')[0]
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    f'ALTER TABLE {table} DETACH PARTITION {schema}.{name}'
                 )
+                if drop:
+                    await conn.execute(f'DROP TABLE {schema}.{name}')
+
+    async def close(self):
+        """Closes the connection pool, waiting for the connections in use
+        to be released."""
+        global _conn_pool
+
+        await self.pool.close()
+        _conn_pool = None
+
+    async def _store_checkpoints(self, conn, since_ids):
+        topic_ids, woeids = zip(*since_ids.keys())
+        await conn.execute(
+            """
+            INSERT INTO data.checkpoints
+              (topic_id, woeid, since_id, updated_at)
+            SELECT c.topic_id, c.woeid, c.since_id, $4
+            FROM unnest($1::text[], $2::integer[], $3::bigint[])
+              AS c (topic_id, woeid, since_id)
+            ON CONFLICT (topic_id, woeid) DO UPDATE
+            SET
+              since_id = greatest(data.checkpoints.since_id,
+                                  excluded.since_id),
+              updated_at = excluded.updated_at
+            """,
+            topic_ids,
+            woeids,
+            list(since_ids.values()),
+            datetime.utcnow()
+        )
+
+    async def _insert_statuses(self, conn, rows):
+        status = await conn.execute(
+            """
+            INSERT INTO data.statuses
+              (id, wrote_at, fetched_at, content, topic_id, woeid)
+            SELECT *
+            FROM unnest(
+              $1::bigint[], $2::timestamp[], $3::timestamp[], $4::text[],
+              $5::text[], $6::integer[]
+            )
+            ON CONFLICT DO NOTHING
+            """,
+            *zip(*rows)
+        )
+        return _inserted_rows(status)
+
+    async def _copy_statuses(self, conn, rows):
+        # The staging table lives as long as the pooled connection does
+        # and it is emptied on every commit
+        await conn.execute(
+            """
+            CREATE TEMPORARY TABLE IF NOT EXISTS statuses_staging
+            ON COMMIT DELETE ROWS AS
+            SELECT id, wrote_at, fetched_at, content, topic_id, woeid
+            FROM data.statuses
+            WITH NO DATA
+            """
+        )
+        await conn.copy_records_to_table(
+            'statuses_staging',
+            records=rows,
+            columns=STATUS_COLUMNS
+        )
+        status = await conn.execute(
+            """
+            INSERT INTO data.statuses
+              (id, wrote_at, fetched_at, content, topic_id, woeid)
+            SELECT id, wrote_at, fetched_at, content, topic_id, woeid
+            FROM statuses_staging
+            ON CONFLICT DO NOTHING
+            """
+        )
+        return _inserted_rows(status)
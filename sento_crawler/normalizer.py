@@ -0,0 +1,361 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import multiprocessing
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from dateutil import parser, tz
+
+from sento_crawler.dedup import content_fingerprint
+
+URL_REGEX = re.compile(r'\b(?:https?://|www\.)\S+')
+
+# Entities whose indices point to links inside the status text
+URL_ENTITIES = (
+    'urls',
+    'media'
+)
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+
+class StatusRecord(namedtuple(
+        'StatusRecord',
+        ('id', 'created_at', 'text', 'url_spans', 'retweeted_id',
+         'point'))):
+    """Fields of a status needed for storing it, extracted from a search
+    page so the rest of the page can be freed right away. ``url_spans``
+    holds the start and end indices of the links in the text,
+    ``retweeted_id`` the id of the retweeted status and ``point`` the
+    longitude and latitude of the status, if any.
+    """
+
+    __slots__ = ()
+
+
+def url_spans(entities):
+    """Returns the sorted indices of the links in a status text.
+
+    Parameters
+    ----------
+    entities : dict or None
+        Status entities.
+
+    Returns
+    -------
+    tuple of tuple
+        Start and end of each link.
+    """
+
+    if not entities:
+        return ()
+
+    return tuple(sorted(
+        tuple(entity['indices'])
+        for key in URL_ENTITIES
+        for entity in entities.get(key) or ()
+        if entity.get('indices')
+    ))
+
+
+def status_text(status):
+    """Returns the full text of a status and the sorted spans of its links.
+
+    Statuses are requested in extended mode, so their text is in
+    ``full_text``. The text of a retweet is truncated, the full text of
+    the retweeted status is used instead with the same ``RT @user:``
+    prefix.
+
+    Parameters
+    ----------
+    status : dict
+        Status from a search response.
+
+    Returns
+    -------
+    tuple of str and tuple
+        The text and the start and end of each link in it.
+    """
+
+    retweeted = status.get('retweeted_status')
+    if retweeted:
+        prefix = 'RT @{}: '.format(
+            (retweeted.get('user') or {}).get('screen_name', '')
+        )
+        text, spans = status_text(retweeted)
+        offset = len(prefix)
+        return (
+            prefix + text,
+            tuple((start + offset, end + offset) for start, end in spans)
+        )
+
+    text = status.get('full_text') or status.get('text') or ''
+    return text, url_spans(status.get('entities'))
+
+
+def strip_spans(text, spans):
+    """Removes the given sorted spans from a status text, the links are
+    searched with a regular expression when there are none."""
+
+    if not spans:
+        return URL_REGEX.sub('', text)
+
+    # Twitter's indices are code point offsets, the same as Python's, of
+    # the text before escaping "&", "<" and ">", which is kept escaped
+    escaped = '&' in text
+    if escaped:
+        text = _unescape(text)
+
+    parts = []
+    position = 0
+    for start, end in spans:
+        if start >= position:
+            parts.append(text[position:start])
+            position = end
+    parts.append(text[position:])
+
+    text = ''.join(parts)
+    return _escape(text) if escaped else text
+
+
+def _unescape(text):
+    # Only the entities Twitter escapes, "&amp;" last so "&amp;lt;" is
+    # unescaped to "&lt;"
+    return text.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def parse_created_at(value):
+    """Parses the ``created_at`` field of a status into a naive UTC
+    datetime.
+
+    Twitter always uses the format ``Wed Mar 13 12:30:00 +0000 2019``, the
+    generic parser is only used when the value does not match it.
+
+    Parameters
+    ----------
+    value : str
+        Status creation date.
+
+    Returns
+    -------
+    datetime.datetime
+        The creation date in UTC without timezone information.
+    """
+
+    try:
+        _, month, day, hms, offset, year = value.split(' ')
+        if offset == '+0000':
+            hour, minute, second = hms.split(':')
+            return datetime(
+                int(year), MONTHS[month], int(day),
+                int(hour), int(minute), int(second)
+            )
+    except (ValueError, KeyError):
+        pass
+
+    return parser.parse(value).astimezone(tz.tzutc()).replace(tzinfo=None)
+
+
+def normalize_statuses(statuses, trend_id, woeid, fetched_at=None):
+    """Builds the ``data.statuses`` rows for a batch of statuses.
+
+    Parameters
+    ----------
+    statuses : list of dict
+        Statuses from a search response.
+    trend_id : str
+        Topic the statuses were found in.
+    woeid : int
+        Location the statuses were found in.
+    fetched_at : datetime.datetime, optional
+        Moment the batch was fetched, defaults to the current UTC time.
+
+    Returns
+    -------
+    list of tuple
+        Rows following the order of ``model.STATUS_COLUMNS``.
+    """
+
+    return normalize_records(
+        status_records(statuses),
+        trend_id,
+        woeid,
+        fetched_at or datetime.utcnow()
+    )
+
+
+def normalize_records(records, trend_id, woeid, fetched_at):
+    """Builds the ``data.statuses`` rows from the records returned by
+    ``status_records``, it also runs in the normalizer processes.
+    """
+    return [
+        (
+            record.id,
+            parse_created_at(record.created_at),
+            fetched_at,
+            strip_spans(record.text, record.url_spans),
+            trend_id,
+            woeid
+        )
+        for record in records
+    ]
+
+
+def normalize_page(records, trend_id, woeid, fetched_at, fingerprints):
+    """Builds the ``data.statuses`` rows from the records returned by
+    ``status_records`` and, if requested, the ``content_fingerprint`` of
+    each row used for dropping duplicates, it also runs in the normalizer
+    processes.
+    """
+
+    rows = normalize_records(records, trend_id, woeid, fetched_at)
+    if not fingerprints:
+        return rows, None
+    return rows, [content_fingerprint(row[3]) for row in rows]
+
+
+def status_records(statuses):
+    """Extracts the ``StatusRecord`` of each status in a search page.
+
+    Parameters
+    ----------
+    statuses : list of dict
+        Statuses from a search response.
+
+    Returns
+    -------
+    list of StatusRecord
+        The records, in the same order.
+    """
+
+    return [
+        StatusRecord(
+            status['id'],
+            status['created_at'],
+            *status_text(status),
+            (status.get('retweeted_status') or {}).get('id'),
+            status_point(status)
+        )
+        for status in statuses
+    ]
+
+
+def status_point(status):
+    """Returns the longitude and latitude of a status, from its exact
+    coordinates or from the center of its place, ``None`` when it has no
+    location."""
+
+    coordinates = status.get('coordinates')
+    if coordinates:
+        lon, lat = coordinates['coordinates']
+        return lon, lat
+
+    place = status.get('place')
+    box = place and (place.get('bounding_box') or {}).get('coordinates')
+    if box:
+        corners = box[0]
+        return (
+            sum(corner[0] for corner in corners) / len(corners),
+            sum(corner[1] for corner in corners) / len(corners)
+        )
+
+    return None
+
+
+class NormalizerPool:
+    """Normalizes the pages of statuses in worker processes, keeping the
+    regular expressions, date parsing and content fingerprints out of the
+    event loop.
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker processes, with 0 the statuses are normalized in
+        the event loop.
+    max_pending : int
+        Pages that may be waiting for or being normalized before the
+        callers are paused.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self._executor = None  # type: ProcessPoolExecutor
+        self._pending = asyncio.Semaphore(max(max_pending, 1))
+
+        if workers > 0:
+            # Forked so the workers share the crawler's hash seed, which
+            # the content fingerprints depend on
+            self._executor = ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context('fork')
+            )
+
+    async def normalize(self, records, trend_id, woeid, fingerprints=False):
+        """Builds the ``data.statuses`` rows for a page of statuses.
+
+        Parameters
+        ----------
+        records : list of StatusRecord
+            Records of the statuses from a search response.
+        trend_id : str
+            Topic the statuses were found in.
+        woeid : int
+            Location the statuses were found in.
+        fingerprints : bool, optional
+            Whether the ``content_fingerprint`` of each row is computed.
+
+        Returns
+        -------
+        tuple of list and list or None
+            Rows following the order of ``model.STATUS_COLUMNS`` and their
+            fingerprints, ``None`` when they were not requested.
+        """
+
+        if self._executor is None or not records:
+            return normalize_page(
+                records,
+                trend_id,
+                woeid,
+                datetime.utcnow(),
+                fingerprints
+            )
+
+        async with self._pending:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                normalize_page,
+                records,
+                trend_id,
+                woeid,
+                datetime.utcnow(),
+                fingerprints
+            )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,188 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import re
+from datetime import datetime, timedelta
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+
+# Tables partitioned by day and their partition key, data.statuses by the
+# day its statuses were written and data.rankings by the day the rankings
+# were stored
+PARTITIONED_TABLES = {
+    'data.statuses': 'wrote_at',
+    'data.rankings': 'ranking_ts'
+}
+
+# Twitter's standard search returns statuses written up to this many days
+# ago, their partitions must exist
+LOOKBACK_DAYS = 7
+
+_PARTITION_NAME = re.compile(r'_p(\d{8})$')
+
+
+def partition_name(table, day):
+    """Returns the name of the partition of a table holding a day."""
+    return f'{table.split(".")[-1]}_p{day:%Y%m%d}'
+
+
+class PartitionManager:
+    """Keeps the daily partitions of the partitioned tables: the partitions
+    of the coming days are created in advance and the partitions older
+    than the retention are detached or dropped.
+
+    The rows stored in the default partition because their day had no
+    partition are moved to the day's partition once it is created, the
+    days found there get their partition too, so they are expired along
+    with the rest.
+
+    The tables are partitioned by the deployment, the tables that are not
+    partitioned are left untouched.
+
+    Parameters
+    ----------
+    model : Model
+        Model used for managing the partitions.
+    days_ahead : int
+        Days after today whose partitions are created in advance.
+    retention_days : int
+        Days whose partitions are kept, including today.
+    drop_expired : bool
+        Whether expired partitions are dropped instead of only detached.
+    """
+
+    def __init__(self, model, days_ahead, retention_days, drop_expired):
+        if retention_days < 1:
+            raise ValueError('The retention must be at least one day.')
+
+        self.model = model
+        self.logger = get_logger()
+        self.days_ahead = days_ahead
+        self.retention_days = retention_days
+        self.drop_expired = drop_expired
+        self._unpartitioned = set()
+
+    async def maintain(self):
+        """Creates the missing partitions and expires the old ones of every
+        partitioned table."""
+        today = datetime.utcnow().date()
+
+        for table, key in PARTITIONED_TABLES.items():
+            partitions = await self.model.get_partitions(table)
+
+            if partitions is None:
+                if table not in self._unpartitioned:
+                    self._unpartitioned.add(table)
+                    self.logger.warning(
+                        '%s is not partitioned, its retention is not managed',
+                        table
+                    )
+                continue
+
+            default = await self.model.get_default_partition(table)
+            partitions = set(partitions)
+            partitions.update(await self._create_partitions(
+                table,
+                key,
+                partitions,
+                default,
+                today
+            ))
+            await self._expire_partitions(table, partitions, today)
+
+    async def _create_partitions(self, table, key, partitions, default,
+                                 today):
+        first = today - timedelta(
+            days=min(LOOKBACK_DAYS, self.retention_days - 1)
+        )
+        last = today + timedelta(days=self.days_ahead)
+        days = {
+            first + timedelta(days=offset)
+            for offset in range((last - first).days + 1)
+        }
+
+        if default is not None:
+            stray = set(
+                await self.model.get_partition_days(table, default, key)
+            )
+            if stray:
+                self.logger.error(
+                    '%s holds rows of %d days without a partition, from %s '
+                    'to %s, moving them to their partitions',
+                    default,
+                    len(stray),
+                    min(stray),
+                    max(stray)
+                )
+            days |= stray
+
+        created = set()
+        for day in sorted(days):
+            name = partition_name(table, day)
+            if name in partitions:
+                continue
+
+            try:
+                moved = await self.model.create_partition(
+                    table,
+                    name,
+                    day,
+                    day + timedelta(days=1),
+                    key,
+                    default
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred creating partition {name}: {err}'
+                )
+                continue
+
+            created.add(name)
+            if moved:
+                metrics.PARTITION_DEFAULT_ROWS.labels(table).inc(moved)
+                self.logger.info(
+                    'Created partition %s with %d rows moved from %s',
+                    name,
+                    moved,
+                    default
+                )
+            else:
+                self.logger.info('Created partition %s', name)
+
+        return created
+
+    async def _expire_partitions(self, table, partitions, today):
+        oldest = today - timedelta(days=self.retention_days - 1)
+
+        for name in sorted(partitions):
+            match = _PARTITION_NAME.search(name)
+            if match is None:
+                continue
+
+            day = datetime.strptime(match.group(1), '%Y%m%d').date()
+            if day >= oldest:
+                continue
+
+            await self.model.detach_partition(table, name, self.drop_expired)
+            self.logger.info(
+                '%s partition %s',
+                'Dropped' if self.drop_expired else 'Detached',
+                name
+            )
@@ -0,0 +1,227 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import math
+from collections import defaultdict
+
+from sento_crawler.trends import geocode_string
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def distance_km(lon1, lat1, lon2, lat2):
+    """Great-circle distance between two points, in kilometres."""
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1))
+
+
+def circle_overlap(trend, other):
+    """Intersection over union of the search circles of two trends, 1 for
+    the same circle and 0 for disjoint ones.
+
+    Parameters
+    ----------
+    trend : dict
+        Trend returned by ``TrendFeed.get_trends``.
+    other : dict
+        Another trend returned by ``TrendFeed.get_trends``.
+
+    Returns
+    -------
+    float
+        Area shared by both circles divided by the area they cover.
+    """
+
+    r1 = trend['radius_km']
+    r2 = other['radius_km']
+    d = distance_km(
+        trend['longitude'],
+        trend['latitude'],
+        other['longitude'],
+        other['latitude']
+    )
+
+    if r1 <= 0 or r2 <= 0 or d >= r1 + r2:
+        return 0.
+
+    if d <= abs(r1 - r2):
+        intersection = math.pi * min(r1, r2) ** 2
+    else:
+        intersection = (
+            r1 ** 2 * math.acos((d ** 2 + r1 ** 2 - r2 ** 2) / (2 * d * r1))
+            + r2 ** 2 * math.acos((d ** 2 + r2 ** 2 - r1 ** 2) / (2 * d * r2))
+            - math.sqrt(
+                (-d + r1 + r2) * (d + r1 - r2) * (d - r1 + r2) * (d + r1 + r2)
+            ) / 2
+        )
+
+    return intersection / (math.pi * (r1 ** 2 + r2 ** 2) - intersection)
+
+
+def enclosing_circle(trends):
+    """Returns the longitude, latitude and radius in kilometres of a circle
+    covering the search circles of every trend.
+
+    The circles are merged one by one on a plane tangent to the first one,
+    which is accurate enough for circles of a few hundred kilometres.
+    """
+
+    lon0 = trends[0]['longitude']
+    lat0 = trends[0]['latitude']
+    km_per_degree = EARTH_RADIUS_KM * math.pi / 180
+    km_per_lon_degree = km_per_degree * math.cos(math.radians(lat0))
+
+    x, y, r = 0., 0., trends[0]['radius_km']
+    for trend in trends[1:]:
+        x2 = (trend['longitude'] - lon0) * km_per_lon_degree
+        y2 = (trend['latitude'] - lat0) * km_per_degree
+        r2 = trend['radius_km']
+        d = math.hypot(x2 - x, y2 - y)
+
+        if d + r2 <= r:
+            continue
+        if d + r <= r2:
+            x, y, r = x2, y2, r2
+            continue
+
+        merged = (d + r + r2) / 2
+        x += (x2 - x) * (merged - r) / d
+        y += (y2 - y) * (merged - r) / d
+        r = merged
+
+    return (
+        lon0 + x / km_per_lon_degree,
+        lat0 + y / km_per_degree,
+        # Rounded up so the rounding never leaves a member circle out
+        math.ceil(r * 1000) / 1000
+    )
+
+
+class FanOutPlanner:
+    """Groups the locations where the same topic is trending whose search
+    circles mostly overlap, so their tweets are extracted with a single
+    search and then assigned to each location.
+
+    Parameters
+    ----------
+    min_overlap : float
+        Minimum intersection over union of the search circle of a location
+        with the circle of the location leading the group, between 0 and 1.
+    """
+
+    def __init__(self, min_overlap):
+        self.min_overlap = min_overlap
+
+    def plan(self, due_trends, relevant_trends):
+        """Groups each due trend with the other locations of its topic.
+
+        The relevant trends not due yet are added to the groups as well,
+        since crawling them with the group costs no extra request.
+
+        Parameters
+        ----------
+        due_trends : list of tuple
+            Trends returned by ``TrendPrioritizer.due`` and their scores,
+            highest scores first.
+        relevant_trends : list of dict
+            Trends returned by ``TrendFeed.get_trends``.
+
+        Returns
+        -------
+        list of tuple
+            The searches to run and their scores, highest scores first.
+            The searches grouping several locations are copies of the
+            leading trend with the enclosing circle and a ``members`` list
+            holding the grouped trends.
+        """
+
+        by_topic = defaultdict(list)
+        for trend in relevant_trends:
+            by_topic[trend.get('id')].append(trend)
+
+        grouped = set()
+        searches = []
+        for trend, score in due_trends:
+            key = (trend.get('id'), trend.get('woeid'))
+            if key in grouped:
+                continue
+            grouped.add(key)
+
+            members = [trend]
+            for other in by_topic[trend.get('id')]:
+                other_key = (other.get('id'), other.get('woeid'))
+                if (other_key not in grouped
+                        and circle_overlap(trend, other) >= self.min_overlap):
+                    grouped.add(other_key)
+                    members.append(other)
+
+            if len(members) == 1:
+                searches.append((trend, score))
+                continue
+
+            longitude, latitude, radius_km = enclosing_circle(members)
+            searches.append((
+                dict(
+                    trend,
+                    longitude=longitude,
+                    latitude=latitude,
+                    radius_km=radius_km,
+                    geocode=geocode_string(latitude, longitude, radius_km),
+                    members=members
+                ),
+                score
+            ))
+
+        return searches
+
+    @staticmethod
+    def assign(records, members):
+        """Splits the statuses found by a grouped search among its members.
+
+        The statuses with a location are assigned to the members whose
+        search circle contains it. Twitter also matches statuses by the
+        location in their author's profile, which is not available, so
+        the statuses without a location are assigned to every member.
+
+        Parameters
+        ----------
+        records : list of StatusRecord
+            Statuses found by the search.
+        members : list of dict
+            Trends grouped in the search.
+
+        Returns
+        -------
+        list of list of StatusRecord
+            The statuses assigned to each member, in the same order.
+        """
+
+        assigned = [[] for _ in members]
+        for record in records:
+            for member, member_records in zip(members, assigned):
+                if record.point is None or distance_km(
+                    record.point[0],
+                    record.point[1],
+                    member['longitude'],
+                    member['latitude']
+                ) <= member['radius_km']:
+                    member_records.append(record)
+
+        return assigned
@@ -0,0 +1,211 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import itertools
+import random
+import time
+
+import aiohttp
+from peony import exceptions, utils
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+from sento_crawler.settings import get_config
+
+_breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to an upstream service that has
+    been failing."""
+
+
+class CircuitBreaker:
+    """Stops the requests to an upstream service after several consecutive
+    transient failures, until a request made after a pause succeeds.
+
+    Parameters
+    ----------
+    name : str
+        Name of the upstream service.
+    failure_threshold : int
+        Consecutive failures opening the circuit.
+    reset_timeout : float
+        Seconds the circuit stays open before a single request is let
+        through to probe the service.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.logger = get_logger()
+        self.failures = 0
+        self._opened_at = None
+        self._open = metrics.CIRCUIT_OPEN.labels(name)
+
+    def check(self):
+        """Raises ``CircuitOpenError`` while the circuit is open."""
+        if self._opened_at is None:
+            return
+
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            raise CircuitOpenError(f'Requests to {self.name} are paused')
+
+        # This request probes the service, the rest wait for another pause
+        self._opened_at = time.monotonic()
+
+    def success(self):
+        if self._opened_at is not None:
+            self.logger.info('Requests to %s resumed', self.name)
+        self.failures = 0
+        self._opened_at = None
+        self._open.set(0)
+
+    def failure(self):
+        self.failures += 1
+        if self.failures < self.failure_threshold:
+            return
+
+        if self._opened_at is None:
+            self.logger.warning(
+                'Pausing requests to %s for %d seconds after %d failures',
+                self.name,
+                self.reset_timeout,
+                self.failures
+            )
+        self._opened_at = time.monotonic()
+        self._open.set(1)
+
+
+def get_breaker(name):
+    """Returns the circuit breaker of an upstream service."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        config = get_config()
+        breaker = _breakers[name] = CircuitBreaker(
+            name,
+            config.RESILIENCE_BREAKER_FAILURES,
+            config.RESILIENCE_BREAKER_RESET_TIMEOUT
+        )
+    return breaker
+
+
+def is_transient(err):
+    """Tells if a request failed because of an error that may not happen
+    again: timeouts, connection errors and server errors."""
+    if isinstance(err, (asyncio.TimeoutError, TimeoutError,
+                        aiohttp.ClientConnectionError)):
+        return True
+
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status >= 500 or err.status == 429
+
+    if isinstance(err, exceptions.PeonyException):
+        return getattr(err.response, 'status', 0) >= 500
+
+    return False
+
+
+def backoff_delay(attempt):
+    """Seconds to wait before retrying a request that failed the given
+    number of times minus one, drawn uniformly up to an exponentially
+    growing maximum so the retries of concurrent requests are spread."""
+    config = get_config()
+    return random.uniform(0, min(
+        config.RESILIENCE_RETRY_BASE_DELAY * 2 ** attempt,
+        config.RESILIENCE_RETRY_MAX_DELAY
+    ))
+
+
+async def call_with_retries(func, timeout, breaker):
+    """Calls a coroutine function making a request, retrying it on
+    transient errors.
+
+    Parameters
+    ----------
+    func : callable
+        Coroutine function making the request, called on every attempt.
+    timeout : float
+        Seconds each attempt may take.
+    breaker : CircuitBreaker
+        Circuit breaker of the requested service.
+
+    Returns
+    -------
+    object
+        The value returned by ``func``.
+    """
+
+    retries = get_config().RESILIENCE_RETRIES
+
+    for attempt in itertools.count():
+        breaker.check()
+        try:
+            result = await asyncio.wait_for(func(), timeout)
+        except Exception as err:
+            if not is_transient(err):
+                raise
+            breaker.failure()
+            if attempt >= retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+        else:
+            breaker.success()
+            return result
+
+
+class TwitterErrorHandler(utils.ErrorHandler):
+    """Peony error handler retrying the requests to the Twitter API that
+    failed with a transient error a limited number of times. Rate limits
+    are waited for like peony's default handler does.
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.attempts = 0
+
+    @utils.ErrorHandler.handle(exceptions.RateLimitExceeded)
+    async def handle_rate_limits(self, exception, url):
+        delay = int(exception.reset_in) + 1
+        get_logger().warning(
+            'Sleeping for %ds, rate limit exceeded on %s',
+            delay,
+            url
+        )
+        await asyncio.sleep(delay)
+        return utils.ErrorHandler.RETRY
+
+    @utils.ErrorHandler.handle(asyncio.TimeoutError, TimeoutError,
+                               aiohttp.ClientConnectionError,
+                               exceptions.PeonyException)
+    async def handle_transient_error(self, exception, url):
+        if (not is_transient(exception)
+                or self.attempts >= get_config().RESILIENCE_RETRIES):
+            return utils.ErrorHandler.RAISE
+
+        delay = backoff_delay(self.attempts)
+        self.attempts += 1
+        get_logger().info(
+            'Request to %s failed (%s), retrying in %.1f seconds',
+            url,
+            type(exception).__name__,
+            delay
+        )
+
+        await asyncio.sleep(delay)
+        return utils.ErrorHandler.RETRY
@@ -0,0 +1,621 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import itertools
+import math
+import time
+from datetime import datetime
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+
+# Trends whose weight is 0 are revisited after this many seconds
+MAX_REVISIT = 12 * 60 * 60
+
+
+class RateLimiter:
+    """Token bucket for a Twitter endpoint, the tokens are synchronised
+    with the ``x-rate-limit-remaining`` and ``x-rate-limit-reset`` headers
+    of the responses.
+
+    Parameters
+    ----------
+    limit : int
+        Requests allowed in each rate limit window.
+    window : int
+        Duration of the rate limit window in seconds.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset = time.time() + window
+        self.in_flight = 0
+
+    def available(self):
+        """Number of requests that can be made right now."""
+        now = time.time()
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.window
+        return self.remaining
+
+    def try_acquire(self):
+        """Takes a token if there is one left, without waiting.
+
+        Returns
+        -------
+        bool
+            Whether the token was taken.
+        """
+
+        if self.available() <= 0:
+            return False
+
+        self.remaining -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self, headers=None):
+        """Finishes a request started after ``try_acquire``.
+
+        Parameters
+        ----------
+        headers : dict, optional
+            Headers of the response, if any.
+        """
+
+        self.in_flight -= 1
+
+        if not headers:
+            return
+
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+
+        if remaining is not None and reset is not None:
+            # The tokens taken by requests still in flight are not
+            # reflected in the headers yet
+            self.remaining = max(int(remaining) - self.in_flight, 0)
+            self.reset = int(reset)
+
+
+class CredentialPool:
+    """Spreads the requests to a rate limited endpoint among clients
+    authenticated with different credentials, each request is sent through
+    the client with the most remaining quota.
+
+    Parameters
+    ----------
+    clients : list of PeonyClient
+        Clients, one per credential.
+    limit : int
+        Requests allowed to each credential in each rate limit window.
+    window : int
+        Duration of the rate limit window in seconds.
+    """
+
+    def __init__(self, clients, limit, window):
+        self.logger = get_logger()
+        self.clients = list(clients)
+        self.limiters = [RateLimiter(limit, window) for _ in self.clients]
+        self._lock = asyncio.Lock()
+        self._requests = [
+            metrics.CREDENTIAL_REQUESTS.labels(str(idx))
+            for idx in range(len(self.clients))
+        ]
+        self._remaining = [
+            metrics.CREDENTIAL_QUOTA_REMAINING.labels(str(idx))
+            for idx in range(len(self.clients))
+        ]
+
+    async def acquire(self):
+        """Waits until a credential has quota left and takes a token from
+        the one with the most.
+
+        Returns
+        -------
+        int
+            Position of the credential, its client is in ``clients``.
+        """
+
+        async with self._lock:
+            while True:
+                idx = max(
+                    range(len(self.limiters)),
+                    key=lambda i: self.limiters[i].available()
+                )
+                if self.limiters[idx].try_acquire():
+                    self._requests[idx].inc()
+                    self._remaining[idx].set(self.limiters[idx].remaining)
+                    return idx
+
+                delay = min(_.reset for _ in self.limiters) - time.time() + 1
+                self.logger.info(
+                    'Rate limit budget of %d credentials exhausted, '
+                    'waiting %.0f seconds',
+                    len(self.limiters),
+                    delay
+                )
+                await asyncio.sleep(delay)
+
+    def release(self, idx, headers=None):
+        """Finishes a request started after ``acquire``.
+
+        Parameters
+        ----------
+        idx : int
+            Position of the credential used.
+        headers : dict, optional
+            Headers of the response, if any.
+        """
+
+        self.limiters[idx].release(headers)
+        self._remaining[idx].set(self.limiters[idx].remaining)
+
+
+class TrendScheduler:
+    """Crawls trends with a bounded pool of workers fed from a priority
+    queue, so a slow trend only delays the worker crawling it.
+
+    Parameters
+    ----------
+    crawl : coroutine function
+        Function crawling a single trend.
+    concurrency : int
+        Maximum number of trends crawled at the same time.
+    """
+
+    def __init__(self, crawl, concurrency):
+        self.logger = get_logger()
+        self.concurrency = concurrency
+        self._crawl = crawl
+        self._queue = asyncio.PriorityQueue()
+        self._counter = itertools.count()
+        self._queued = set()
+        self._workers = []
+
+    @property
+    def depth(self):
+        """Number of trends queued or being crawled."""
+        return len(self._queued)
+
+    def start(self):
+        """Starts the workers."""
+        if not self._workers:
+            self._workers = [
+                asyncio.ensure_future(self._work())
+                for _ in range(self.concurrency)
+            ]
+
+    def put(self, trend, priority=0):
+        """Queues a trend unless it is already queued or being crawled,
+        lower priorities are crawled first.
+
+        Returns
+        -------
+        bool
+            Whether the trend was queued.
+        """
+
+        key = (trend.get('id'), trend.get('woeid'))
+        if key in self._queued:
+            return False
+
+        self._queued.add(key)
+        self._queue.put_nowait((priority, next(self._counter), key, trend))
+        metrics.SCHEDULER_DEPTH.set(len(self._queued))
+        return True
+
+    async def close(self):
+        """Stops the workers, the trends being crawled are cancelled."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self):
+        while True:
+            _, _, key, trend = await self._queue.get()
+            try:
+                await self._crawl(trend)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(
+                    f'Exception ocurred crawling trend "{trend.get("id")}" '
+                    f'in {trend.get("location_name")}: {err}'
+                )
+            finally:
+                self._queued.discard(key)
+                self._queue.task_done()
+                metrics.SCHEDULER_DEPTH.set(len(self._queued))
+
+
+class TrendPrioritizer:
+    """Decides when each trend in a location has to be crawled again, the
+    trends with a better rank, a higher tweet volume and that have been
+    seen recently are revisited more often.
+
+    Parameters
+    ----------
+    rank_weight : float
+        Weight of the trend's best rank in its score.
+    volume_weight : float
+        Weight of the trend's tweet volume in its score.
+    half_life : float
+        Seconds after which the score of a trend not seen again in the
+        rankings is halved.
+    min_revisit : float
+        Seconds between visits of the trend with the highest score.
+    exploration_share : float
+        Share of the visits spread evenly among every trend regardless of
+        its score, between 0 and 1.
+    budget : float
+        Search requests per second allowed by the rate limits of every
+        credential.
+    """
+
+    def __init__(self, rank_weight, volume_weight, half_life, min_revisit,
+                 exploration_share, budget):
+        self.rank_weight = rank_weight
+        self.volume_weight = volume_weight
+        self.half_life = half_life
+        self.min_revisit = min_revisit
+        self.exploration_share = min(max(exploration_share, 0), 1)
+        self.budget = budget
+        self.requests_per_visit = 1.
+        self._next_visits = {}
+        self._intervals = {}
+        self._restored_visits = {}
+
+    def score(self, trend):
+        """Computes the score of a trend.
+
+        Parameters
+        ----------
+        trend : dict
+            Trend returned by ``TrendFeed.get_trends``.
+
+        Returns
+        -------
+        float
+            The trend's score, greater than 0.
+        """
+
+        rank_score = 1 / max(trend.get('best_rank') or 50, 1)
+        # A volume of ten million tweets scores 1
+        volume_score = math.log10(1 + (trend.get('tweet_volume') or 0)) / 7
+        recency = 0.5 ** ((trend.get('age_seconds') or 0) / self.half_life)
+
+        return (
+            (self.rank_weight * rank_score
+             + self.volume_weight * volume_score)
+            * recency
+        )
+
+    def due(self, trends):
+        """Returns the trends that have to be crawled now, the trends that
+        were never crawled are always due.
+
+        Parameters
+        ----------
+        trends : list of dict
+            Trends returned by ``TrendFeed.get_trends``.
+
+        Returns
+        -------
+        list of tuple
+            The due trends and their scores, highest scores first.
+        """
+
+        if not trends:
+            return []
+
+        now = time.monotonic()
+        scores = {
+            (trend.get('id'), trend.get('woeid')): self.score(trend)
+            for trend in trends
+        }
+        total = sum(scores.values())
+        weights = {
+            key: (
+                (1 - self.exploration_share) * score / total
+                + self.exploration_share / len(scores)
+            ) if total else 1
+            for key, score in scores.items()
+        }
+        max_weight = max(weights.values())
+        self._intervals = {
+            key: (
+                self.min_revisit * max_weight / weight
+                if weight else MAX_REVISIT
+            )
+            for key, weight in weights.items()
+        }
+
+        # The intervals are stretched evenly when visiting every trend that
+        # often would exceed the search budget, so the visits stay
+        # proportional to the weights instead of starving the lowest ones
+        rate = sum(1 / interval for interval in self._intervals.values())
+        allowed = self.budget / self.requests_per_visit
+        if rate > allowed:
+            self._intervals = {
+                key: interval * rate / allowed
+                for key, interval in self._intervals.items()
+            }
+
+        due = []
+        for trend in trends:
+            key = (trend.get('id'), trend.get('woeid'))
+            if key in self._restored_visits and key not in self._next_visits:
+                self._next_visits[key] = (
+                    self._restored_visits.pop(key) + self._intervals[key]
+                )
+            if self._next_visits.get(key, 0) <= now:
+                self._next_visits[key] = now + self._intervals[key]
+                due.append((trend, scores[key]))
+
+        # Forget the trends that are no longer relevant
+        for key in self._next_visits.keys() - scores.keys():
+            del self._next_visits[key]
+
+        due.sort(key=lambda x: x[1], reverse=True)
+        return due
+
+    def record_requests(self, requests):
+        """Updates the average of search requests made by each visit with
+        the requests of a visit that has just finished."""
+        self.requests_per_visit += 0.1 * (
+            max(requests, 1) - self.requests_per_visit
+        )
+
+    def visit(self, trend):
+        """Postpones the next visit of a trend crawled before it was due.
+
+        Parameters
+        ----------
+        trend : dict
+            Trend passed to the last call to ``due``.
+        """
+
+        key = (trend.get('id'), trend.get('woeid'))
+        interval = self._intervals.get(key)
+        if interval is not None:
+            self._next_visits[key] = time.monotonic() + interval
+
+    def restore(self, visits):
+        """Schedules the next visit of the trends crawled before a restart
+        from the time they were last crawled.
+
+        Parameters
+        ----------
+        visits : dict
+            Time of the last visit, as a naive UTC datetime, indexed by
+            topic id and WOEID.
+        """
+
+        now = time.monotonic()
+        utcnow = datetime.utcnow()
+        self._restored_visits = {
+            key: now - (utcnow - visited_at).total_seconds()
+            for key, visited_at in visits.items()
+        }
+
+    def time_until_next(self):
+        """Seconds until the next trend is due."""
+        if not self._next_visits:
+            return 0
+        return max(min(self._next_visits.values()) - time.monotonic(), 0)
+
+
+def ranking_change(previous, current):
+    """Measures how much the ranking of a location changed.
+
+    Each topic that entered the ranking counts as 1 and each topic that
+    moved counts as the positions it moved over the ranking's length.
+
+    Parameters
+    ----------
+    previous : tuple of str
+        Names of the topics in the previous ranking, best ranked first.
+    current : tuple of str
+        Names of the topics in the current ranking, best ranked first.
+
+    Returns
+    -------
+    float
+        Change between 0, for the same ranking, and 1.
+    """
+
+    if not current:
+        return 0. if not previous else 1.
+
+    positions = {name: idx for idx, name in enumerate(previous)}
+    change = 0.
+    for idx, name in enumerate(current):
+        position = positions.get(name)
+        if position is None:
+            change += 1
+        else:
+            change += abs(idx - position) / len(current)
+
+    return min(change / len(current), 1.)
+
+
+class TrendRefresher:
+    """Decides when the trends of each location are requested again. The
+    locations whose ranking changes are refreshed more often and those
+    whose ranking stays the same less often, within the rate limit of the
+    trends endpoint.
+
+    Parameters
+    ----------
+    min_interval : float
+        Minimum seconds between refreshes of a location.
+    max_interval : float
+        Seconds between refreshes of a location whose ranking does not
+        change, unless the rate limit requires longer ones.
+    fast_change : float
+        Change of a ranking, as computed by ``ranking_change``, from which
+        the refresh interval of its location is halved.
+    rate_limit : int
+        Trends requests allowed in each rate limit window.
+    rate_limit_window : int
+        Duration of the rate limit window in seconds.
+    unchanged_write_interval : float
+        Seconds after which a ranking is stored again even if it did not
+        change, 0 for storing every ranking.
+    """
+
+    def __init__(self, min_interval, max_interval, fast_change, rate_limit,
+                 rate_limit_window, unchanged_write_interval):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.fast_change = fast_change
+        self.unchanged_write_interval = unchanged_write_interval
+        self.limiter = RateLimiter(rate_limit, rate_limit_window)
+        self._intervals = {}
+        self._next_refreshes = {}
+        self._rankings = {}
+        self._written = {}
+
+    def due(self, woeids):
+        """Returns the locations whose trends have to be requested now, as
+        many as the rate limit allows, taking a token of the rate limiter
+        for each of them. The locations never refreshed are always due.
+
+        Parameters
+        ----------
+        woeids : list of int
+            WOEIDs of the locations with trends.
+
+        Returns
+        -------
+        list of int
+            The due locations, the ones waiting the longest first.
+        """
+
+        now = time.monotonic()
+        for woeid in self._next_refreshes.keys() - set(woeids):
+            self._forget(woeid)
+        # Every location counts towards the rate limit, even before its
+        # first refresh
+        for woeid in woeids:
+            self._next_refreshes.setdefault(woeid, 0)
+
+        due = sorted(
+            (woeid for woeid in woeids if self._next_refreshes[woeid] <= now),
+            key=self._next_refreshes.get
+        )
+
+        # The rest stay due until there are tokens again
+        taken = []
+        for woeid in due:
+            if not self.limiter.try_acquire():
+                break
+            self._next_refreshes[woeid] = now + self._interval(woeid)
+            taken.append(woeid)
+
+        return taken
+
+    def update(self, woeid, names):
+        """Adapts the refresh interval of a location to the change of its
+        ranking and tells if the ranking has to be stored.
+
+        Parameters
+        ----------
+        woeid : int
+            WOEID of the location, returned by the last call to ``due``.
+        names : tuple of str
+            Names of the topics just ranked in the location, best ranked
+            first.
+
+        Returns
+        -------
+        tuple of float and bool
+            The change of the ranking, 1 for the first ranking of the
+            location, and whether it has to be stored.
+        """
+
+        now = time.monotonic()
+        previous = self._rankings.get(woeid)
+        self._rankings[woeid] = names
+
+        interval = self._intervals.get(woeid, self.max_interval)
+        if previous is None:
+            change = 1.
+        else:
+            change = ranking_change(previous, names)
+            if change >= self.fast_change:
+                interval /= 2
+            elif change == 0:
+                interval *= 1.5
+        self._intervals[woeid] = min(
+            max(interval, self.min_interval),
+            self.max_interval
+        )
+        self._next_refreshes[woeid] = now + self._interval(woeid)
+
+        store = (
+            change > 0
+            or now - self._written.get(woeid, 0)
+            >= self.unchanged_write_interval
+        )
+        if store:
+            self._written[woeid] = now
+
+        return change, store
+
+    def release(self, headers=None):
+        """Finishes a request of the trends of a location returned by
+        ``due``, synchronising the rate limiter with the response's
+        headers, if any."""
+        self.limiter.release(headers)
+
+    def time_until_next(self):
+        """Seconds until the next location is due, or until the rate limit
+        window is reset if there are no tokens left."""
+        if not self._next_refreshes:
+            return self.max_interval
+
+        wait = min(self._next_refreshes.values()) - time.monotonic()
+        if self.limiter.available() <= 0:
+            wait = max(wait, self.limiter.reset - time.time())
+        return max(wait, 0)
+
+    def _interval(self, woeid):
+        interval = self._intervals.get(woeid, self.max_interval)
+
+        # The intervals are stretched evenly when refreshing every location
+        # that often would exceed the rate limit
+        rate = sum(
+            1 / self._intervals.get(other, self.max_interval)
+            for other in self._next_refreshes
+        )
+        allowed = self.limiter.limit / self.limiter.window
+        if rate > allowed:
+            interval *= rate / allowed
+
+        return interval
+
+    def _forget(self, woeid):
+        self._next_refreshes.pop(woeid, None)
+        self._intervals.pop(woeid, None)
+        self._rankings.pop(woeid, None)
+        self._written.pop(woeid, None)
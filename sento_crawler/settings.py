@@ -14,30 +14,72 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import os
+import socket
 from configparser import ConfigParser
 from pathlib import Path
 
 _config = None  # type: Config
 
+OPTIONAL_SECTIONS = (
+    'buffer',
+    'normalizer',
+    'dedup',
+    'archive',
+    'geocoder',
+    'scheduler',
+    'priority',
+    'trends',
+    'planner',
+    'sharding',
+    'metrics',
+    'resilience',
+    'http',
+    'retention',
+    'supervisor'
+)
+
 
 class Config:
-    def __init__(self):
+    def __init__(self, config_path=None):
         parser = ConfigParser()
-        config_path = (
-            Path(__file__)
-            .absolute()
-            .parents[1]
-            .joinpath('config.ini')
-        )
+        if config_path is None:
+            config_path = (
+                Path(__file__)
+                .absolute()
+                .parents[1]
+                .joinpath('config.ini')
+            )
         parser.read(config_path)
 
+        # Sections added after a config.ini was created fall back to the
+        # defaults of their keys
+        for section in OPTIONAL_SECTIONS:
+            if not parser.has_section(section):
+                parser.add_section(section)
+
         # Logging
         self.LOGGING_LEVEL = parser['logging'].get('level')
+        self.LOGGING_OUTPUT_LEVEL = parser['logging'].get(
+            'outputLevel',
+            'INFO'
+        )
         self.ASYNCIO_LOGGING_LEVEL = parser['logging'].get('asyncioLevel')
         self.PEONY_TWITTER_LOGGING_LEVEL = (
             parser['logging'].get('peonyTwitterLevel')
         )
         self.LOGGING_OUTPUT = parser['logging'].get('output')
+        self.LOGGING_FORMAT = parser['logging'].get('format', 'text')
+        self.LOGGING_CALLER_INFO = parser['logging'].getboolean(
+            'callerInfo',
+            True
+        )
+        self.LOGGING_SAMPLE_LIMIT = int(
+            parser['logging'].get('sampleLimit', 0)
+        )
+        self.LOGGING_SAMPLE_INTERVAL = float(
+            parser['logging'].get('sampleInterval', 60)
+        )
 
         # Postgres
         self.POSTGRES_HOST = parser['postgres'].get('host', 'postgres')
@@ -45,17 +87,223 @@ class Config:
         self.POSTGRES_DATABASE = parser['postgres'].get('database', 'sento')
         self.POSTGRES_USER = parser['postgres'].get('user', 'sento')
         self.POSTGRES_PASSWD = parser['postgres'].get('password', 'sento')
+        self.POSTGRES_INGEST_MODE = (
+            parser['postgres'].get('ingestMode', 'insert')
+        )
 
-        # app config
-        self.SEARCH_WOEID = int(parser['app'].get('woeid'))
+        # Statuses write-behind buffer
+        self.BUFFER_MAX_ROWS = int(parser['buffer'].get('maxRows', 1000))
+        self.BUFFER_MAX_BYTES = int(
+            parser['buffer'].get('maxBytes', 1024 * 1024)
+        )
+        self.BUFFER_MAX_DELAY = float(parser['buffer'].get('maxDelay', 5))
+        self.BUFFER_MAX_PENDING = int(
+            parser['buffer'].get('maxPending', 5000)
+        )
+        self.BUFFER_DEAD_LETTER_PATH = parser['buffer'].get(
+            'deadLetterPath',
+            'dead_statuses.jsonl'
+        )
+
+        # Statuses normalization
+        self.NORMALIZER_WORKERS = int(parser['normalizer'].get('workers', 0))
+        self.NORMALIZER_MAX_PENDING = int(
+            parser['normalizer'].get('maxPending', 8)
+        )
+
+        # Duplicated statuses filtering
+        self.DEDUP_RETWEETS = parser['dedup'].getboolean('retweets', True)
+        self.DEDUP_EXACT = parser['dedup'].getboolean('exact', True)
+        self.DEDUP_NEAR_DUPLICATES = (
+            parser['dedup'].getboolean('nearDuplicates', True)
+        )
+        self.DEDUP_WINDOW = float(parser['dedup'].get('window', 6 * 60 * 60))
+        self.DEDUP_MAX_ENTRIES = int(
+            parser['dedup'].get('maxEntries', 200000)
+        )
+        self.DEDUP_MAX_DISTANCE = int(parser['dedup'].get('maxDistance', 6))
+
+        # Raw statuses archive
+        self.ARCHIVE_ENABLED = parser['archive'].getboolean('enabled', False)
+        self.ARCHIVE_PATH = parser['archive'].get('path', 'archive')
+        self.ARCHIVE_MAX_FILE_BYTES = int(
+            parser['archive'].get('maxFileBytes', 100 * 1024 * 1024)
+        )
+        self.ARCHIVE_COMPRESSION = (
+            parser['archive'].get('compression', 'gzip')
+        )
+        self.ARCHIVE_MAX_PENDING = int(
+            parser['archive'].get('maxPending', 1000)
+        )
+
+        # Geocoder
+        self.GEOCODER_NOMINATIM_URL = parser['geocoder'].get(
+            'nominatimUrl',
+            'https://nominatim.openstreetmap.org/search'
+        )
+        self.GEOCODER_CACHE_PATH = (
+            parser['geocoder'].get('cachePath', 'geocode_cache.sqlite3')
+        )
+        self.GEOCODER_CACHE_TTL = int(
+            parser['geocoder'].get('cacheTtl', 7 * 24 * 60 * 60)
+        )
+        self.GEOCODER_SIMPLIFY_TOLERANCE = float(
+            parser['geocoder'].get('simplifyTolerance', 0.0005)
+        )
+
+        # Tweets extraction scheduling
+        self.SCHEDULER_CONCURRENCY = int(
+            parser['scheduler'].get('concurrency', 5)
+        )
+        self.SCHEDULER_MAX_PAGES_PER_VISIT = int(
+            parser['scheduler'].get('maxPagesPerVisit', 10)
+        )
+        self.SEARCH_RATE_LIMIT = int(
+            parser['scheduler'].get('searchRateLimit', 450)
+        )
+        self.SEARCH_RATE_LIMIT_WINDOW = int(
+            parser['scheduler'].get('searchRateLimitWindow', 15 * 60)
+        )
 
-        # Twitter
-        self.TWITTER_CONSUMER_API_KEY = (
-            parser['twitter'].get('consumer_api_key')
+        # Trends prioritization
+        self.PRIORITY_RANK_WEIGHT = float(
+            parser['priority'].get('rankWeight', 1)
+        )
+        self.PRIORITY_VOLUME_WEIGHT = float(
+            parser['priority'].get('volumeWeight', 1)
         )
-        self.TWITTER_CONSUMER_API_SECRET_KEY = (
+        self.PRIORITY_HALF_LIFE = float(
+            parser['priority'].get('halfLife', 2 * 60 * 60)
+        )
+        self.PRIORITY_MIN_REVISIT = float(
+            parser['priority'].get('minRevisit', 60)
+        )
+        self.PRIORITY_EXPLORATION_SHARE = float(
+            parser['priority'].get('explorationShare', 0.2)
+        )
+
+        # Refresh of the trends of each location
+        self.TRENDS_MIN_INTERVAL = float(
+            parser['trends'].get('minInterval', 2 * 60)
+        )
+        self.TRENDS_MAX_INTERVAL = float(
+            parser['trends'].get('maxInterval', 15 * 60)
+        )
+        self.TRENDS_FAST_CHANGE = float(
+            parser['trends'].get('fastChange', 0.1)
+        )
+        self.TRENDS_RATE_LIMIT = int(parser['trends'].get('rateLimit', 75))
+        self.TRENDS_RATE_LIMIT_WINDOW = int(
+            parser['trends'].get('rateLimitWindow', 15 * 60)
+        )
+        self.TRENDS_UNCHANGED_WRITE_INTERVAL = float(
+            parser['trends'].get('unchangedWriteInterval', 60 * 60)
+        )
+
+        # Searches shared by the locations of a topic
+        self.PLANNER_ENABLED = parser['planner'].getboolean('enabled', True)
+        self.PLANNER_MIN_OVERLAP = float(
+            parser['planner'].get('minOverlap', 0.75)
+        )
+
+        # Sharding among several crawler processes
+        self.SHARDING_ENABLED = parser['sharding'].getboolean('enabled', False)
+        self.SHARDING_WORKER_ID = (
+            parser['sharding'].get('workerId')
+            or f'{socket.gethostname()}-{os.getpid()}'
+        )
+        self.SHARDING_LEASE_TTL = float(
+            parser['sharding'].get('leaseTtl', 60)
+        )
+        self.SHARDING_RENEW_INTERVAL = float(
+            parser['sharding'].get('renewInterval', 15)
+        )
+
+        # Prometheus metrics
+        self.METRICS_ENABLED = parser['metrics'].getboolean('enabled', False)
+        self.METRICS_HOST = parser['metrics'].get('host', '0.0.0.0')
+        self.METRICS_PORT = int(parser['metrics'].get('port', 9180))
+
+        # Timeouts, retries and circuit breakers of the upstream services
+        self.RESILIENCE_TWITTER_TIMEOUT = float(
+            parser['resilience'].get('twitterTimeout', 30)
+        )
+        self.RESILIENCE_NOMINATIM_TIMEOUT = float(
+            parser['resilience'].get('nominatimTimeout', 10)
+        )
+        self.RESILIENCE_RETRIES = int(parser['resilience'].get('retries', 3))
+        self.RESILIENCE_RETRY_BASE_DELAY = float(
+            parser['resilience'].get('retryBaseDelay', 0.5)
+        )
+        self.RESILIENCE_RETRY_MAX_DELAY = float(
+            parser['resilience'].get('retryMaxDelay', 10)
+        )
+        self.RESILIENCE_BREAKER_FAILURES = int(
+            parser['resilience'].get('breakerFailures', 5)
+        )
+        self.RESILIENCE_BREAKER_RESET_TIMEOUT = float(
+            parser['resilience'].get('breakerResetTimeout', 60)
+        )
+
+        # HTTP connections shared by the Twitter clients and the geocoder
+        self.HTTP_LIMIT = int(parser['http'].get('limit', 100))
+        self.HTTP_LIMIT_PER_HOST = int(parser['http'].get('limitPerHost', 30))
+        self.HTTP_KEEPALIVE_TIMEOUT = float(
+            parser['http'].get('keepaliveTimeout', 60)
+        )
+        self.HTTP_DNS_CACHE_TTL = int(parser['http'].get('dnsCacheTtl', 300))
+        self.HTTP_GZIP = parser['http'].getboolean('gzip', True)
+
+        # Daily partitions of the statuses and rankings
+        self.RETENTION_ENABLED = parser['retention'].getboolean(
+            'enabled',
+            False
+        )
+        self.RETENTION_DAYS = int(parser['retention'].get('days', 30))
+        self.RETENTION_DAYS_AHEAD = int(
+            parser['retention'].get('daysAhead', 3)
+        )
+        self.RETENTION_DROP_EXPIRED = parser['retention'].getboolean(
+            'dropExpired',
+            False
+        )
+        self.RETENTION_INTERVAL = float(
+            parser['retention'].get('interval', 60 * 60)
+        )
+
+        # Tasks supervision
+        self.SUPERVISOR_INITIAL_BACKOFF = float(
+            parser['supervisor'].get('initialBackoff', 1)
+        )
+        self.SUPERVISOR_MAX_BACKOFF = float(
+            parser['supervisor'].get('maxBackoff', 5 * 60)
+        )
+        self.SUPERVISOR_STATE_INTERVAL = float(
+            parser['supervisor'].get('stateInterval', 30)
+        )
+
+        # app config
+        self.SEARCH_WOEIDS = [
+            int(woeid) for woeid in _split_list(parser['app'].get('woeid'))
+        ]
+        if not self.SEARCH_WOEIDS:
+            raise ValueError('At least one WOEID must be set.')
+
+        # Twitter, each API key is paired with the secret in its position
+        api_keys = _split_list(parser['twitter'].get('consumer_api_key'))
+        api_secret_keys = _split_list(
             parser['twitter'].get('consumer_api_secret_key')
         )
+        if not api_keys or len(api_keys) != len(api_secret_keys):
+            raise ValueError(
+                'Each Twitter API key must have its API secret key.'
+            )
+        self.TWITTER_CREDENTIALS = list(zip(api_keys, api_secret_keys))
+
+
+def _split_list(value):
+    # Comma separated values, e.g. "a, b"
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
 
 
 def get_config():
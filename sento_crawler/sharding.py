@@ -0,0 +1,203 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import math
+import time
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+from sento_crawler.trends import RELEVANCE_WINDOW
+
+# First key of the advisory locks taken for leading the trends extraction
+# of a country, the second key is the country's WOEID
+TRENDS_LOCK_CLASS = 5311
+
+
+class LeaseManager:
+    """Divides the work units, a trend in a location, among every crawler
+    process sharing the database. Each worker leases its fair share of the
+    units and renews the leases periodically, the units of a worker that
+    stops renewing them are taken over by the rest once they expire.
+
+    Parameters
+    ----------
+    model : Model
+        Model used for storing the leases.
+    worker_id : str
+        Identifier of this crawler process, unique among the workers.
+    lease_ttl : float
+        Seconds a lease is valid for after being renewed.
+    renew_interval : float
+        Seconds between lease renewals, shorter than ``lease_ttl``.
+    """
+
+    def __init__(self, model, worker_id, lease_ttl, renew_interval):
+        if renew_interval >= lease_ttl:
+            raise ValueError(
+                'The lease renewal interval must be shorter than the '
+                'lease TTL.'
+            )
+
+        self.model = model
+        self.logger = get_logger()
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.renew_interval = renew_interval
+        self.owned = set()
+        self._renewed_at = None
+        self._leader_conns = {}
+
+    def owns(self, trend):
+        """Tells if the trend's work unit is leased by this worker."""
+        return (trend.get('id'), trend.get('woeid')) in self.owned
+
+    async def renew(self, units):
+        """Registers the known units, renews the leases held and claims or
+        frees units until this worker holds its fair share.
+
+        Parameters
+        ----------
+        units : iterable of tuple
+            Topic id and WOEID of the relevant trends known by the worker.
+
+        Returns
+        -------
+        dict
+            Checkpointed since_id of the units claimed in this renewal.
+        """
+
+        units = set(units)
+        started = time.monotonic()
+        owned, workers, total = await self.model.renew_leases(
+            self.worker_id,
+            units,
+            self.lease_ttl
+        )
+
+        # The trends no longer relevant are forgotten by their owner, the
+        # units not known locally may have been ranked by other crawlers
+        unknown = owned - units
+        if unknown:
+            stale = await self.model.drop_leases(
+                self.worker_id,
+                unknown,
+                RELEVANCE_WINDOW
+            )
+            owned -= stale
+            total -= len(stale)
+
+        share = math.ceil(total / max(workers, 1))
+        claimed = {}
+        released = []
+
+        if len(owned) > share:
+            released = sorted(owned)[share:]
+            await self.model.release_leases(self.worker_id, released)
+            owned.difference_update(released)
+        elif len(owned) < share:
+            claimed = await self.model.claim_leases(
+                self.worker_id,
+                share - len(owned),
+                self.lease_ttl
+            )
+            owned.update(claimed)
+
+        if claimed or released:
+            self.logger.info(
+                'Claimed %d and released %d work units, %d of %d units '
+                'leased among %d workers',
+                len(claimed),
+                len(released),
+                len(owned),
+                total,
+                workers
+            )
+
+        self.owned = owned
+        self._renewed_at = started
+        metrics.LEASES_OWNED.set(len(owned))
+
+        return claimed
+
+    def expire(self):
+        """Forgets the leased units when the renewals have failed for longer
+        than ``lease_ttl``, as the rest of workers may have taken them over.
+
+        Returns
+        -------
+        bool
+            Whether the units were forgotten.
+        """
+
+        if not self.owned:
+            return False
+        if time.monotonic() - self._renewed_at < self.lease_ttl:
+            return False
+
+        self.logger.warning(
+            'The leases of %d work units were not renewed within their '
+            'TTL, not crawling them until the next renewal',
+            len(self.owned)
+        )
+        self.owned = set()
+        metrics.LEASES_OWNED.set(0)
+
+        return True
+
+    async def lead_trends(self, woeid):
+        """Tells if this worker extracts the trends of the country, taking
+        the leadership when no other worker holds it.
+
+        Parameters
+        ----------
+        woeid : int
+            The country's WOEID.
+        """
+
+        conn = self._leader_conns.get(woeid)
+        if conn is not None:
+            try:
+                await conn.fetchval('SELECT 1')
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                # The lock was lost along with the session
+                self.logger.warning(
+                    f'Exception ocurred checking the trends leadership of '
+                    f'{woeid}: {err}'
+                )
+                del self._leader_conns[woeid]
+                await self.model.release_advisory_lock(conn)
+
+        conn = await self.model.try_advisory_lock((TRENDS_LOCK_CLASS, woeid))
+        if conn is None:
+            return False
+
+        self._leader_conns[woeid] = conn
+        self.logger.info('Leading the trends extraction of %d', woeid)
+        return True
+
+    async def close(self):
+        """Gives up the trends leadership and frees every leased unit."""
+        for conn in self._leader_conns.values():
+            await self.model.release_advisory_lock(conn)
+        self._leader_conns = {}
+
+        await self.model.remove_worker(self.worker_id)
+        self.owned = set()
+        metrics.LEASES_OWNED.set(0)
@@ -0,0 +1,67 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import functools
+import time
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+from sento_crawler.settings import get_config
+
+
+def supervised(func):
+    """Decorator restarting a task's coroutine function when it fails,
+    waiting an exponentially growing time between consecutive failures.
+
+    The wait starts over once the task runs for longer than the maximum
+    wait without failing. Cancelling the task stops it for good.
+    """
+
+    restarts = metrics.TASK_RESTARTS.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        config = get_config()
+        logger = get_logger()
+        backoff = config.SUPERVISOR_INITIAL_BACKOFF
+
+        while True:
+            start = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                # Still an Exception before Python 3.8, the task is stopped
+                raise
+            except Exception as err:
+                logger.error(
+                    f'Exception ocurred in {func.__name__} task: {err}'
+                )
+
+            if time.monotonic() - start > config.SUPERVISOR_MAX_BACKOFF:
+                backoff = config.SUPERVISOR_INITIAL_BACKOFF
+
+            logger.info(
+                'Restarting %s task in %.1f seconds',
+                func.__name__,
+                backoff
+            )
+            restarts.inc()
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, config.SUPERVISOR_MAX_BACKOFF)
+
+    return wrapper
@@ -0,0 +1,147 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from collections import Counter
+
+import aiohttp
+
+from sento_crawler import metrics
+from sento_crawler.logger import get_logger
+from sento_crawler.settings import get_config
+
+_session = None  # type: aiohttp.ClientSession
+
+# Totals since the session was created, logged when it is closed
+_stats = Counter()
+
+
+def _get_host(trace_config_ctx):
+    return getattr(trace_config_ctx, 'host', None) or 'unknown'
+
+
+async def _on_request_start(session, trace_config_ctx, params):
+    # The context is shared by the callbacks of a single request
+    trace_config_ctx.host = params.url.host
+
+
+async def _on_request_end(session, trace_config_ctx, params):
+    encoding = params.response.headers.get('Content-Encoding', 'identity')
+    metrics.HTTP_RESPONSES.labels(_get_host(trace_config_ctx), encoding).inc()
+    _stats['responses'] += 1
+    _stats[f'responses_{encoding}'] += 1
+
+
+async def _on_connection_create_end(session, trace_config_ctx, params):
+    metrics.HTTP_CONNECTIONS.labels(_get_host(trace_config_ctx), 'new').inc()
+    _stats['connections_new'] += 1
+
+
+async def _on_connection_reuseconn(session, trace_config_ctx, params):
+    metrics.HTTP_CONNECTIONS.labels(
+        _get_host(trace_config_ctx),
+        'reused'
+    ).inc()
+    _stats['connections_reused'] += 1
+
+
+async def _on_dns_cache_hit(session, trace_config_ctx, params):
+    metrics.HTTP_DNS_LOOKUPS.labels(params.host, 'cached').inc()
+    _stats['dns_cached'] += 1
+
+
+async def _on_dns_cache_miss(session, trace_config_ctx, params):
+    metrics.HTTP_DNS_LOOKUPS.labels(params.host, 'resolved').inc()
+    _stats['dns_resolved'] += 1
+
+
+def _create_trace_config():
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace_config.on_dns_cache_hit.append(_on_dns_cache_hit)
+    trace_config.on_dns_cache_miss.append(_on_dns_cache_miss)
+    return trace_config
+
+
+def get_session():
+    """Returns the HTTP session shared by the Twitter clients and the
+    geocoder, creating it on the first call.
+
+    Its connector keeps the connections and the resolved addresses of each
+    host, so the DNS resolutions and TLS handshakes are made once and then
+    reused by every request to the same host. It must be called from a
+    coroutine.
+
+    Returns
+    -------
+    aiohttp.ClientSession
+        The shared session, closed with ``close_session``.
+    """
+
+    global _session
+    if _session is None or _session.closed:
+        config = get_config()
+
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_LIMIT,
+            limit_per_host=config.HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=config.HTTP_DNS_CACHE_TTL
+        )
+
+        # aiohttp asks for gzip or deflate responses unless its automatic
+        # Accept-Encoding header is skipped
+        skip_auto_headers = (
+            () if config.HTTP_GZIP else ('Accept-Encoding',)
+        )
+
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            skip_auto_headers=skip_auto_headers,
+            trace_configs=[_create_trace_config()]
+        )
+    return _session
+
+
+def get_stats():
+    """Returns the number of responses, of new and reused connections and
+    of resolved and cached DNS lookups since the session was created."""
+    return dict(_stats)
+
+
+async def close_session():
+    """Closes the shared session and logs its connection reuse."""
+    global _session
+    if _session is None:
+        return
+
+    await _session.close()
+    _session = None
+
+    connections = _stats['connections_new'] + _stats['connections_reused']
+    get_logger().info(
+        'HTTP transport closed after %d responses, %d of %d connections '
+        'reused and %d DNS resolutions',
+        _stats['responses'],
+        _stats['connections_reused'],
+        connections,
+        _stats['dns_resolved'],
+        extra={'summary': 'http', **_stats}
+    )
+    _stats.clear()
@@ -0,0 +1,228 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from sento_crawler.logger import get_logger
+
+# Trends are crawled while they have been ranked within this many seconds
+RELEVANCE_WINDOW = 12 * 60 * 60
+
+# Seconds before the newest ranking loaded that are read again by the next
+# load, covering the rankings committed late by other crawlers
+LOAD_OVERLAP = 5 * 60
+
+
+def geocode_string(latitude, longitude, radius_km):
+    """Formats a search circle as the ``geocode`` parameter of Twitter's
+    search."""
+    return f'{latitude},{longitude},{radius_km}km'
+
+
+class TrendFeed:
+    """In-memory view of the trends ranked recently in each location, it is
+    fed directly by the trends extraction and read by the tweets extraction.
+
+    Parameters
+    ----------
+    model : Model
+        Model used for loading the recent rankings and the locations.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.logger = get_logger()
+        self._trends = {}
+        self._locations = {}
+        self._allowed = None
+        self._loaded_at = None
+        self._updated = asyncio.Event()
+
+    async def load(self):
+        """Loads the trends ranked within the relevance window, or since
+        the newest ranking of the previous loads."""
+        since = self._loaded_at or (
+            datetime.utcnow() - timedelta(seconds=RELEVANCE_WINDOW)
+        )
+        rankings = await self.model.get_rankings_since(since)
+
+        # The stored timestamps are followed instead of the local clock,
+        # which may be ahead of the clocks of the crawlers storing them
+        if rankings:
+            self._loaded_at = max(
+                ranking['last_seen'] for ranking in rankings
+            ) - timedelta(seconds=LOAD_OVERLAP)
+
+        for ranking in rankings:
+            self._add(
+                ranking['id'],
+                ranking['query_str'],
+                ranking['woeid'],
+                ranking['best_rank'],
+                ranking['tweet_volume'],
+                ranking['last_seen'].replace(tzinfo=timezone.utc).timestamp()
+            )
+
+        await self._load_locations()
+        self._updated.set()
+
+        self.logger.debug(
+            'Loaded %d rankings, %d recent trends',
+            len(rankings),
+            len(self._trends)
+        )
+
+    async def publish(self, trends_by_location):
+        """Adds the trends that have just been stored.
+
+        Parameters
+        ----------
+        trends_by_location : dict
+            Trends lists from twitter indexed by their location's WOEID.
+        """
+
+        now = time.time()
+        for woeid, trends in trends_by_location.items():
+            for idx, trend in enumerate(trends):
+                self._add(
+                    trend.name,
+                    trend.query,
+                    woeid,
+                    idx + 1,
+                    trend.tweet_volume,
+                    now
+                )
+
+        await self._load_locations()
+        self._updated.set()
+
+    async def get_trends(self):
+        """Returns the relevant trends whose location is known, waiting
+        until there is at least one.
+
+        Returns
+        -------
+        list of dict
+            Twitter and geospatial data of each trend.
+        """
+
+        while True:
+            self._expire()
+            self._updated.clear()
+
+            trends = [
+                dict(
+                    trend,
+                    age_seconds=time.time() - trend['last_seen'],
+                    **self._locations[trend['woeid']]
+                )
+                for key, trend in self._trends.items()
+                if trend['woeid'] in self._locations
+                and (self._allowed is None or key in self._allowed)
+            ]
+
+            if trends:
+                return trends
+
+            await self._updated.wait()
+
+    async def refresh_locations(self):
+        """Loads the locations stored since the last load, making their
+        trends available."""
+        await self._load_locations()
+        self._updated.set()
+
+    def get_work_units(self):
+        """Returns the topic id and WOEID of the relevant trends whose
+        location is known."""
+        self._expire()
+        return [key for key in self._trends if key[1] in self._locations]
+
+    def restrict(self, keys):
+        """Limits the trends returned by ``get_trends`` to the given ones,
+        ``None`` removes the limit.
+
+        Parameters
+        ----------
+        keys : iterable of tuple or None
+            Topic id and WOEID of the allowed trends.
+        """
+
+        self._allowed = None if keys is None else set(keys)
+        self._updated.set()
+
+    async def wait_for_update(self, timeout):
+        """Waits until new trends are published or the timeout expires."""
+        try:
+            await asyncio.wait_for(self._updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _add(self, topic_id, query_str, woeid, rank, tweet_volume, seen):
+        trend = self._trends.get((topic_id, woeid))
+
+        if trend is None:
+            self._trends[(topic_id, woeid)] = {
+                'id': topic_id,
+                'query_str': query_str,
+                'woeid': woeid,
+                'best_rank': rank,
+                'tweet_volume': tweet_volume,
+                'last_seen': seen
+            }
+            return
+
+        trend['best_rank'] = min(trend['best_rank'], rank)
+        trend['tweet_volume'] = max(
+            trend['tweet_volume'] or 0,
+            tweet_volume or 0
+        ) or None
+        trend['last_seen'] = max(trend['last_seen'], seen)
+
+    def _expire(self):
+        oldest = time.time() - RELEVANCE_WINDOW
+        expired = [
+            key for key, trend in self._trends.items()
+            if trend['last_seen'] < oldest
+        ]
+        for key in expired:
+            del self._trends[key]
+
+    async def _load_locations(self):
+        # Locations never change once stored, only the missing ones
+        # are queried
+        missing = {
+            woeid for _, woeid in self._trends
+            if woeid not in self._locations
+        }
+
+        if not missing:
+            return
+
+        for location in await self.model.get_locations_info(list(missing)):
+            self._locations[location['woeid']] = {
+                'location_name': location['location_name'],
+                'longitude': location['longitude'],
+                'latitude': location['latitude'],
+                'radius_km': location['radius_km'],
+                'geocode': geocode_string(
+                    location['latitude'],
+                    location['longitude'],
+                    location['radius_km']
+                )
+            }
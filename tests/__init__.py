@@ -0,0 +1,50 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Unit tests of the crawler, run from the repository root with
+``pipenv run python -m unittest``. They use the configuration of
+``config.example.ini`` and need neither a database nor network access.
+"""
+
+import asyncio
+from pathlib import Path
+
+from sento_crawler import settings
+
+EXAMPLE_CONFIG = Path(__file__).absolute().parents[1].joinpath(
+    'config.example.ini'
+)
+
+
+def use_config(**attributes):
+    """Makes the example configuration, with the given attributes
+    overridden, the configuration returned by ``get_config``."""
+    config = settings.Config(EXAMPLE_CONFIG)
+    # Only the failures of the tests are of interest
+    config.LOGGING_LEVEL = 'CRITICAL'
+    config.ASYNCIO_LOGGING_LEVEL = 'CRITICAL'
+    for name, value in attributes.items():
+        setattr(config, name, value)
+    settings._config = config
+    return config
+
+
+def run(coro):
+    """Runs a coroutine in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
@@ -0,0 +1,145 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from asyncpg import exceptions
+
+from sento_crawler.buffer import StatusBuffer
+from tests import run, use_config
+
+
+def _row(status_id, content='status', topic_id='#trend', woeid=1):
+    now = datetime(2019, 5, 1)
+    return (status_id, now, now, content, topic_id, woeid)
+
+
+class FakeModel:
+    """Stores the rows in memory, rejecting the batches with a NUL byte
+    like PostgreSQL does, or failing with the queued errors first."""
+
+    def __init__(self):
+        self.rows = {}
+        self.since_ids = {}
+        self.calls = 0
+        self.errors = []
+
+    async def store_statuses(self, rows, since_ids=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        if any('\x00' in row[3] for row in rows):
+            raise exceptions.CharacterNotInRepertoireError(
+                'invalid byte sequence for encoding "UTF8": 0x00'
+            )
+
+        inserted = 0
+        for row in rows:
+            if row[0] not in self.rows:
+                self.rows[row[0]] = row
+                inserted += 1
+        self.since_ids.update(since_ids or {})
+        return inserted
+
+
+class StatusBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dead_letter_path = os.path.join(self.tmp.name, 'dead.jsonl')
+        use_config(BUFFER_DEAD_LETTER_PATH=self.dead_letter_path)
+        self.model = FakeModel()
+        self.flushed = {}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _read_dead_letters(self):
+        if not os.path.exists(self.dead_letter_path):
+            return []
+        with open(self.dead_letter_path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def _flush(self, rows, since_ids=None, errors=()):
+        async def flush():
+            buffer = StatusBuffer(self.model, self.flushed.update)
+            await buffer.put(rows)
+            buffer.put_checkpoints(since_ids or {})
+            self.model.errors.extend(errors)
+            await buffer.flush()
+            return buffer, buffer.depth
+
+        return run(flush())
+
+    def test_rejected_row_is_dead_lettered(self):
+        rows = [_row(i) for i in range(1, 8)] + [_row(8, 'bad\x00text')]
+        buffer, depth = self._flush(rows, {('#trend', 1): 8})
+
+        self.assertEqual(depth, 0)
+        self.assertEqual(sorted(self.model.rows), list(range(1, 8)))
+        self.assertEqual(buffer.dead_rows, 1)
+        self.assertEqual(self.flushed, {('#trend', 1): 8})
+        self.assertEqual(self.model.since_ids, {('#trend', 1): 8})
+
+        dead_letters = self._read_dead_letters()
+        self.assertEqual([letter['id'] for letter in dead_letters], [8])
+        self.assertIn('0x00', dead_letters[0]['error'])
+
+    def test_permanently_failing_batch_is_not_retried(self):
+        rows = [_row(i) for i in range(1, 5)]
+        errors = [exceptions.CheckViolationError(
+            'no partition of relation "statuses" found for row'
+        )] * 7
+        buffer, depth = self._flush(rows, errors=errors)
+
+        # Split down to every single row, then never tried again
+        self.assertEqual(self.model.calls, 7)
+        self.assertEqual(depth, 0)
+        self.assertEqual(self.model.rows, {})
+        self.assertEqual(
+            [letter['id'] for letter in self._read_dead_letters()],
+            [1, 2, 3, 4]
+        )
+
+        run(buffer.flush())
+        self.assertEqual(self.model.calls, 7)
+
+    def test_transient_error_keeps_the_rows(self):
+        rows = [_row(i) for i in range(1, 5)]
+        error = exceptions.ConnectionDoesNotExistError('connection lost')
+
+        async def retry():
+            buffer = StatusBuffer(self.model, self.flushed.update)
+            self.model.errors.append(error)
+            await buffer.put(rows)
+            buffer.put_checkpoints({('#trend', 1): 4})
+            with self.assertRaises(exceptions.ConnectionDoesNotExistError):
+                await buffer.flush()
+            depth = buffer.depth
+            flushed = dict(self.flushed)
+            await buffer.flush()
+            return depth, flushed, buffer.depth
+
+        self.assertEqual(run(retry()), (4, {}, 0))
+        self.assertEqual(sorted(self.model.rows), [1, 2, 3, 4])
+        self.assertEqual(self.flushed, {('#trend', 1): 4})
+        self.assertEqual(self._read_dead_letters(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from sento_crawler.dedup import Deduplicator, content_fingerprint
+from sento_crawler.normalizer import NormalizerPool, StatusRecord
+from tests import run, use_config
+
+TEXTS = (
+    'Gran partido hoy en el estadio https://t.co/abc',
+    'RT @fan: Gran partido hoy en el estadio',
+    'gran partido, HOY en el estadio @club',
+    'Hoy gran partido en el estadio',
+    'Otra noticia completamente distinta sobre el tiempo',
+    '\U0001f600\U0001f600',
+)
+
+
+def _records():
+    return [
+        StatusRecord(
+            idx,
+            'Wed May 01 12:00:00 +0000 2019',
+            text,
+            ((text.find('https'), len(text)),) if 'https' in text else (),
+            None,
+            None
+        )
+        for idx, text in enumerate(TEXTS, 1)
+    ]
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def setUp(self):
+        use_config()
+
+    def _deduplicator(self, exact=True, near_duplicates=True):
+        return Deduplicator(True, exact, near_duplicates, 60, 1000, 6)
+
+    def _kept_ids(self, deduplicator, workers=0):
+        async def normalize():
+            pool = NormalizerPool(workers, 4)
+            try:
+                records = deduplicator.filter_retweets(_records(), '#t', 1)
+                return await pool.normalize(
+                    records,
+                    '#t',
+                    1,
+                    deduplicator.fingerprints
+                )
+            finally:
+                pool.close()
+
+        rows, fingerprints = run(normalize())
+        rows = deduplicator.filter_rows(rows, fingerprints, '#t', 1)
+        return [row[0] for row in rows]
+
+    def test_exact_duplicates(self):
+        kept = self._kept_ids(self._deduplicator(near_duplicates=False))
+        self.assertEqual(kept, [1, 4, 5, 6])
+
+    def test_near_duplicates(self):
+        self.assertEqual(self._kept_ids(self._deduplicator()), [1, 5, 6])
+
+    def test_fingerprints_computed_by_workers(self):
+        self.assertEqual(
+            self._kept_ids(self._deduplicator(), workers=2),
+            [1, 5, 6]
+        )
+
+    def test_no_fingerprints_without_content_filters(self):
+        deduplicator = self._deduplicator(False, False)
+        self.assertFalse(deduplicator.fingerprints)
+        self.assertEqual(self._kept_ids(deduplicator), [1, 2, 3, 4, 5, 6])
+
+    def test_fingerprint_without_words(self):
+        self.assertIsNone(content_fingerprint('\U0001f600 '))
+        self.assertEqual(
+            content_fingerprint('RT @a: Hola @b mundo'),
+            content_fingerprint('hola, MUNDO')
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from sento_crawler.logger import set_caller_lookup
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class CallerLookupTest(unittest.TestCase):
+    def _log(self, logger):
+        handler = _Records()
+        logger.addHandler(handler)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        try:
+            logger.info('Message')
+        finally:
+            logger.removeHandler(handler)
+        return handler.records[0]
+
+    def test_only_the_given_logger_skips_the_lookup(self):
+        crawler_logger = logging.getLogger('sento-crawler-test')
+        other_logger = logging.getLogger('sento-crawler-test-other')
+
+        set_caller_lookup(crawler_logger, False)
+        try:
+            self.assertEqual(
+                self._log(crawler_logger).funcName,
+                '(unknown function)'
+            )
+            self.assertEqual(
+                self._log(other_logger).funcName,
+                '_log'
+            )
+        finally:
+            set_caller_lookup(crawler_logger, True)
+
+        self.assertEqual(self._log(crawler_logger).funcName, '_log')
+
+
+if __name__ == '__main__':
+    unittest.main()
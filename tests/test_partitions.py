@@ -0,0 +1,115 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+from datetime import datetime, timedelta
+
+from sento_crawler import metrics
+from sento_crawler.partitions import PartitionManager, partition_name
+from tests import run, use_config
+
+
+class FakeModel:
+    """Keeps the days of the rows of each partition of the statuses, the
+    rankings are not partitioned."""
+
+    def __init__(self, default_days=None):
+        self.partitions = {}
+        self.default = None
+        if default_days is not None:
+            self.default = 'statuses_default'
+            self.partitions[self.default] = list(default_days)
+        self.detached = []
+
+    async def get_partitions(self, table):
+        if table != 'data.statuses':
+            return None
+        return list(self.partitions)
+
+    async def get_default_partition(self, table):
+        return self.default
+
+    async def get_partition_days(self, table, name, key):
+        return sorted(set(self.partitions[name]))
+
+    async def create_partition(self, table, name, start, end, key=None,
+                               default=None):
+        stored = self.partitions.get(self.default, [])
+        moved = [day for day in stored if start <= day < end]
+        if moved and default is None:
+            raise ValueError(
+                f'updated partition constraint for default partition '
+                f'"{self.default}" would be violated by some row'
+            )
+
+        self.partitions[name] = moved
+        if moved:
+            self.partitions[default] = [
+                day for day in stored if not start <= day < end
+            ]
+        return len(moved)
+
+    async def detach_partition(self, table, name, drop):
+        self.detached.append((name, drop, self.partitions.pop(name)))
+
+
+class PartitionManagerTest(unittest.TestCase):
+    def setUp(self):
+        use_config()
+        self.today = datetime.utcnow().date()
+        self.moved = metrics.PARTITION_DEFAULT_ROWS.labels('data.statuses')
+        self.moved.value = 0
+
+    def _day(self, offset):
+        return self.today + timedelta(days=offset)
+
+    def test_partitions_created_around_today(self):
+        model = FakeModel()
+        run(PartitionManager(model, 2, 3, True).maintain())
+
+        self.assertEqual(
+            set(model.partitions),
+            {partition_name('data.statuses', self._day(d)) for d in (
+                -2, -1, 0, 1, 2
+            )}
+        )
+        self.assertEqual(model.detached, [])
+
+    def test_default_rows_moved_to_the_created_partitions(self):
+        model = FakeModel([self._day(0), self._day(0), self._day(-1)])
+        run(PartitionManager(model, 1, 3, True).maintain())
+
+        self.assertEqual(model.partitions['statuses_default'], [])
+        self.assertEqual(
+            model.partitions[partition_name('data.statuses', self._day(0))],
+            [self._day(0), self._day(0)]
+        )
+        self.assertEqual(self.moved.value, 3)
+
+    def test_expired_default_rows_are_dropped(self):
+        old = self._day(-30)
+        model = FakeModel([old, self._day(0)])
+        run(PartitionManager(model, 1, 3, True).maintain())
+
+        self.assertEqual(model.partitions['statuses_default'], [])
+        self.assertEqual(
+            model.detached,
+            [(partition_name('data.statuses', old), True, [old])]
+        )
+        self.assertNotIn(
+            partition_name('data.statuses', old),
+            model.partitions
+        )
@@ -0,0 +1,267 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import socket
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+
+from benchmarks.fake_apis import FakeApis
+from sento_crawler.scheduler import CredentialPool, RateLimiter, TrendScheduler
+from tests import run, use_config
+
+
+def _headers(remaining, reset):
+    return {
+        'x-rate-limit-remaining': str(remaining),
+        'x-rate-limit-reset': str(int(reset))
+    }
+
+
+class _Clock:
+    """Replaces ``time.time`` and ``asyncio.sleep``, sleeping advances the
+    time right away."""
+
+    def __init__(self, now=1000.):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+    def patch(self):
+        return mock.patch.multiple(
+            'sento_crawler.scheduler',
+            time=mock.Mock(time=self.time),
+            asyncio=mock.Mock(sleep=self.sleep, Lock=asyncio.Lock)
+        )
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        use_config()
+        self.clock = _Clock()
+        patcher = self.clock.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_refills_when_window_resets(self):
+        limiter = RateLimiter(2, 60)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual(limiter.available(), 0)
+
+        self.clock.now += 59
+        self.assertEqual(limiter.available(), 0)
+        self.clock.now += 1
+        self.assertEqual(limiter.available(), 2)
+        self.assertEqual(limiter.reset, self.clock.now + 60)
+
+    def test_headers_set_remaining_and_reset(self):
+        limiter = RateLimiter(450, 900)
+        limiter.try_acquire()
+        limiter.release(_headers(10, self.clock.now + 30))
+        self.assertEqual(limiter.remaining, 10)
+        self.assertEqual(limiter.reset, self.clock.now + 30)
+
+        # The bucket refills at Twitter's reset, not its own window's
+        limiter.remaining = 0
+        self.clock.now += 30
+        self.assertEqual(limiter.available(), 450)
+
+    def test_response_without_headers_keeps_the_bucket(self):
+        limiter = RateLimiter(5, 900)
+        limiter.try_acquire()
+        limiter.release()
+        self.assertEqual((limiter.remaining, limiter.in_flight), (4, 0))
+
+    def test_pool_waits_for_reset_when_buckets_are_empty(self):
+        async def check():
+            pool = CredentialPool(['client0', 'client1'], 1, 900)
+            reset = self.clock.now + 120
+            for _ in range(2):
+                idx = await pool.acquire()
+                pool.release(idx, _headers(0, reset))
+            self.assertEqual(self.clock.sleeps, [])
+
+            idx = await pool.acquire()
+            return idx, reset
+
+        idx, reset = run(check())
+        # One second after the reset, for the clocks' difference
+        self.assertEqual(self.clock.sleeps, [121])
+        self.assertGreaterEqual(self.clock.now, reset)
+        self.assertIn(idx, (0, 1))
+
+
+class FakeApiRateLimitTest(unittest.TestCase):
+    """Searches through the credential pool against the stand-in API,
+    whose rate limit windows are a few seconds long."""
+
+    def setUp(self):
+        use_config()
+
+    def test_no_request_exceeds_the_rate_limit(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        apis = FakeApis(
+            locations=1,
+            trends_per_location=1,
+            latency=0,
+            jitter=0,
+            search_limit=3,
+            window=2
+        )
+
+        async def search(session, pool, url):
+            idx = await pool.acquire()
+            headers = None
+            try:
+                async with session.get(
+                    url,
+                    params={'q': '#trend'},
+                    headers={'Authorization': pool.clients[idx]}
+                ) as resp:
+                    headers = resp.headers
+                    return resp.status
+            finally:
+                pool.release(idx, headers)
+
+        async def check():
+            base_url = await apis.start(port=port)
+            pool = CredentialPool(['Bearer a', 'Bearer b'], 3, 2)
+            start = time.monotonic()
+            try:
+                async with aiohttp.ClientSession() as session:
+                    statuses = await asyncio.gather(*(
+                        search(
+                            session,
+                            pool,
+                            f'{base_url}/1.1/search/tweets.json'
+                        )
+                        for _ in range(9)
+                    ))
+            finally:
+                await apis.stop()
+            return statuses, time.monotonic() - start
+
+        statuses, seconds = run(check())
+        self.assertEqual(statuses, [200] * 9)
+        self.assertEqual(dict(apis.rejected), {})
+        # 6 requests fit in the first windows, the rest waited for a reset
+        self.assertGreater(seconds, 1)
+
+
+class CredentialPoolTest(unittest.TestCase):
+    def setUp(self):
+        use_config()
+
+    def _pool(self, credentials=3, limit=10):
+        return CredentialPool(
+            [f'client{idx}' for idx in range(credentials)],
+            limit,
+            900
+        )
+
+    def test_request_goes_to_credential_with_most_quota(self):
+        async def check():
+            pool = self._pool()
+            reset = time.time() + 900
+            for idx, remaining in enumerate((2, 7, 5)):
+                taken = await pool.acquire()
+                pool.release(taken, _headers(remaining, reset))
+                self.assertEqual(taken, idx)
+
+            chosen = []
+            for _ in range(4):
+                idx = await pool.acquire()
+                chosen.append(idx)
+                pool.release(
+                    idx,
+                    _headers(pool.limiters[idx].remaining, reset)
+                )
+            return pool, chosen
+
+        pool, chosen = run(check())
+        # 7, 5 and 2 remaining: 7, 6, 5 and 5 left in each step
+        self.assertEqual(chosen, [1, 1, 1, 2])
+        self.assertEqual(
+            [limiter.remaining for limiter in pool.limiters],
+            [2, 4, 4]
+        )
+
+    def test_headers_are_synced_back(self):
+        async def check():
+            pool = self._pool(credentials=1)
+            first = await pool.acquire()
+            second = await pool.acquire()
+            reset = time.time() + 300
+            # The headers do not count the request still in flight
+            pool.release(first, _headers(3, reset))
+            synced = pool.limiters[0].remaining
+            pool.release(second, _headers(2, reset))
+            return pool.limiters[0], synced, reset
+
+        limiter, synced, reset = run(check())
+        self.assertEqual(synced, 2)
+        self.assertEqual(limiter.remaining, 2)
+        self.assertEqual(limiter.reset, int(reset))
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_requests_rotate_among_credentials(self):
+        async def check():
+            pool = self._pool()
+            return [await pool.acquire() for _ in range(6)]
+
+        self.assertEqual(sorted(run(check())), [0, 0, 1, 1, 2, 2])
+
+
+class TrendSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        use_config()
+
+    def test_close_stops_workers_crawling(self):
+        async def check():
+            crawling = asyncio.Event()
+
+            async def crawl(trend):
+                crawling.set()
+                await asyncio.sleep(60)
+
+            scheduler = TrendScheduler(crawl, 2)
+            scheduler.start()
+            scheduler.put({'id': '#trend', 'woeid': 1})
+            await crawling.wait()
+
+            workers = scheduler._workers
+            await asyncio.wait_for(scheduler.close(), 1)
+            return workers
+
+        workers = run(check())
+        self.assertTrue(all(worker.cancelled() for worker in workers))
+
+
+if __name__ == '__main__':
+    unittest.main()
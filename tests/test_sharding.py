@@ -0,0 +1,93 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+from unittest import mock
+
+from sento_crawler.sharding import LeaseManager
+from tests import run, use_config
+
+
+class FakeModel:
+    """Leases every registered unit to the only worker, or fails with the
+    queued errors first."""
+
+    def __init__(self):
+        self.errors = []
+
+    async def renew_leases(self, worker_id, units, ttl):
+        if self.errors:
+            raise self.errors.pop(0)
+        return set(units), 1, len(units)
+
+
+class LeaseManagerTest(unittest.TestCase):
+    def setUp(self):
+        use_config()
+        self.now = 1000.
+        patcher = mock.patch(
+            'sento_crawler.sharding.time.monotonic',
+            lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.model = FakeModel()
+        self.manager = LeaseManager(self.model, 'worker', 30, 10)
+
+    def test_units_kept_while_renewals_fail_within_ttl(self):
+        units = {('#trend', 1), ('#other', 1)}
+        run(self.manager.renew(units))
+
+        self.model.errors.append(OSError('connection lost'))
+        self.now += 20
+        with self.assertRaises(OSError):
+            run(self.manager.renew(units))
+
+        self.assertFalse(self.manager.expire())
+        self.assertEqual(self.manager.owned, units)
+        self.assertTrue(self.manager.owns({'id': '#trend', 'woeid': 1}))
+
+    def test_units_forgotten_after_ttl_until_renewed(self):
+        units = {('#trend', 1)}
+        run(self.manager.renew(units))
+
+        for _ in range(3):
+            self.now += 10
+            self.model.errors.append(OSError('connection lost'))
+            with self.assertRaises(OSError):
+                run(self.manager.renew(units))
+
+        self.assertTrue(self.manager.expire())
+        self.assertEqual(self.manager.owned, set())
+        self.assertFalse(self.manager.owns({'id': '#trend', 'woeid': 1}))
+        self.assertFalse(self.manager.expire())
+
+        run(self.manager.renew(units))
+        self.assertEqual(self.manager.owned, units)
+
+    def test_ttl_counts_from_the_start_of_the_renewal(self):
+        units = {('#trend', 1)}
+
+        async def slow_renew(worker_id, units, ttl):
+            self.now += 5
+            return set(units), 1, len(units)
+
+        self.model.renew_leases = slow_renew
+        run(self.manager.renew(units))
+
+        self.now += 25
+        self.assertTrue(self.manager.expire())
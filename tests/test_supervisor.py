@@ -0,0 +1,75 @@
+# Copyright (C) 2019 Roberto García Calero (garcalrob@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import unittest
+
+from sento_crawler.supervisor import supervised
+from tests import run, use_config
+
+
+class SupervisedTest(unittest.TestCase):
+    def setUp(self):
+        use_config(SUPERVISOR_INITIAL_BACKOFF=0.01, SUPERVISOR_MAX_BACKOFF=1)
+
+    def test_restarts_failed_task(self):
+        calls = []
+
+        @supervised
+        async def failing():
+            calls.append(None)
+            if len(calls) < 3:
+                raise ValueError('failed')
+            return len(calls)
+
+        self.assertEqual(run(failing()), 3)
+
+    def test_cancelled_while_running(self):
+        @supervised
+        async def forever():
+            while True:
+                await asyncio.sleep(0.01)
+
+        async def cancel():
+            task = asyncio.ensure_future(forever())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.wait([task], timeout=1)
+            return task
+
+        self.assertTrue(run(cancel()).cancelled())
+
+    def test_cancelled_while_waiting_to_restart(self):
+        calls = []
+
+        @supervised
+        async def failing():
+            calls.append(None)
+            raise ValueError('failed')
+
+        async def cancel():
+            use_config(SUPERVISOR_INITIAL_BACKOFF=10)
+            task = asyncio.ensure_future(failing())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.wait([task], timeout=1)
+            return task
+
+        self.assertTrue(run(cancel()).cancelled())
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()